@@ -1,46 +1,54 @@
 import numpy as np
-from matplotlib import pyplot as plt
-import argparse
-from run import MAX_STEPS, NUM_AGENTS
+from contacts import ContactHistory
+from clusters import cluster_labels, largest_cluster, load_metrics
+from store import ExperimentStore
+from config import contacts_path, metrics_path
+from multiprocessing import Pool
 import glob
+import os
+import sys
 
 def find_clusters(graph, interval):
-    to_visit = set(range(len(graph)))
-    clusters = []
-    while len(to_visit) > 0:
-        node = to_visit.pop()
-        bfs_list = set([node,])
-        cluster = set([node,])
-        while len(bfs_list) > 0:
-            bfs_node = bfs_list.pop()
-            if bfs_node in to_visit:
-                to_visit.remove(bfs_node)
-            connected = [i for i in range(len(graph[bfs_node])) if graph[bfs_node][i] >= interval]
-            connected = [c for c in connected if c in to_visit]
-            bfs_list.update(connected)
-            cluster.update(connected)
-        clusters.append(cluster)
-    return clusters
+    i, j = np.nonzero(np.asarray(graph) >= interval)
+    labels = cluster_labels([np.stack((i, j), axis=1)], len(graph))[0]
+    clusters = {}
+    for node, label in enumerate(labels):
+        clusters.setdefault(label, set()).add(node)
+    return list(clusters.values())
 
-def main(attractive_w, repulsive_w, align_w, test_n):
-    if test_n is not None:
-        adj_mat = np.load(f'aggr_data/adj_{attractive_w}_{repulsive_w}_{align_w}_{test_n}.npy')
-        biggest_clusters = np.zeros(MAX_STEPS + 2)
-        for t in range(MAX_STEPS):
-            clusters = find_clusters(adj_mat[t], 1)
-            cluster_size = [len(c) for c in clusters]
-            biggest_clusters[t] = max(cluster_size)
+def biggest_cluster_series(path: str, block: int = 1000) -> np.ndarray:
+    """Returns the largest cluster size of every step of a contact history, reading block steps at a time"""
+    history = ContactHistory(path)
+    biggest_clusters = np.zeros(len(history))
+    for start in range(0, len(history), block):
+        steps = [history[t] for t in range(start, min(start + block, len(history)))]
+        biggest_clusters[start:start + len(steps)] = largest_cluster(cluster_labels(steps, history.n_agents))
+    return biggest_clusters
+
+def main(attractive_w, repulsive_w, align_w, test_n, jobs=1, store=None, backend='agent'):
+    # the metrics computed during the run are used when present, the contact histories otherwise
+    replicate = '*' if test_n is None else test_n
+    metrics = sorted(glob.glob(metrics_path(attractive_w, repulsive_w, align_w, replicate, backend)))
+    if store is not None:
+        where = dict(attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w, backend=backend)
+        if test_n is not None:
+            where['test_n'] = test_n
+        bc = [stored.metrics()['largest_cluster'] for stored in ExperimentStore(store).runs(**where)]
+    elif len(metrics) > 0:
+        bc = [load_metrics(f)['largest_cluster'] for f in metrics]
     else:
-        files = glob.glob(f'aggr_data/adj_{attractive_w}_{repulsive_w}_{align_w}_*.npy')
-        adj_mat = np.zeros((len(files), MAX_STEPS + 2, NUM_AGENTS, NUM_AGENTS))
-        bc = np.zeros((len(files), MAX_STEPS + 2))
-        for f in range(len(files)):
-            adj_mat[f] = np.load(files[f])
-            for t in range(MAX_STEPS):
-                clusters = find_clusters(adj_mat[f, t], 1)
-                cluster_size = [len(c) for c in clusters]
-                bc[f, t] = max(cluster_size)
-        biggest_clusters = np.mean(bc, axis=0)
+        files = [f for f in glob.glob(contacts_path(attractive_w, repulsive_w, align_w, replicate, backend)) if os.path.isdir(f)]
+        with Pool(jobs) as pool:
+            bc = pool.map(biggest_cluster_series, files)
+    if len(bc) == 0:
+        print(f'No runs found for attractive_w={attractive_w}, repulsive_w={repulsive_w}, align_w={align_w}'
+              + (f', test_n={test_n}' if test_n is not None else '') + f' on the {backend} backend')
+        return
+    # runs stopped early by a convergence criterion hold their last value until the longest run ends
+    length = max(len(b) for b in bc)
+    biggest_clusters = np.mean([np.pad(b, (0, length - len(b)), mode='edge') for b in bc], axis=0)
+
+    from matplotlib import pyplot as plt
 
     plt.figure(figsize=(10, 5), dpi=80)
     plt.plot(biggest_clusters)
@@ -49,10 +57,5 @@ def main(attractive_w, repulsive_w, align_w, test_n):
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-a', type=float, required=True)
-    parser.add_argument('-r', type=float, required=True)
-    parser.add_argument('-l', type=float, required=True)
-    parser.add_argument('-t', type=int, required=False)
-    args = parser.parse_args()
-    main(args.a, args.r, args.l, args.t)
+    import cli
+    raise SystemExit(1 if cli.main(['analyse'] + sys.argv[1:]) else 0)
@@ -0,0 +1,155 @@
+from model import WormSimulator
+from clusters import cluster_labels, largest_cluster
+from config import BACKENDS
+import analyse_cluster
+import numpy as np
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from multiprocessing import Pipe, Process
+
+
+def bench_case(case):
+    """
+    Times one configuration of the simulator and of the analysis pipeline.
+    Every case runs in its own process, so the peak resident memory it reports only includes the
+    interpreter and that single configuration, not the workers of the decomposed backend.
+    """
+    start = time.perf_counter()
+    model = WormSimulator(n_agents=case['n_agents'], dim_env=case['dim_env'], max_steps=case['max_steps'],
+                          multispot=False, num_spots=1, clustered=False, attractive_w=0.3, repulsive_w=0.3, align_w=0.3,
+                          decay_rate=case['decay_rate'], backend=case['backend'],
+                          pheromone_field=case['pheromone_field'], seed=case['seed'], workers=case.get('workers', 1))
+    construction = time.perf_counter() - start
+
+    # time the steps spend recording the trajectories, part of the step times
+    record_times = []
+    collect = model.collect
+    def timed_collect():
+        start = time.perf_counter()
+        collect()
+        record_times.append(time.perf_counter() - start)
+    model.collect = timed_collect
+
+    step_times = np.zeros(case['max_steps'])
+    for t in range(case['max_steps']):
+        start = time.perf_counter()
+        model.step()
+        step_times[t] = time.perf_counter() - start
+    live_worms = len(model.worm_positions())
+    live_pheromones = 0 if model.env.pheromone_field else len(model.env.pheromones)
+
+    start = time.perf_counter()
+    adj_mat = model.get_adj_matrix()
+    adj_matrix = time.perf_counter() - start
+
+    start = time.perf_counter()
+    analyse_cluster.find_clusters(adj_mat, 1)
+    find_clusters = time.perf_counter() - start
+
+    start = time.perf_counter()
+    largest_cluster(cluster_labels([model.contacts[t] for t in range(len(model.contacts))], case['n_agents']))
+    cluster_all_steps = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'position_data.npz')
+        start = time.perf_counter()
+        model.recorder.save(path)
+        trajectory_write = time.perf_counter() - start
+        trajectory_bytes = os.path.getsize(path)
+    model.close()
+
+    return dict(case, construction=construction, step_mean=step_times.mean(), step_median=float(np.median(step_times)),
+                step_max=step_times.max(), adj_matrix=adj_matrix, find_clusters=find_clusters,
+                cluster_all_steps=cluster_all_steps, trajectory_record=sum(record_times), trajectory_write=trajectory_write,
+                trajectory_bytes=trajectory_bytes, trajectory_rows=len(model.recorder),
+                live_worms=live_worms, live_pheromones=live_pheromones,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+def send_bench_case(case, connection):
+    connection.send(bench_case(case))
+
+def bench_in_process(case):
+    """Runs bench_case in a fresh process, which unlike a pool worker may start the workers of the decomposed backend"""
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=send_bench_case, args=(case, sender))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError(f'The benchmark case {case} failed') from None
+    finally:
+        process.join()
+
+def case_key(case):
+    # results written before the decomposed backend existed ran on one process
+    return tuple(case[k] for k in ('n_agents', 'dim_env', 'max_steps', 'decay_rate', 'backend', 'pheromone_field')) + \
+        (case.get('workers', 1),)
+
+def compare(results, baseline_path, tolerance):
+    """Prints the timings that got slower than tolerance times those of the same case in a baseline file"""
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in map(json.loads, f) if 'n_agents' in r}
+    regressions = 0
+    for r in results:
+        old = baseline.get(case_key(r))
+        if old is None:
+            continue
+        for metric in ('construction', 'step_mean', 'adj_matrix', 'find_clusters', 'cluster_all_steps', 'trajectory_record',
+                       'trajectory_write'):
+            if old.get(metric, 0) > 0 and r[metric] / old[metric] > tolerance:
+                regressions += 1
+                print(f'{case_key(r)} {metric}: {old[metric]:.4g}s -> {r[metric]:.4g}s ({r[metric] / old[metric]:.2f}x)')
+    print(f'{regressions} regressions above {tolerance}x')
+    return regressions
+
+def main(n_agents, dim_envs, max_steps, decay_rates, backends, pheromone_field, output, baseline=None, tolerance=1.2, seed=0,
+         workers=1):
+    if pheromone_field and 'decomposed' in backends:
+        raise ValueError('The decomposed backend only supports pheromone molecules, not pheromone fields')
+    cases = [dict(n_agents=n, dim_env=d, max_steps=s, decay_rate=r, backend=b, pheromone_field=pheromone_field, seed=seed,
+                  workers=workers if b == 'decomposed' else 1)
+             for n, d, s, r, b in itertools.product(n_agents, dim_envs, max_steps, decay_rates, backends)]
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    results = []
+    # a fresh process per case keeps the peak memory of one case from leaking into the next
+    with open(output, 'a') as f:
+        for r in map(bench_in_process, cases):
+            r.update(commit=commit, timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            f.write(json.dumps(r) + '\n')
+            f.flush()
+            results.append(r)
+            print(f"n_agents={r['n_agents']} dim_env={r['dim_env']} decay_rate={r['decay_rate']} {r['backend']}: "
+                  f"{r['step_mean'] * 1000:.2f} ms/step, {r['live_pheromones']} pheromones, {r['peak_rss_mb']:.0f} MB")
+    if baseline is not None:
+        return compare(results, baseline, tolerance)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--agents', type=int, nargs='+', default=[75, 300, 1000])
+    parser.add_argument('-d', '--dim-env', type=float, nargs='+', default=[400])
+    parser.add_argument('-s', '--steps', type=int, nargs='+', default=[50])
+    parser.add_argument('-r', '--decay', type=float, nargs='+', default=[0.1])
+    parser.add_argument('-b', '--backend', nargs='+', default=['agent', 'vectorized'], choices=BACKENDS)
+    parser.add_argument('-w', '--workers', type=int, default=1, help='worker processes of the decomposed backend')
+    parser.add_argument('--field', action='store_true', help='use the pheromone concentration field, except on the decomposed backend')
+    parser.add_argument('-o', '--output', default='bench_results.jsonl', help='results are appended to this JSON lines file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON lines file of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+    if args.field and 'decomposed' in args.backend:
+        parser.error('--field is not supported by the decomposed backend')
+    regressions = main(args.agents, args.dim_env, args.steps, args.decay, args.backend, args.field, args.output,
+                       args.compare, args.tolerance, workers=args.workers)
+    raise SystemExit(1 if regressions > 0 else 0)
@@ -0,0 +1,201 @@
+# Single entry point of the simulator: python cli.py {run,sweep,explore,analyse,render,batch} ...
+# Only the argument parsers live here. Every command imports the modules it needs when it runs,
+# so starting the command line does not load mesa, matplotlib or pygame.
+
+from config import NUM_EXPERIMENTS, BACKENDS, CONVERGENCE_METRICS, MANIFEST
+from typing import List
+import argparse
+import os
+import shlex
+import sys
+import time
+
+
+def add_convergence_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--stop-metric', choices=CONVERGENCE_METRICS, help='stop every run once this metric has converged')
+    parser.add_argument('--stop-window', type=int, default=50, help='steps averaged by each window of the convergence test')
+    parser.add_argument('--stop-tolerance', type=float, default=0.02, help='largest change between windows deemed converged')
+    parser.add_argument('--stop-patience', type=int, default=50, help='consecutive converged steps before stopping')
+
+def convergence_arguments(args: argparse.Namespace) -> dict:
+    """Returns the arguments of the ConvergenceCriterion requested on the command line, None without --stop-metric"""
+    if args.stop_metric is None:
+        return None
+    return dict(metric=args.stop_metric, window=args.stop_window, tolerance=args.stop_tolerance, patience=args.stop_patience)
+
+
+def add_collection_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--collect-kinds', nargs='*', choices=('worm', 'attractive', 'repulsive'),
+                        help='agent kinds recorded in the trajectories, all of them by default')
+    parser.add_argument('--collect-interval', type=int, default=1, help='steps between two recorded steps')
+    parser.add_argument('--pheromone-histogram', type=int, nargs='?', const=50, metavar='BINS',
+                        help='record a BINS x BINS density of each pheromone kind instead of its molecules')
+
+def collection_arguments(args: argparse.Namespace) -> dict:
+    """Returns the arguments of the CollectionPolicy requested on the command line, None without any collection option"""
+    if args.collect_kinds is None and args.collect_interval == 1 and args.pheromone_histogram is None:
+        return None
+    collection = dict(interval=args.collect_interval)
+    if args.collect_kinds is not None:
+        collection['kinds'] = args.collect_kinds
+    if args.pheromone_histogram is not None:
+        collection.update(pheromone_mode='histogram', bins=args.pheromone_histogram)
+    return collection
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-a', type=float, required=True)
+    parser.add_argument('-r', type=float, required=True)
+    parser.add_argument('-l', type=float, required=True)
+    parser.add_argument('-t', type=int, required=True)
+    parser.add_argument('-s', '--seed', type=int, required=False)
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='agent', help='implementation of the worm rules')
+    parser.add_argument('-p', '--profile', action='store_true', help='print the time spent in every phase of the step')
+    parser.add_argument('--contacts', action='store_true', help='also store the contact graph of every step')
+    parser.add_argument('--from-checkpoint', help='continue the run saved in this checkpoint instead of starting from step 0')
+    parser.add_argument('--save-checkpoint', help='write the state of the run to this checkpoint')
+    parser.add_argument('--checkpoint-step', type=int, help='step at which the checkpoint is written, the last one by default')
+    add_convergence_arguments(parser)
+    add_collection_arguments(parser)
+    parser.add_argument('--store', help='directory of the ExperimentStore the run is added to')
+
+def run_command(args: argparse.Namespace) -> None:
+    import run
+    from store import ExperimentStore
+    run.main(args.a, args.r, args.l, args.t, args.seed, profile=args.profile, store_contacts=args.contacts,
+             checkpoint=args.from_checkpoint, save_checkpoint=args.save_checkpoint, checkpoint_step=args.checkpoint_step,
+             convergence=convergence_arguments(args), store=ExperimentStore(args.store) if args.store is not None else None,
+             backend=args.backend, collection=collection_arguments(args))
+
+
+def add_sweep_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-a', type=float, nargs='+', required=True)
+    parser.add_argument('-r', type=float, nargs='+', required=True)
+    parser.add_argument('-l', type=float, nargs='+', required=True)
+    parser.add_argument('-n', type=int, default=NUM_EXPERIMENTS, help='replicates per weight combination')
+    parser.add_argument('-j', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='base seed the per-run seeds are derived from')
+    parser.add_argument('-m', '--manifest', default=MANIFEST)
+    parser.add_argument('--contacts', action='store_true', help='also store the contact graph of every step')
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='agent', help='implementation of the worm rules')
+    parser.add_argument('--batch', action='store_true',
+                        help='run the replicates of every combination as one batched ensemble, requires --backend vectorized')
+    add_convergence_arguments(parser)
+    parser.add_argument('--store', help='directory of the ExperimentStore the runs are added to')
+
+def sweep_command(args: argparse.Namespace) -> int:
+    """Returns the number of failed runs"""
+    import sweep
+    return sweep.main(args.a, args.r, args.l, args.n, args.j, args.seed, args.manifest, args.contacts, args.batch,
+                      convergence_arguments(args), args.store, args.backend)
+
+
+def add_explore_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--spacing', type=float, default=0.25, help='step of the initial grid of weights')
+    parser.add_argument('--min-spacing', type=float, default=0.02, help='smallest spacing refinement goes down to')
+    parser.add_argument('-n', '--replicates', type=int, default=2, help='runs per new point')
+    parser.add_argument('--max-replicates', type=int, default=6, help='runs per point at most, when its replicates disagree')
+    parser.add_argument('--budget', type=int, default=200, help='total number of runs')
+    parser.add_argument('--round-runs', type=int, default=20, help='runs per refinement round')
+    parser.add_argument('--threshold', type=float, default=0.5, help='largest cluster fraction deemed aggregated')
+    parser.add_argument('--max-std', type=float, default=0.15, help='replicate score deviation beyond which a point gets more runs')
+    parser.add_argument('--tail', type=int, default=50, help='last steps whose largest cluster is averaged into the score')
+    parser.add_argument('-j', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='base seed the per-run seeds are derived from')
+    parser.add_argument('-o', '--output', default='explore', help='prefix of the samples, points and boundary files')
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='agent', help='implementation of the worm rules')
+    add_convergence_arguments(parser)
+    parser.add_argument('--store', help='directory of the ExperimentStore the runs are added to')
+
+def explore_command(args: argparse.Namespace) -> None:
+    from explore import AdaptiveExplorer
+    explorer = AdaptiveExplorer(args.spacing, args.replicates, args.budget, args.threshold, args.max_std, args.max_replicates,
+                                args.min_spacing, args.tail, args.round_runs, args.seed)
+    explorer.explore(args.j, f'{args.output}_samples.jsonl', convergence_arguments(args), args.store, args.backend)
+    explorer.save(f'{args.output}_points.csv', f'{args.output}_boundary.csv')
+
+
+def add_analyse_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-a', type=float, required=True)
+    parser.add_argument('-r', type=float, required=True)
+    parser.add_argument('-l', type=float, required=True)
+    parser.add_argument('-t', type=int, required=False)
+    parser.add_argument('-b', '--backend', choices=BACKENDS, default='agent', help='backend the runs were simulated with')
+    parser.add_argument('-j', type=int, default=1, help='number of replicate files analysed in parallel')
+    parser.add_argument('--store', help='read the runs from this ExperimentStore instead of aggr_data')
+
+def analyse_command(args: argparse.Namespace) -> None:
+    import analyse_cluster
+    analyse_cluster.main(args.a, args.r, args.l, args.t, args.j, args.store, args.backend)
+
+
+def add_render_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('-i', '--input', default='position_data.npz')
+    parser.add_argument('--headless', metavar='VIDEO', help='render to this video file through ffmpeg instead of a window')
+    parser.add_argument('--skip', type=int, default=1, help='render one recorded step out of skip')
+    parser.add_argument('--scale', type=float, default=2, help='pixels per unit of the environment')
+    parser.add_argument('--fps', type=int, default=15)
+
+def render_command(args: argparse.Namespace) -> None:
+    from recorder import Trajectories
+    import show_trajectories
+    pos_data = Trajectories(args.input)
+    if args.headless is not None:
+        show_trajectories.HeadlessRenderer(pos_data, scale=args.scale, skip=args.skip, fps=args.fps).run(args.headless)
+    else:
+        show_trajectories.Simulator(pos_data).run()
+
+
+def add_batch_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('jobs', help='file with one command per line, such as "run -a 0.1 -r 0.2 -l 0.3 -t 0", '
+                                     'blank lines and lines starting with # being skipped')
+    parser.add_argument('--stop-on-error', action='store_true', help='stop at the first job that fails')
+
+def batch_command(args: argparse.Namespace) -> int:
+    """Runs every command of a job file in this interpreter, so the imports are only paid once. Returns the number of failed jobs."""
+    with open(args.jobs) as f:
+        jobs = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+    failed = 0
+    for n, job in enumerate(jobs, 1):
+        argv = shlex.split(job)
+        print(f'[{n}/{len(jobs)}] {job}')
+        start = time.perf_counter()
+        try:
+            if argv[0] == 'batch':
+                raise ValueError('A job file cannot run another batch')
+            main(argv)
+        # argparse exits on malformed arguments
+        except (Exception, SystemExit) as e:
+            failed += 1
+            print(f'[{n}/{len(jobs)}] failed: {e!r}', file=sys.stderr)
+            if args.stop_on_error:
+                break
+        else:
+            print(f'[{n}/{len(jobs)}] done in {time.perf_counter() - start:.1f} s')
+    if failed > 0:
+        print(f'{failed} of {len(jobs)} jobs failed', file=sys.stderr)
+    return failed
+
+
+COMMANDS = {
+    'run': (add_run_arguments, run_command, 'run one experiment'),
+    'sweep': (add_sweep_arguments, sweep_command, 'run every combination of weights over a process pool'),
+    'explore': (add_explore_arguments, explore_command, 'sample the weights adaptively around the aggregation boundary'),
+    'analyse': (add_analyse_arguments, analyse_command, 'plot the mean largest cluster of the replicates of a combination'),
+    'render': (add_render_arguments, render_command, 'show or record the saved trajectories'),
+    'batch': (add_batch_arguments, batch_command, 'run the commands of a job file in one interpreter'),
+}
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='cli.py', description='Simulation and analysis of worm aggregation')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, (add_arguments, command, help) in COMMANDS.items():
+        subparser = commands.add_parser(name, help=help, description=help)
+        add_arguments(subparser)
+        subparser.set_defaults(handler=command)
+    args = parser.parse_args(argv)
+    return args.handler(args) or 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(1 if main() else 0)
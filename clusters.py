@@ -0,0 +1,128 @@
+from typing import Sequence
+import numpy as np
+
+
+def cluster_labels(edges_per_step: Sequence[np.ndarray], n_agents: int) -> np.ndarray:
+    """
+    Finds the connected components of the contact graph of many steps at once.
+    Every step becomes a block of n_agents nodes of one graph, whose components are found with
+    array-based union-find: each root is hooked under the smallest root it touches, followed by
+    pointer jumping, until no edge joins two different roots.
+    Args:
+        edges_per_step: one (E, 2) edge list per step.
+        n_agents: number of worms.
+
+    Returns:
+        A (T, N) array labelling every worm with the smallest worm index of its cluster.
+    """
+    n_steps = len(edges_per_step)
+    offsets = np.repeat(np.arange(n_steps, dtype=np.int64) * n_agents, [len(e) for e in edges_per_step])
+    if len(offsets) > 0:
+        edges = np.concatenate([np.asarray(e, dtype=np.int64).reshape(-1, 2) for e in edges_per_step])
+        u = edges[:, 0] + offsets
+        v = edges[:, 1] + offsets
+    else:
+        u = v = np.zeros(0, dtype=np.int64)
+
+    labels = np.arange(n_steps * n_agents, dtype=np.int64)
+    while True:
+        lu = labels[u]; lv = labels[v]
+        joined = lu != lv
+        if not joined.any():
+            break
+        u = u[joined]; v = v[joined]
+        np.minimum.at(labels, np.maximum(lu[joined], lv[joined]), np.minimum(lu[joined], lv[joined]))
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+    return labels.reshape(n_steps, n_agents) - np.arange(n_steps)[:, None] * n_agents
+
+
+def cluster_counts(labels: np.ndarray) -> np.ndarray:
+    """Returns the (T, N) size of the cluster rooted at each worm, 0 for worms that are not a root"""
+    n_steps, n_agents = labels.shape
+    flat = (labels + np.arange(n_steps)[:, None] * n_agents).ravel()
+    return np.bincount(flat, minlength=n_steps * n_agents).reshape(n_steps, n_agents)
+
+
+def cluster_sizes(labels: np.ndarray) -> np.ndarray:
+    """Returns the (T, N + 1) histogram of cluster sizes, entry [t, s] counting the clusters of size s at step t"""
+    counts = cluster_counts(labels)
+    n_steps, n_agents = counts.shape
+    t, root = np.nonzero(counts)
+    flat = t * (n_agents + 1) + counts[t, root]
+    return np.bincount(flat, minlength=n_steps * (n_agents + 1)).reshape(n_steps, n_agents + 1)
+
+
+def largest_cluster(labels: np.ndarray) -> np.ndarray:
+    """Returns the size of the largest cluster at every step"""
+    return cluster_counts(labels).max(axis=1)
+
+
+class AggregationMetrics():
+    """
+    Time series of aggregation metrics, updated online from the contact graph of every step so the
+    contact history itself need not be stored.
+
+    Every update records the size of the largest cluster, the number of clusters (isolated worms
+    counting as clusters of size 1), their mean size, the mean distance of the worms to their
+    nearest neighbour, over the worms with one within config.NN_MAX_DISTANCE, and the polar order
+    parameter of their headings.
+    """
+    fields = ('step', 'largest_cluster', 'n_clusters', 'mean_cluster_size', 'nn_distance', 'order_parameter')
+
+    def __init__(self, n_agents: int) -> None:
+        self.n_agents = n_agents
+        self.values = {f: [] for f in self.fields}
+        # set when a ConvergenceCriterion ends the run before its last step
+        self.converged = False
+
+    def __len__(self) -> int:
+        return len(self.values['step'])
+
+    def update(self, step: int, edges: np.ndarray, nn_distance: float, order_parameter: float = np.nan) -> None:
+        self.record(step, cluster_labels([edges], self.n_agents)[0], nn_distance, order_parameter)
+
+    def record(self, step: int, labels: np.ndarray, nn_distance: float, order_parameter: float = np.nan) -> None:
+        """Records a step from the (N,) cluster labels computed by cluster_labels"""
+        sizes = np.bincount(labels, minlength=self.n_agents)
+        n_clusters = np.count_nonzero(sizes)
+        self.values['step'].append(step)
+        self.values['largest_cluster'].append(sizes.max(initial=0))
+        self.values['n_clusters'].append(n_clusters)
+        self.values['mean_cluster_size'].append(self.n_agents / max(n_clusters, 1))
+        self.values['nn_distance'].append(nn_distance)
+        self.values['order_parameter'].append(order_parameter)
+
+    def truncate(self, step: int) -> None:
+        """Drops the entries recorded after step"""
+        n = int(np.searchsorted(self.values['step'], step, side='right'))
+        self.values = {f: v[:n] for f, v in self.values.items()}
+
+    def series(self) -> dict:
+        return {f: np.array(v, dtype=np.int32 if f in ('step', 'largest_cluster', 'n_clusters') else float)
+                for f, v in self.values.items()}
+
+    def set_state(self, series: dict) -> None:
+        self.values = {f: list(series[f]) for f in self.fields}
+
+    def save(self, path: str) -> None:
+        """Writes the series with the last step run and whether the run stopped because it converged"""
+        stop_step = self.values['step'][-1] if len(self) > 0 else -1
+        np.savez(path, n_agents=self.n_agents, stop_step=stop_step, converged=self.converged, **self.series())
+
+
+def polar_order(angles: np.ndarray) -> float:
+    """Returns the norm of the mean heading unit vector, 1 when all worms head the same way and near 0 when they are disordered"""
+    angles = np.asarray(angles, dtype=float)
+    if len(angles) == 0:
+        return np.nan
+    return float(np.hypot(np.cos(angles).mean(), np.sin(angles).mean()))
+
+
+def load_metrics(path: str) -> dict:
+    """Returns the series saved by AggregationMetrics.save as a dict of arrays"""
+    with np.load(path) as data:
+        return {f: data[f] for f in data.files}
@@ -0,0 +1,33 @@
+# Experiment defaults and output paths shared by the simulation and the command line. This module
+# imports nothing, so the command line can read it without loading mesa, matplotlib or the simulation itself.
+
+NUM_EXPERIMENTS = 1
+ENV_SIZE = 400
+MAX_STEPS = 500
+NUM_AGENTS = 75
+
+# implementations of the worm rules, see WormSimulator
+BACKENDS = ('agent', 'vectorized', 'decomposed')
+
+# sweep log of the completed runs
+MANIFEST = 'aggr_data/manifest.jsonl'
+
+# the nn_distance metric averages the distance to the nearest worm over the worms with one this close,
+# twice the contact distance, as searching the whole torus for the isolated worms costs more than
+# the rest of the contacts
+NN_MAX_DISTANCE = 40
+
+# metrics a ConvergenceCriterion can follow
+CONVERGENCE_METRICS = ('largest_cluster', 'order_parameter')
+
+
+# paths of the outputs of a run outside an ExperimentStore, those of the agent backend keeping the
+# names they had before there were other backends
+def backend_prefix(backend):
+    return '' if backend == 'agent' else f'{backend}_'
+
+def contacts_path(attractive_w, repulsive_w, align_w, test_n, backend='agent'):
+    return f'aggr_data/adj_{backend_prefix(backend)}{attractive_w}_{repulsive_w}_{align_w}_{test_n}'
+
+def metrics_path(attractive_w, repulsive_w, align_w, test_n, backend='agent'):
+    return f'aggr_data/metrics_{backend_prefix(backend)}{attractive_w}_{repulsive_w}_{align_w}_{test_n}.npz'
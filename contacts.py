@@ -0,0 +1,122 @@
+from typing import Iterator, Tuple
+import json
+import os
+import numpy as np
+
+
+class ContactRecorder():
+    """
+    Contact graph of every step, stored as (E, 2) uint32 edge lists with i < j.
+
+    Without a path the edge lists are kept in memory. With a path, they are appended to disk every
+    chunk_steps steps in the layout read by ContactHistory, so memory scales with the contacts of
+    one chunk instead of N^2 x T.
+    """
+    def __init__(self, n_agents: int, path: str = None, chunk_steps: int = 100) -> None:
+        self.n_agents = n_agents
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self.steps = []
+        self.n_edges = 0
+        self.n_flushed = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump({'n_agents': n_agents}, f)
+            # start from empty files so a rerun does not append to an older history
+            open(os.path.join(path, 'edges.u32'), 'wb').close()
+            open(os.path.join(path, 'offsets.i64'), 'wb').close()
+
+    def __len__(self) -> int:
+        return self.n_flushed + len(self.steps)
+
+    def __getitem__(self, t: int) -> np.ndarray:
+        if self.path is not None:
+            raise IndexError('The contacts are streamed to disk, read them back with ContactHistory')
+        return self.steps[t]
+
+    def append(self, edges: np.ndarray) -> None:
+        self.steps.append(np.asarray(edges, dtype=np.uint32).reshape(-1, 2))
+        if self.path is not None and len(self.steps) >= self.chunk_steps:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends the buffered steps to disk"""
+        if self.path is None or len(self.steps) == 0:
+            return
+        offsets = self.n_edges + np.cumsum([len(e) for e in self.steps], dtype=np.int64)
+        with open(os.path.join(self.path, 'edges.u32'), 'ab') as f:
+            f.write(np.concatenate(self.steps).tobytes())
+        with open(os.path.join(self.path, 'offsets.i64'), 'ab') as f:
+            f.write(offsets.tobytes())
+        self.n_edges = int(offsets[-1])
+        self.n_flushed += len(self.steps)
+        self.steps = []
+
+    def close(self) -> None:
+        self.flush()
+
+    def get_state(self) -> dict:
+        """Returns the edge lists held in memory, concatenated, with the edge offset of every step"""
+        offsets = np.concatenate(([0], np.cumsum([len(e) for e in self.steps], dtype=np.int64)))
+        edges = np.concatenate(self.steps) if len(self.steps) > 0 else np.zeros((0, 2), dtype=np.uint32)
+        return {'edges': edges, 'offsets': offsets}
+
+    def set_state(self, state: dict) -> None:
+        """Replaces the buffered steps with those of get_state, written to disk on the next flush if streaming"""
+        offsets = state['offsets']
+        self.steps = [np.asarray(state['edges'][offsets[t]:offsets[t + 1]], dtype=np.uint32) for t in range(len(offsets) - 1)]
+
+
+class ContactHistory():
+    """Lazy reader of a contact history written by ContactRecorder, memory-mapping the edge lists"""
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.n_agents = json.load(f)['n_agents']
+        self.offsets = np.concatenate(([0], np.fromfile(os.path.join(path, 'offsets.i64'), dtype=np.int64)))
+        if self.offsets[-1] > 0:
+            self.edges = np.memmap(os.path.join(path, 'edges.u32'), dtype=np.uint32, mode='r').reshape(-1, 2)
+        else:
+            self.edges = np.zeros((0, 2), dtype=np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, t: int) -> np.ndarray:
+        """Returns the (E, 2) edge list of step t"""
+        if t < 0:
+            t += len(self)
+        return self.edges[self.offsets[t]:self.offsets[t + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for t in range(len(self)):
+            yield self[t]
+
+    def dense(self, t: int) -> np.ndarray:
+        """Returns the contact matrix of step t, symmetric and with every worm in contact with itself"""
+        return edges_to_dense(self[t], self.n_agents)
+
+
+def contact_pairs(index, radius: float, torus: bool = False, groups: np.ndarray = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the pairs i < j of the points of a PeriodicCellList within radius of each other, sorted
+    by i then j. Without torus, distances are measured in the plane as in the original adjacency
+    matrix, so points close to each other across an edge of the environment are not in contact.
+    """
+    i, j, _ = index.query(index.positions, radius, groups=groups)
+    keep = i < j
+    if not torus:
+        # pairs within radius in the plane are within radius on the torus too
+        delta = index.positions[j] - index.positions[i]
+        keep &= delta[:, 0] ** 2 + delta[:, 1] ** 2 <= radius ** 2
+    i = i[keep]; j = j[keep]
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+def edges_to_dense(edges: np.ndarray, n_agents: int) -> np.ndarray:
+    adj_mat = np.eye(n_agents)
+    adj_mat[edges[:, 0], edges[:, 1]] = 1
+    adj_mat[edges[:, 1], edges[:, 0]] = 1
+    return adj_mat
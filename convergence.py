@@ -0,0 +1,56 @@
+from clusters import AggregationMetrics
+from config import CONVERGENCE_METRICS
+import numpy as np
+
+
+class ConvergenceCriterion():
+    """
+    Stopping rule ending a run once an aggregation metric has settled, whether the worms aggregated
+    or clearly never will.
+
+    After every step the mean of the metric over the last window steps is compared with its mean
+    over the window before; the run has converged once the two differ by at most tolerance for
+    patience consecutive steps.
+    Args:
+        metric: 'largest_cluster', as a fraction of the worms, or 'order_parameter'.
+        window: number of steps averaged by each of the two windows.
+        tolerance: largest difference between the two window means deemed stable.
+        patience: number of consecutive stable steps before stopping.
+        min_steps: steps always run before stopping is considered.
+    """
+    metrics = CONVERGENCE_METRICS
+
+    def __init__(self, metric: str = 'largest_cluster', window: int = 50, tolerance: float = 0.02,
+                  patience: int = 50, min_steps: int = 0) -> None:
+        if metric not in self.metrics:
+            raise ValueError(f'Unknown metric {metric}, it must be among {list(self.metrics)}')
+        if window < 1 or patience < 1:
+            raise ValueError(f'The window is {window} and the patience {patience} but they must be at least 1')
+        self.metric = metric
+        self.window = window
+        self.tolerance = tolerance
+        self.patience = patience
+        self.min_steps = min_steps
+        self.stable_steps = 0
+
+    def update(self, metrics: AggregationMetrics) -> bool:
+        """Checks the last entry of the series, returning True and marking the series as converged once the run can stop"""
+        values = metrics.values[self.metric]
+        if len(values) < 2 * self.window:
+            return False
+        recent = np.asarray(values[-2 * self.window:], dtype=float)
+        if self.metric == 'largest_cluster':
+            recent /= metrics.n_agents
+        if abs(recent[self.window:].mean() - recent[:self.window].mean()) <= self.tolerance:
+            self.stable_steps += 1
+        else:
+            self.stable_steps = 0
+        if self.stable_steps >= self.patience and metrics.values['step'][-1] >= self.min_steps:
+            metrics.converged = True
+        return metrics.converged
+
+    def get_state(self) -> dict:
+        return {'stable_steps': self.stable_steps}
+
+    def set_state(self, state: dict) -> None:
+        self.stable_steps = int(state['stable_steps'])
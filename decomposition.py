@@ -0,0 +1,270 @@
+from swarm import WormSwarm, pheromone_centroid, mean_heading, steer
+from player import PheromonePool, random_walk
+from spatial import PeriodicCellList
+from profiling import phase
+from multiprocessing import Pool, current_process, shared_memory
+from typing import Dict
+import weakref
+import numpy as np
+
+# shared memory blocks attached by a worker process, by block name
+_attached = {}
+
+
+class SharedArrays():
+    """
+    NumPy arrays kept in named shared memory blocks, so worker processes can map them without
+    copying. A block is only reallocated, with doubled capacity, when an array outgrows it.
+    """
+    def __init__(self) -> None:
+        self.blocks = {}
+        self.layouts = {}
+
+    def allocate(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = self.blocks.get(name)
+        if block is None or block.size < nbytes:
+            size = nbytes
+            if block is not None:
+                size = max(nbytes, 2 * block.size)
+                block.close()
+                block.unlink()
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.blocks[name] = block
+        self.layouts[name] = (tuple(shape), dtype.str)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def put(self, name: str, values: np.ndarray) -> None:
+        values = np.asarray(values)
+        self.allocate(name, values.shape, values.dtype)[...] = values
+
+    def get(self, name: str) -> np.ndarray:
+        """Returns a copy of an array, leaving no reference to its block behind"""
+        shape, dtype = self.layouts[name]
+        return np.ndarray(shape, dtype=dtype, buffer=self.blocks[name].buf).copy()
+
+    def specs(self) -> Dict[str, tuple]:
+        """Returns the block name, shape and dtype of every array, as read by attach"""
+        return {name: (self.blocks[name].name,) + layout for name, layout in self.layouts.items()}
+
+    def close(self) -> None:
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # arrays still viewing the block keep it mapped until they are collected
+                pass
+            block.unlink()
+        self.blocks = {}
+        self.layouts = {}
+
+
+def attach(specs: Dict[str, tuple]) -> Dict[str, np.ndarray]:
+    """Maps the arrays described by SharedArrays.specs in a worker, reusing the blocks already attached"""
+    names = {shm_name for shm_name, _, _ in specs.values()}
+    for stale in set(_attached) - names:
+        _attached.pop(stale).close()
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        if shm_name not in _attached:
+            _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=_attached[shm_name].buf)
+    return arrays
+
+
+def strip_rows(order: np.ndarray, starts: np.ndarray, positions: np.ndarray, strip: int, n_strips: int,
+               dim_env: float, halo: float) -> np.ndarray:
+    """Returns the rows lying in a strip or within halo of it along x, the strips being at least halo wide"""
+    strips = sorted({(strip - 1) % n_strips, strip, (strip + 1) % n_strips})
+    rows = np.concatenate([order[starts[s]:starts[s + 1]] for s in strips])
+    width = dim_env / n_strips
+    dx = (positions[rows, 0] - strip * width) % dim_env
+    return rows[(dx < width + halo) | (dx >= dim_env - halo)]
+
+
+class SharedPheromonePool(PheromonePool):
+    """PheromonePool whose columns live in the blocks of a SharedArrays, so workers can update them in place"""
+    def __init__(self, dim_env: float, shared: SharedArrays, capacity: int = 1024) -> None:
+        self.shared = shared
+        super().__init__(dim_env, capacity)
+        for name in self.columns:
+            old = getattr(self, name)
+            setattr(self, name, self.shared.allocate(f'ph_{name}', old.shape, old.dtype))
+
+    def reserve(self, n: int) -> None:
+        capacity = len(self.quantity)
+        if self.n + n <= capacity:
+            return
+        while capacity < self.n + n:
+            capacity *= 2
+        for name in self.columns:
+            old = getattr(self, name)[:self.n].copy()
+            # a block is only replaced once no array views it anymore
+            setattr(self, name, None)
+            new = self.shared.allocate(f'ph_{name}', (capacity,) + old.shape[1:], old.dtype)
+            new[:self.n] = old
+            setattr(self, name, new)
+
+
+def walk_strip(task: dict) -> None:
+    """Moves and decays the pheromone molecules of one block of rows of the pool, in shared memory"""
+    a = attach(task['specs'])
+    rows = slice(*task['rows'])
+    angle = np.random.default_rng([task['seed'], task['strip']]).random(rows.stop - rows.start) * np.pi * 2
+    random_walk(a['ph_pos'][rows], a['ph_vel'][rows], a['ph_quantity'][rows], a['ph_speed'][rows],
+                a['ph_decay_rate'][rows], angle, task['dim_env'])
+
+
+def step_strip(task: dict) -> None:
+    """
+    Senses, aligns and steers the worms of one strip, reading the worms and pheromones of the
+    strip and of its halos from shared memory and writing the new headings back to it.
+    """
+    a = attach(task['specs'])
+    strip, n_strips, dim_env = task['strip'], task['n_strips'], task['dim_env']
+    own = a['worm_order'][a['worm_starts'][strip]:a['worm_starts'][strip + 1]]
+    if len(own) == 0:
+        return
+    pos = a['worm_pos'][own]
+
+    sensed = {}
+    for attractive in (True, False):
+        rows = strip_rows(a['ph_order'], a['ph_starts'], a['ph_pos'], strip, n_strips, dim_env, task['sensing_range'])
+        rows = rows[a['ph_attractive'][rows] == attractive]
+        index = PeriodicCellList(a['ph_pos'][rows], dim_env, task['cell_size'])
+        qi, j, delta = index.query(pos, task['sensing_range'])
+        sensed[attractive] = pheromone_centroid(pos, qi, delta, a['ph_quantity'][rows[j]])
+
+    worms = strip_rows(a['worm_order'], a['worm_starts'], a['worm_pos'], strip, n_strips, dim_env, task['align_dist'])
+    index = PeriodicCellList(a['worm_pos'][worms], dim_env, task['cell_size'])
+    qi, j, _ = index.query(pos, task['align_dist'], include_center=False)
+    align_angle, n_neighbors = mean_heading(qi, a['worm_angle'][worms[j]], len(own))
+
+    # one stream per step and strip, so results only depend on the seed and the number of strips
+    random_angle = np.random.default_rng([task['seed'], strip]).random(len(own)) * np.pi * 2
+    (attraction_pos, attracted), (repulsion_pos, repulsed) = sensed[True], sensed[False]
+    a['new_angle'][own] = steer(pos, align_angle, n_neighbors > 0, attraction_pos, attracted, repulsion_pos, repulsed,
+                                random_angle, *task['weights'])
+
+
+class DecomposedSwarm(WormSwarm):
+    """
+    WormSwarm whose pheromone walk, sensing, alignment and steering are split over worker processes.
+
+    The torus is cut into strips vertical strips, workers processes stepping them in turn. The
+    worms and the pheromone pool live in shared memory for the whole run: workers update them in
+    place and the main process only publishes, every step, the order of the worms and molecules by
+    strip. Each worker walks the molecules of one block of rows of the pool, then handles the worms
+    of its strip from the worms and molecules of the strip and of halos of width align_dist and
+    sensing_range around it. Emission, the move of the worms and the contacts and metrics of
+    WormSimulator stay in the main process.
+    Random draws are made per strip from seeds taken from rng, so a run is reproducible for a given
+    seed and number of strips, whatever the number of workers. Inside a daemonic process, e.g. a
+    worker of sweep, no process can be started and the strips are stepped in the process itself.
+    The speedup over the vectorized backend has not been measured on a multi-core machine.
+    Args:
+        workers: number of worker processes.
+        strips: number of strips, workers by default.
+    """
+    def __init__(self, *args, workers: int = 1, strips: int = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if self.env.pheromone_field:
+            raise ValueError('The decomposed backend only supports pheromone molecules, not pheromone fields')
+        strips = workers if strips is None else strips
+        if workers < 1 or strips < 1:
+            raise ValueError(f'There are {workers} workers and {strips} strips but there must be at least one of each')
+        halo = max(self.sensing_range, self.align_dist)
+        if self.env.dim_env / strips < halo:
+            raise ValueError(f'The {strips} strips are {self.env.dim_env / strips} wide but they must be '
+                             f'at least {halo} wide, the width of their halos')
+        self.workers = workers
+        self.strips = strips
+        self.shared = SharedArrays()
+        # the worms and the pheromones are moved to shared memory once and updated there
+        for name in ('pos', 'angle', 'vel'):
+            value = getattr(self, name)
+            setattr(self, name, self.shared.allocate(f'worm_{name}', value.shape, value.dtype))
+            getattr(self, name)[...] = value
+        self.new_angle = self.shared.allocate('new_angle', self.angle.shape, float)
+        state = self.env.pheromones.get_state()
+        self.env.pheromones = SharedPheromonePool(self.env.dim_env, self.shared)
+        self.env.pheromones.set_state(state)
+        self.index_worms()
+
+        parallel = min(workers, strips) > 1 and not current_process().daemon
+        self.pool = Pool(min(workers, strips)) if parallel else None
+        self._finalizer = weakref.finalize(self, DecomposedSwarm._release, self.pool, self.shared)
+
+    @staticmethod
+    def _release(pool, shared: SharedArrays) -> None:
+        if pool is not None:
+            pool.terminate()
+        shared.close()
+
+    def close(self) -> None:
+        """Stops the workers and moves the worms and pheromones back to private memory, where they stay readable"""
+        for name in ('pos', 'angle', 'vel'):
+            setattr(self, name, getattr(self, name).copy())
+        self.new_angle = None
+        state = self.env.pheromones.get_state()
+        self.env.pheromones = PheromonePool(self.env.dim_env)
+        self.env.pheromones.set_state(state)
+        self.index_worms()
+        self._finalizer()
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.pos[...] = state['pos']
+        self.angle[...] = state['angle']
+        self.vel[...] = state['vel']
+        self.index_worms()
+
+    def index_worms(self) -> None:
+        # the index keeps its own copy, the positions being updated in place
+        self.env.set_index('worm', self.pos.copy(), cell_size=self.cell_size)
+
+    def run(self, function, tasks: list) -> None:
+        if self.pool is not None:
+            self.pool.map(function, tasks)
+        else:
+            for task in tasks:
+                function(task)
+
+    def publish(self, name: str, positions: np.ndarray) -> None:
+        """Writes the strip order of positions and the start of every strip in it to shared memory"""
+        strip = np.minimum((positions[:, 0] * self.strips / self.env.dim_env).astype(int), self.strips - 1)
+        order = np.argsort(strip, kind='stable')
+        self.shared.put(f'{name}_order', order)
+        self.shared.put(f'{name}_starts', np.searchsorted(strip[order], np.arange(self.strips + 1)))
+
+    def diffuse_pheromone(self, rng: np.random.Generator) -> None:
+        pool = self.env.pheromones
+        n = len(pool)
+        seed = int(rng.integers(2 ** 63))
+        specs = self.shared.specs()
+        tasks = [{'specs': specs, 'strip': s, 'rows': (n * s // self.strips, n * (s + 1) // self.strips), 'seed': seed,
+                  'dim_env': self.env.dim_env} for s in range(self.strips)]
+        self.run(walk_strip, tasks)
+        pool.keep(pool.quantity[:n] > 0)
+
+    def step(self) -> None:
+        pool = self.env.pheromones
+        n = len(pool)
+        with phase(self.profiler, 'index'):
+            self.publish('worm', self.pos)
+            self.publish('ph', pool.pos[:n])
+        seed = int(self.rng.integers(2 ** 63))
+        specs = self.shared.specs()
+        tasks = [{'specs': specs, 'strip': s, 'n_strips': self.strips, 'dim_env': self.env.dim_env, 'seed': seed,
+                  'cell_size': self.cell_size, 'sensing_range': self.sensing_range, 'align_dist': self.align_dist,
+                  'weights': (self.align_w, self.attractive_w, self.repulsive_w)} for s in range(self.strips)]
+        with phase(self.profiler, 'sense'):
+            self.run(step_strip, tasks)
+        with phase(self.profiler, 'emit'):
+            self.emit_pheromone()
+        with phase(self.profiler, 'move'):
+            self.angle[...] = self.new_angle
+            self.vel[:, 0] = np.cos(self.angle) * self.speed
+            self.vel[:, 1] = np.sin(self.angle) * self.speed
+            self.pos[...] = (self.pos + self.vel) % self.env.dim_env
+            self.index_worms()
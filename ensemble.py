@@ -0,0 +1,216 @@
+from player import PheromonePool
+from spatial import PeriodicCellList
+from contacts import ContactRecorder, contact_pairs
+from clusters import AggregationMetrics, cluster_labels, polar_order
+from recorder import CollectionPolicy, TrajectoryRecorder, WORM, record_pheromones, pool_density
+from config import NN_MAX_DISTANCE
+from swarm import pheromone_centroid, mean_heading, steer
+from typing import Sequence, Tuple, Union
+import math
+import random
+import numpy as np
+
+
+class ReplicaPheromonePool(PheromonePool):
+    """PheromonePool whose molecules belong to one of n_replicates independent replicates, with ids counted per replicate"""
+    columns = PheromonePool.columns + ('replica',)
+
+    def __init__(self, dim_env: float, n_replicates: int, capacity: int = 1024) -> None:
+        super().__init__(dim_env, capacity)
+        self.replica = np.zeros(capacity, dtype=np.int64)
+        self.next_ids = np.zeros(n_replicates, dtype=np.int64)
+
+    def emit_many(self, positions: np.ndarray, replica: np.ndarray, attractive: bool, quantity: float = 1,
+                   speed: float = 1, decay_rate: float = 0.01) -> None:
+        """Emits molecules at positions grouped by replica, replica giving the replicate of each of them"""
+        n = len(positions)
+        start = self.n
+        super().emit_many(positions, attractive, quantity, speed, decay_rate)
+        counts = np.bincount(replica, minlength=len(self.next_ids))
+        first = np.cumsum(counts) - counts
+        self.ids[start:start + n] = self.next_ids[replica] + np.arange(n) - first[replica]
+        self.replica[start:start + n] = replica
+        self.next_ids += counts
+
+
+class WormEnsemble():
+    """
+    Independent replicates of the vectorized backend, stepped together as one batch.
+
+    The worms of all replicates are kept replicate-major in the same (R * N, 2) arrays and their
+    pheromones in one pool tagged with their replicate, so every rule runs once per step for the
+    whole ensemble. Spatial queries go through cell lists grouped by replicate, keeping every
+    replicate on its own torus, and every replicate draws from its own generators seeded as
+    WormSimulator seeds them: replicate r follows the same trajectory as
+    WormSimulator(backend='vectorized', seed=seeds[r]).
+    Replicates can be retired once they are no longer needed, e.g. when they have converged: their
+    worms and pheromones are dropped from the arrays, so the remaining replicates run faster and
+    still follow the same trajectories.
+    Pheromones are always molecules: there is no ensemble counterpart of the pheromone_field
+    option of WormSimulator.
+    Args:
+        seeds: one seed per replicate.
+        n_agents: number of worms of every replicate.
+        dim_env: side of the torus of every replicate.
+        attractive_w, repulsive_w, align_w: weights shared by all replicates, or one per replicate.
+        decay_rate: quantity every pheromone molecule loses per step.
+        store_contacts: keeps the contact graph of every step of every replicate.
+        collection: what is recorded for every replicate and how often.
+        torus_contacts: measures the contact distance on the torus instead of in the plane.
+    """
+    def __init__(self, seeds: Sequence[int], n_agents: int, dim_env: float,
+                  attractive_w: Union[float, Sequence[float]], repulsive_w: Union[float, Sequence[float]],
+                  align_w: Union[float, Sequence[float]], decay_rate: float = 0.1, store_contacts: bool = False,
+                  collection: CollectionPolicy = None, torus_contacts: bool = False) -> None:
+        self.n_replicates = len(seeds)
+        self.n_agents = n_agents
+        self.dim_env = dim_env
+        self.speed = 5
+        self.align_dist = 10
+        self.sensing_range = 20
+        self.contact_dist = 20
+        self.torus_contacts = torus_contacts
+        self.cell_size = max(self.align_dist, self.sensing_range)
+        self.decay_rate = decay_rate
+        self.steps = 0
+
+        weights = [np.broadcast_to(np.asarray(w, dtype=float), (self.n_replicates,)) for w in (attractive_w, repulsive_w, align_w)]
+        for a, r, l in zip(*weights):
+            if l + a + r > 1:
+                raise Exception(f'The sum of the alignment, attraction and repulsion weights is {l + a + r} but it must be <1.0')
+        self.attractive_w, self.repulsive_w, self.align_w = (np.repeat(w, n_agents) for w in weights)
+
+        # same draws as WormSimulator, replicate by replicate
+        positions = []; angles = []; self.rngs = []
+        for seed in seeds:
+            model_random = random.Random(seed)
+            for i in range(n_agents):
+                positions.append((model_random.uniform(0, dim_env), model_random.uniform(0, dim_env)))
+                angles.append(model_random.random() * math.pi * 2)
+            self.rngs.append(np.random.default_rng(model_random.getrandbits(64)))
+        # replicates still stepped, in the order of their blocks of n_agents rows
+        self.active = np.arange(self.n_replicates)
+        self.replica = np.repeat(self.active, n_agents)
+        self.pos = np.array(positions, dtype=float).reshape(-1, 2)
+        self.angle = np.array(angles, dtype=float)
+        self.vel = np.zeros(self.pos.shape)
+        self.pheromones = ReplicaPheromonePool(dim_env, self.n_replicates)
+        self.index_worms()
+
+        self.contacts = [ContactRecorder(n_agents) for _ in seeds] if store_contacts else None
+        self.metrics = [AggregationMetrics(n_agents) for _ in seeds]
+        self.collection = collection if collection is not None else CollectionPolicy()
+        self.recorders = [TrajectoryRecorder(dim_env=dim_env) for _ in seeds]
+        self.update_contacts()
+        self.collect()
+
+    def __len__(self) -> int:
+        return self.n_replicates
+
+    def retire(self, replicates: Sequence[int]) -> None:
+        """Stops stepping some replicates, their metrics, contacts and recordings ending at the current step"""
+        rows = ~np.isin(self.replica, replicates)
+        self.active = self.active[~np.isin(self.active, replicates)]
+        self.replica = self.replica[rows]
+        for name in ('pos', 'angle', 'vel', 'attractive_w', 'repulsive_w', 'align_w'):
+            setattr(self, name, getattr(self, name)[rows])
+        pool = self.pheromones
+        pool.keep(~np.isin(pool.replica[:len(pool)], replicates))
+        self.index_worms()
+
+    def random_angles(self, replica: np.ndarray) -> np.ndarray:
+        """Draws one uniform angle per row from the generator of its replicate, in row order within each replicate"""
+        counts = np.bincount(replica, minlength=self.n_replicates)
+        draws = np.concatenate([rng.random(c) for rng, c in zip(self.rngs, counts)])
+        angle = np.empty(len(replica))
+        angle[np.argsort(replica, kind='stable')] = draws * math.pi * 2
+        return angle
+
+    def index_worms(self) -> None:
+        self.worm_index = PeriodicCellList(self.pos, self.dim_env, self.cell_size, self.replica, self.n_replicates)
+
+    def index_pheromones(self) -> None:
+        pool = self.pheromones
+        self.pheromone_index = {}
+        for attractive in (True, False):
+            rows = np.nonzero(pool.attractive[:len(pool)] == attractive)[0]
+            index = PeriodicCellList(pool.pos[rows], self.dim_env, self.cell_size, pool.replica[rows], self.n_replicates)
+            self.pheromone_index[attractive] = (index, rows)
+
+    def sense_pheromone(self, attractive: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the weighted centroid of the sensed pheromone of one kind and whether any was sensed, per worm"""
+        index, rows = self.pheromone_index[attractive]
+        qi, j, delta = index.query(self.pos, self.sensing_range, groups=self.replica)
+        return pheromone_centroid(self.pos, qi, delta, self.pheromones.quantity[rows[j]])
+
+    def emit_pheromone(self) -> None:
+        self.pheromones.emit_many(self.pos, self.replica, attractive=True, speed=10, quantity=1, decay_rate=self.decay_rate)
+        self.pheromones.emit_many(self.pos, self.replica, attractive=False, speed=1, quantity=1, decay_rate=self.decay_rate)
+
+    def move(self, attraction_pos: np.ndarray, attracted: np.ndarray,
+              repulsion_pos: np.ndarray, repulsed: np.ndarray) -> None:
+        random_angle = self.random_angles(self.replica)
+        qi, j, _ = self.worm_index.query(self.pos, self.align_dist, include_center=False, groups=self.replica)
+        align_angle, n_neighbors = mean_heading(qi, self.angle[j], len(self.pos))
+        self.angle = steer(self.pos, align_angle, n_neighbors > 0, attraction_pos, attracted, repulsion_pos, repulsed,
+                           random_angle, self.align_w, self.attractive_w, self.repulsive_w)
+
+        self.vel[:, 0] = np.cos(self.angle) * self.speed
+        self.vel[:, 1] = np.sin(self.angle) * self.speed
+        self.pos = (self.pos + self.vel) % self.dim_env
+        self.index_worms()
+
+    def step(self) -> None:
+        pool = self.pheromones
+        pool.walk(self.random_angles(pool.replica[:len(pool)]))
+        self.index_pheromones()
+        attraction_pos, attracted = self.sense_pheromone(attractive=True)
+        repulsion_pos, repulsed = self.sense_pheromone(attractive=False)
+        self.emit_pheromone()
+        self.move(attraction_pos, attracted, repulsion_pos, repulsed)
+        self.steps += 1
+        self.update_contacts()
+        self.collect()
+
+    def update_contacts(self) -> None:
+        """Records the contact graph of every replicate and the aggregation metrics derived from it"""
+        n = self.n_agents
+        i, j = contact_pairs(self.worm_index, self.contact_dist, self.torus_contacts, groups=self.replica)
+        bounds = np.searchsorted(i, np.arange(len(self.active) + 1) * n)
+        edges = [np.stack((i[lo:hi] - k * n, j[lo:hi] - k * n), axis=1).astype(np.uint32)
+                 for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))]
+        labels = cluster_labels(edges, n)
+        nn_distance = self.worm_index.nearest_distance(self.contact_dist, NN_MAX_DISTANCE)
+        for k, r in enumerate(self.active):
+            d = nn_distance[k * n:(k + 1) * n]
+            d = d[np.isfinite(d)]
+            self.metrics[r].record(self.steps, labels[k], d.mean() if len(d) > 0 else np.nan,
+                                   polar_order(self.angle[k * n:(k + 1) * n]))
+            if self.contacts is not None:
+                self.contacts[r].append(edges[k])
+
+    def collect(self) -> None:
+        """Records the current step of every replicate as set by the collection policy"""
+        step = self.steps
+        if not self.collection.collects(step):
+            return
+        kinds = self.collection.row_kinds()
+        pool = self.pheromones
+        for k, r in enumerate(self.active):
+            recorder = self.recorders[r]
+            worms = slice(k * self.n_agents, (k + 1) * self.n_agents)
+            if WORM in kinds:
+                recorder.record(step, np.arange(self.n_agents), np.full(self.n_agents, WORM), self.pos[worms], self.vel[worms])
+            record_pheromones(recorder, step, pool, kinds, pool.replica[:len(pool)] == r)
+            if self.collection.pheromone_mode == 'histogram':
+                recorder.record_density(step, self.pheromone_density(r, True), self.pheromone_density(r, False))
+
+    def pheromone_density(self, replicate: int, attractive: bool) -> np.ndarray:
+        """Returns the (bins, bins) histogram of one pheromone kind over the torus of a replicate, weighted by quantity"""
+        pool = self.pheromones
+        return pool_density(pool, attractive, self.collection.bins, pool.replica[:len(pool)] == replicate)
+
+    def worm_positions(self, replicate: int) -> np.ndarray:
+        """Returns the (N, 2) worm positions of a replicate that has not been retired"""
+        k = list(self.active).index(replicate)
+        return self.pos[k * self.n_agents:(k + 1) * self.n_agents]
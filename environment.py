@@ -2,26 +2,214 @@ import mesa
 from mesa.space import Coordinate
 from mesa.agent import Agent
 from typing import Sequence, Tuple
+from spatial import PeriodicCellList
+from player import Pheromone, PheromonePool
+import math
+import numpy as np
 
 
 class WormEnvironment(mesa.space.ContinuousSpace):
 
-    def __init__(self, dim_env: float, torus: bool) -> None:
+    def __init__(self, dim_env: float, torus: bool, pheromone_field: bool = False, field_resolution: float = 1,
+                  decay_rate: float = 0.1) -> None:
         super().__init__(dim_env, dim_env, torus)
         self.dim_env = dim_env
         # Additional attributes to track foraging efficiency metrics
         self.foraging_attempts = 0
         self.successful_foraging_attempts = 0
 
+        # Concentration grids replacing the pheromone molecules, with the same speed and decay emitted by SolitaryWorm
+        self.pheromone_field = pheromone_field
+        if pheromone_field:
+            self.attractive_field = PheromoneField(dim_env, field_resolution, speed=10, decay_rate=decay_rate)
+            self.repulsive_field = PheromoneField(dim_env, field_resolution, speed=1, decay_rate=decay_rate)
+        else:
+            self.pheromones = PheromonePool(dim_env)
+
+        # per-kind spatial indexes ('worm', 'attractive', 'repulsive'), each a (PeriodicCellList, items) pair
+        self.indexes = {}
+        self.index_margin = {}
+        self.unindexed = {}
+        # StepProfiler counting the neighbour candidates examined, set by WormSimulator
+        self.profiler = None
+
+    def diffuse_pheromone(self, rng: np.random.Generator) -> None:
+        """Advances the pheromone fields or molecules by one step"""
+        if self.pheromone_field:
+            self.attractive_field.step()
+            self.repulsive_field.step()
+        else:
+            self.pheromones.step(rng)
+
+    def set_index(self, kind: str, positions: np.ndarray, items: list = None, cell_size: float = 20) -> PeriodicCellList:
+        """Indexes the positions of one agent kind, optionally with the agents or rows they belong to"""
+        if self.profiler is not None and kind in self.indexes:
+            self.profiler.count(f'{kind}_candidates', self.indexes[kind][0].examined)
+        index = PeriodicCellList(positions, self.dim_env, cell_size)
+        self.indexes[kind] = (index, items)
+        return index
+
+    def count_candidates(self) -> None:
+        """Moves the number of candidates examined by the queries of the current indexes to the profiler"""
+        for kind, (index, _) in self.indexes.items():
+            self.profiler.count(f'{kind}_candidates', index.examined)
+            index.examined = 0
+
+    def index_agents(self, cell_size: float = 20) -> None:
+        """
+        Rebuilds the spatial index of the worms currently placed.
+        Worms keep moving until the next rebuild, so the index is searched with a margin equal to
+        their fastest speed, worms placed since are kept aside, and every candidate is checked
+        against its current position. Queries thus return the worms get_neighbors returns, in the
+        same order, as long as the positions it reads are up to date.
+        """
+        worms = list(self._agent_to_index)
+        self.set_index('worm', [a.pos for a in worms], worms, cell_size)
+        self.index_margin['worm'] = max((a.speed for a in worms), default=0)
+        self.unindexed['worm'] = []
+
+    def index_pheromones(self, cell_size: float = 20) -> None:
+        """
+        Rebuilds the spatial index of both pheromone kinds. Molecules only move and expire in
+        PheromonePool.step, so the index stays exact until then; molecules emitted after the
+        rebuild are scanned separately.
+        """
+        pool = self.pheromones
+        for kind, attractive in (('attractive', True), ('repulsive', False)):
+            rows = np.nonzero(pool.attractive[:len(pool)] == attractive)[0]
+            self.set_index(kind, pool.pos[rows], rows, cell_size)
+        self.n_indexed = len(pool)
+
+    def place_agent(self, agent: Agent, pos: Coordinate) -> None:
+        super().place_agent(agent, pos)
+        if 'worm' in self.unindexed:
+            self.unindexed['worm'].append(agent)
+
+    def query_index(self, kind: str, pos: Coordinate, radius: float, include_center: bool) -> list[Agent]:
+        index, items = self.indexes[kind]
+        found, _ = index.query_point(pos, radius + self.index_margin[kind], include_center)
+        # in the order of the space, as get_neighbors returns them
+        candidates = [items[i] for i in np.sort(found)] + self.unindexed[kind]
+        if self.profiler is not None:
+            self.profiler.count(f'{kind}_candidates', len(self.unindexed[kind]))
+        neighbors = []
+        for a in candidates:
+            # agents removed since the rebuild have no position anymore
+            if a.pos is None:
+                continue
+            dx = abs(a.pos[0] - pos[0]); dy = abs(a.pos[1] - pos[1])
+            dx = min(dx, self.dim_env - dx); dy = min(dy, self.dim_env - dy)
+            d2 = dx ** 2 + dy ** 2
+            if d2 <= radius ** 2 and (include_center or d2 > 0):
+                neighbors.append(a)
+        return neighbors
+
     def get_neighbor_worms(self, pos: Coordinate, radius: int = 1, include_center: bool = False) -> list[Agent]:
+        if 'worm' in self.indexes:
+            return self.query_index('worm', pos, radius, include_center)
+        if self.profiler is not None:
+            self.profiler.count('worm_candidates', len(self._agent_to_index))
+        # worms set their position without move_agent, so the positions get_neighbors caches are
+        # rebuilt to the current ones, as the pheromone agents placed every step used to do
+        self._invalidate_agent_cache()
         agents = list(self.get_neighbors(pos, radius, include_center))
         worms = [a for a in agents if a.is_worm]
         return worms
     
-    def get_pheromone(self, pos: Coordinate, radius: int = 1, include_center: bool = True) -> list[Agent]:
-        agents = list(self.get_neighbors(pos, radius, include_center))
-        pheromones = [a for a in agents if not a.is_worm]
-        return pheromones 
+    def pheromone_rows(self, pos: Coordinate, radius: float, attractive: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows of the pool holding the pheromone molecules of one kind within radius of a
+        position, in row order, and their (K, 2) displacements from pos on the torus.
+        """
+        pool = self.pheromones
+        kind = 'attractive' if attractive else 'repulsive'
+        if kind in self.indexes:
+            index, rows = self.indexes[kind]
+            found, delta = index.query_point(pos, radius)
+            # in row order, as the scan of the whole pool finds them
+            order = np.argsort(rows[found])
+            rows = rows[found][order]; delta = delta[order]
+            new_rows = np.arange(self.n_indexed, len(pool))
+            new_rows = new_rows[pool.attractive[new_rows] == attractive]
+        else:
+            rows = np.zeros(0, dtype=int); delta = np.zeros((0, 2))
+            new_rows = np.nonzero(pool.attractive[:len(pool)] == attractive)[0]
+        if self.profiler is not None:
+            self.profiler.count(f'{kind}_candidates', len(new_rows))
+        if len(new_rows) > 0:
+            new_delta = (pool.pos[new_rows] - pos + self.dim_env / 2) % self.dim_env - self.dim_env / 2
+            inside = (new_delta ** 2).sum(axis=1) <= radius ** 2
+            rows = np.concatenate((rows, new_rows[inside])); delta = np.concatenate((delta, new_delta[inside]))
+        return rows, delta
+
+    def get_pheromone_deltas(self, pos: Coordinate, radius: float, attractive: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the pheromone molecules of one kind within radius of a position, as SolitaryWorm senses them.
+
+        Returns:
+            Their (K, 2) displacements from pos on the torus and their (K,) quantities.
+        """
+        rows, delta = self.pheromone_rows(pos, radius, attractive)
+        return delta, self.pheromones.quantity[rows]
+
+    def get_pheromone(self, pos: Coordinate, radius: int = 1, include_center: bool = True) -> list[Pheromone]:
+        """Returns views of the pheromone molecules of both kinds within radius, oldest first"""
+        return sum(self.get_pheromone_kinds(pos, radius, include_center), [])
+
+    def get_pheromone_kinds(self, pos: Coordinate, radius: int = 1, include_center: bool = True) -> Tuple[list[Pheromone], list[Pheromone]]:
+        """Returns views of the attractive and the repulsive pheromone molecules within radius"""
+        kinds = []
+        for attractive in (True, False):
+            rows, delta = self.pheromone_rows(pos, radius, attractive)
+            if not include_center:
+                rows = rows[(delta ** 2).sum(axis=1) > 0]
+            kinds.append(self.pheromones.molecules(rows))
+        return kinds[0], kinds[1]
+
+    def get_pheromone_many(self, points: np.ndarray, radius: float, attractive: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the pheromone molecules of one kind within radius of many positions, from an index
+        rebuilt by index_pheromones since the last emission.
+
+        Returns:
+            The index of the position each match belongs to, the (K, 2) displacements of the
+            molecules from it and their (K,) quantities.
+        """
+        index, rows = self.indexes['attractive' if attractive else 'repulsive']
+        qi, j, delta = index.query(points, radius)
+        return qi, delta, self.pheromones.quantity[rows[j]]
+
+    def get_neighborhood(self, pos: Coordinate, moore: bool, include_center: bool = False, radius: int = 1) -> Sequence[Coordinate]:
+        """
+        Returns the cells of a unit grid over the environment around a cell, as
+        mesa.space.MultiGrid.get_neighborhood does.
+        Args:
+            pos: Coordinate tuple for the neighborhood to get.
+            moore: If True, return Moore neighborhood
+                   (including diagonals)
+                   If False, return Von Neumann neighborhood
+                   (exclude diagonals)
+            include_center: If True, return the (x, y) cell as well.
+            radius: radius, in cells, of neighborhood to get.
+
+        Returns:
+            A list of coordinate tuples, wrapped around the torus or cut at the border.
+        """
+        x, y = pos
+        cells = {}
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if not moore and abs(dx) + abs(dy) > radius:
+                    continue
+                if dx == 0 and dy == 0 and not include_center:
+                    continue
+                cell = (x + dx, y + dy)
+                if self.torus:
+                    cell = (cell[0] % self.dim_env, cell[1] % self.dim_env)
+                elif self.out_of_bounds(cell):
+                    continue
+                cells[cell] = None
+        return list(cells)
 
     def get_neighborhood_dist(self, pos: Coordinate, moore: bool = False, radius: int = 1) -> Sequence[Coordinate]:
         """
@@ -73,3 +261,79 @@ class WormEnvironment(mesa.space.ContinuousSpace):
         neighborhood = self.get_neighborhood_dist(pos, moore, radius)
         neighbors = list(self.iter_cell_list_contents(neighborhood))
         return [n for n in neighbors if n.is_worm()]
+
+
+class PheromoneField():
+    """
+    Pheromone concentration on a periodic grid covering the whole environment.
+
+    Every step the field is convolved with a Gaussian matching the variance of the random walk
+    of a pheromone molecule with the same speed, and scaled by (1 - decay_rate). Deposits and
+    sensing cost depend only on the grid size, not on how many molecules were emitted.
+    Decay is exponential with mean lifetime 1 / decay_rate, where molecules decay linearly.
+    """
+    min_concentration = 1e-6
+
+    def __init__(self, dim_env: float, resolution: float = 1, speed: float = 1, decay_rate: float = 0.01) -> None:
+        self.dim_env = dim_env
+        self.n_cells = max(1, round(dim_env / resolution))
+        self.cell_size = dim_env / self.n_cells
+        self.decay_rate = decay_rate
+        self.grid = np.zeros((self.n_cells, self.n_cells))
+
+        # a step of length speed in a uniform direction has variance speed^2 / 2 along each axis
+        k = 2 * np.pi * np.fft.fftfreq(self.n_cells, d=self.cell_size)
+        kr = 2 * np.pi * np.fft.rfftfreq(self.n_cells, d=self.cell_size)
+        k2 = k[:, None] ** 2 + kr[None, :] ** 2
+        self.kernel = np.exp(-0.5 * (speed ** 2 / 2) * k2) * (1 - decay_rate)
+        self._disks = {}
+
+    def cell_index(self, positions: np.ndarray) -> np.ndarray:
+        return np.floor(np.asarray(positions) / self.cell_size).astype(int) % self.n_cells
+
+    def deposit(self, positions: np.ndarray, quantity: float = 1) -> None:
+        """Adds quantity to the cells containing the given positions, either a single (x, y) or an (N, 2) array"""
+        idx = self.cell_index(np.atleast_2d(positions))
+        np.add.at(self.grid, (idx[:, 0], idx[:, 1]), quantity)
+
+    def step(self) -> None:
+        self.grid = np.fft.irfft2(np.fft.rfft2(self.grid) * self.kernel, s=self.grid.shape)
+        np.maximum(self.grid, 0, out=self.grid)
+
+    def disk(self, radius: float) -> np.ndarray:
+        """Returns the cell offsets whose centres lie within radius of the centre cell"""
+        if radius not in self._disks:
+            r = math.ceil(radius / self.cell_size)
+            dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1), indexing='ij')
+            inside = (dx ** 2 + dy ** 2) * self.cell_size ** 2 <= radius ** 2
+            self._disks[radius] = np.stack((dx[inside], dy[inside]), axis=1)
+        return self._disks[radius]
+
+    def centroid(self, positions: np.ndarray, radius: float, chunk: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the concentration-weighted centroid of the field within radius of each position.
+        Args:
+            positions: (x, y) coordinate or (N, 2) array of coordinates.
+            radius: sensing radius.
+            chunk: number of positions processed at once, bounding memory to chunk * disk size.
+
+        Returns:
+            An (N, 2) array of centroids, unwrapped to lie near their position, and an (N,) boolean
+            array telling whether any pheromone was sensed at all.
+        """
+        positions = np.atleast_2d(np.asarray(positions, dtype=float))
+        offsets = self.disk(radius)
+        centroids = np.zeros(positions.shape)
+        sensed = np.zeros(len(positions), dtype=bool)
+        for start in range(0, len(positions), chunk):
+            pos = positions[start:start + chunk]
+            idx = self.cell_index(pos)
+            cx = (idx[:, 0, None] + offsets[None, :, 0]) % self.n_cells
+            cy = (idx[:, 1, None] + offsets[None, :, 1]) % self.n_cells
+            weights = self.grid[cx, cy]
+            total = weights.sum(axis=1)
+            ok = total > self.min_concentration
+            mean_offset = (weights @ offsets) / np.where(ok, total, 1)[:, None]
+            centroids[start:start + chunk] = (idx + 0.5 + mean_offset) * self.cell_size
+            sensed[start:start + chunk] = ok
+        return centroids, sensed
@@ -0,0 +1,212 @@
+from tqdm import tqdm
+
+import run
+import sweep
+from typing import List, Tuple
+import numpy as np
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+Point = Tuple[float, float, float]
+
+
+def simplex_grid(spacing: float) -> List[Point]:
+    """
+    Returns the (attractive_w, repulsive_w, align_w) points of a grid of step spacing whose weights
+    sum to less than 1, as a worm sensing nothing has no heading when the random weight is 0.
+    """
+    ticks = [round(i * spacing, 6) for i in range(int(round(1 / spacing)) + 1)]
+    return [p for p in itertools.product(ticks, repeat=3) if sweep.valid_weights(*p)]
+
+def score_job(job):
+    """Runs one replicate and scores it with its mean largest cluster over the last tail steps, as a fraction of the worms"""
+    attractive_w, repulsive_w, align_w, test_n, seed, spacing, tail, convergence, store_root, backend = job
+    store = sweep.open_store(store_root)
+    start = time.perf_counter()
+    metrics = run.main(attractive_w, repulsive_w, align_w, test_n, seed=seed, positions_path=None,
+                       convergence=convergence, store=store, backend=backend)
+    if store is not None:
+        store.close()
+    largest = np.asarray(metrics.values['largest_cluster'][-tail:], dtype=float)
+    return {'attractive_w': attractive_w, 'repulsive_w': repulsive_w, 'align_w': align_w, 'test_n': test_n,
+            'seed': seed, 'spacing': spacing, 'backend': backend, 'wall_time': time.perf_counter() - start,
+            'stop_step': int(metrics.values['step'][-1]), 'score': largest.mean() / metrics.n_agents}
+
+
+class AdaptiveExplorer():
+    """
+    Adaptive sampling of the weight simplex that locates the boundary between aggregated and
+    dispersed behaviour with fewer runs than a dense grid.
+
+    Sampling starts from a grid of step spacing with replicates runs per point. A point is
+    aggregated when the mean score of its replicates reaches threshold, the score of a run being
+    the fraction of the worms in its largest cluster over its last tail steps. Every round then
+    spends up to round_runs runs, by decreasing priority, on
+    - the midpoint of every edge between neighbouring points on either side of threshold, by
+      score difference, as long as the new spacing stays above min_spacing,
+    - extra replicates for the points whose replicate scores have a standard deviation above
+      max_std, by standard deviation, up to max_replicates runs per point,
+    until budget runs have been done or nothing is left to refine. Points are neighbours when they
+    are within the spacing of either of them along every weight.
+    """
+    def __init__(self, spacing: float = 0.25, replicates: int = 2, budget: int = 200, threshold: float = 0.5,
+                  max_std: float = 0.15, max_replicates: int = 6, min_spacing: float = 0.02, tail: int = 50,
+                  round_runs: int = 20, base_seed: int = 0) -> None:
+        if not 0 < min_spacing <= spacing <= 1:
+            raise ValueError(f'The spacing is {spacing} and the minimum spacing {min_spacing} but they must satisfy 0 < min_spacing <= spacing <= 1')
+        self.spacing = spacing
+        self.replicates = replicates
+        self.budget = budget
+        self.threshold = threshold
+        self.max_std = max_std
+        self.max_replicates = max_replicates
+        self.min_spacing = min_spacing
+        self.tail = tail
+        self.round_runs = round_runs
+        self.base_seed = base_seed
+        # (attractive_w, repulsive_w, align_w) -> spacing it was sampled at, replicates scheduled and their scores
+        self.points = {}
+        self.n_runs = 0
+
+    def add(self, record: dict) -> None:
+        """Adds the score of a run, as returned by score_job"""
+        point = self.points.setdefault((record['attractive_w'], record['repulsive_w'], record['align_w']),
+                                       {'spacing': record['spacing'], 'n': 0, 'scores': []})
+        point['n'] = max(point['n'], record['test_n'] + 1)
+        point['scores'].append(record['score'])
+        self.n_runs += 1
+
+    def schedule(self, point: Point, spacing: float, n: int) -> List[tuple]:
+        """Returns the arguments of score_job for n more replicates of a point"""
+        entry = self.points.setdefault(point, {'spacing': spacing, 'n': 0, 'scores': []})
+        tests = range(entry['n'], entry['n'] + n)
+        entry['n'] += n
+        return [point + (t, sweep.run_seed(self.base_seed, *point, t), entry['spacing']) for t in tests]
+
+    def initial_jobs(self, done: set = frozenset()) -> List[tuple]:
+        """Returns the jobs of the initial grid, but for the (point, test_n) pairs in done"""
+        jobs = []
+        for point in simplex_grid(self.spacing):
+            entry = self.points.setdefault(point, {'spacing': self.spacing, 'n': 0, 'scores': []})
+            entry['n'] = max(entry['n'], self.replicates)
+            jobs += [point + (t, sweep.run_seed(self.base_seed, *point, t), self.spacing)
+                     for t in range(self.replicates) if (point, t) not in done]
+        return jobs
+
+    def summary(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the scored points with their spacing, mean score, score standard deviation and number of runs"""
+        scored = [(p, e) for p, e in self.points.items() if len(e['scores']) > 0]
+        points = np.array([p for p, _ in scored], dtype=float).reshape(-1, 3)
+        spacing = np.array([e['spacing'] for _, e in scored])
+        mean = np.array([np.mean(e['scores']) for _, e in scored])
+        std = np.array([np.std(e['scores']) for _, e in scored])
+        n = np.array([len(e['scores']) for _, e in scored])
+        return points, spacing, mean, std, n
+
+    def disagreeing_edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns both ends of the neighbour edges crossing threshold that have not been split yet, and their length"""
+        points, spacing, mean, _, _ = self.summary()
+        distance = np.abs(points[:, None] - points[None]).max(axis=2)
+        reach = np.maximum(spacing[:, None], spacing[None]) * (1 + 1e-9)
+        aggregated = mean >= self.threshold
+        i, j = np.nonzero((distance <= reach) & (aggregated[:, None] != aggregated[None]))
+        keep = i < j
+        i, j = i[keep], j[keep]
+        midpoints = np.round((points[i] + points[j]) / 2, 6)
+        unsplit = np.array([tuple(m) not in self.points for m in midpoints], dtype=bool)
+        return i[unsplit], j[unsplit], distance[i, j][unsplit]
+
+    def refine(self) -> List[tuple]:
+        """Returns the jobs of the next round, the most informative first"""
+        points, _, mean, std, n = self.summary()
+        actions = []
+        i, j, length = self.disagreeing_edges()
+        for a, b, d in zip(i, j, length):
+            if d / 2 >= self.min_spacing:
+                actions.append((abs(mean[a] - mean[b]), 'split', tuple(np.round((points[a] + points[b]) / 2, 6)), d / 2))
+        for k in np.nonzero((std > self.max_std) & (n < self.max_replicates))[0]:
+            actions.append((std[k], 'replicate', tuple(points[k]), None))
+        actions.sort(key=lambda action: -action[0])
+
+        jobs = []
+        left = min(self.round_runs, self.budget - self.n_runs)
+        for _, kind, point, spacing in actions:
+            if left <= 0:
+                break
+            if kind == 'split' and point in self.points:
+                # midpoint shared with an edge of higher priority
+                continue
+            count = self.replicates if kind == 'split' else min(self.replicates, self.max_replicates - self.points[point]['n'])
+            count = min(count, left)
+            if count <= 0:
+                continue
+            jobs += self.schedule(tuple(float(w) for w in point), spacing, count)
+            left -= count
+        return jobs
+
+    def boundary(self) -> np.ndarray:
+        """
+        Returns the (B, 3) estimate of the boundary: one point on every finest edge crossing
+        threshold, where the linear interpolation of the mean scores of its ends reaches it.
+        """
+        points, _, mean, _, _ = self.summary()
+        i, j, _ = self.disagreeing_edges()
+        s = (self.threshold - mean[i]) / (mean[j] - mean[i])
+        return points[i] + s[:, None] * (points[j] - points[i])
+
+    def explore(self, jobs: int = 1, samples_path: str = 'explore_samples.jsonl', convergence: dict = None,
+                store: str = None, backend: str = 'agent') -> None:
+        """
+        Runs the rounds on a backend of WormSimulator over a process pool, appending every run to
+        samples_path as it completes. The runs of the same backend already in samples_path are read
+        back first, so an interrupted exploration resumes where it stopped: the runs of the initial
+        grid still missing are done before refining. convergence and store are passed on to
+        run.main as in sweep.
+        """
+        done = set()
+        if os.path.exists(samples_path):
+            with open(samples_path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        # samples written before runs had a backend are agent-based runs
+                        if record.get('backend', 'agent') != backend:
+                            continue
+                        self.add(record)
+                        done.add(((record['attractive_w'], record['repulsive_w'], record['align_w']), record['test_n']))
+        todo = self.initial_jobs(done)
+        if len(todo) > self.budget - self.n_runs:
+            print(f'The initial grid needs {len(todo)} more runs, more than the {self.budget - self.n_runs} left in the budget: '
+                  'only the first are run')
+            todo = todo[:max(self.budget - self.n_runs, 0)]
+        if len(todo) == 0:
+            todo = self.refine()
+
+        os.makedirs(os.path.dirname(samples_path) or '.', exist_ok=True)
+        with Pool(jobs) as pool, open(samples_path, 'a') as f:
+            while len(todo) > 0:
+                print(f'{len(todo)} runs to do, {self.n_runs} of {self.budget} done')
+                todo = [job + (self.tail, convergence, store, backend) for job in todo]
+                for record in tqdm(pool.imap_unordered(score_job, todo), total=len(todo)):
+                    self.add(record)
+                    f.write(json.dumps(record) + '\n')
+                    f.flush()
+                todo = self.refine()
+
+    def save(self, points_path: str, boundary_path: str) -> None:
+        """Writes the scored points and the boundary estimate as CSV files"""
+        points, spacing, mean, std, n = self.summary()
+        table = np.column_stack((points, spacing, n, mean, std, mean >= self.threshold))
+        np.savetxt(points_path, table, delimiter=',', fmt=['%.6f'] * 4 + ['%d', '%.6f', '%.6f', '%d'], comments='',
+                   header='attractive_w,repulsive_w,align_w,spacing,runs,score_mean,score_std,aggregated')
+        np.savetxt(boundary_path, self.boundary(), delimiter=',', fmt='%.6f', comments='',
+                   header='attractive_w,repulsive_w,align_w')
+
+
+if __name__ == "__main__":
+    import cli
+    raise SystemExit(1 if cli.main(['explore'] + sys.argv[1:]) else 0)
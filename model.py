@@ -1,53 +1,329 @@
 import mesa
 from player import SolitaryWorm
 from environment import WormEnvironment
+from swarm import WormSwarm
+from spatial import PeriodicCellList
+from contacts import ContactRecorder, contact_pairs, edges_to_dense
+from clusters import AggregationMetrics, polar_order
+from convergence import ConvergenceCriterion
+from config import BACKENDS, NN_MAX_DISTANCE
+from recorder import CollectionPolicy, TrajectoryRecorder, WORM, record_pheromones, pool_density, density_histogram
+from profiling import StepProfiler, phase
+import io
+import json
 import math
-from typing import Tuple
+from typing import List, Tuple
 import numpy as np
 
 class WormSimulator(mesa.Model):
     def __init__(self, n_agents: int, dim_env: float, max_steps: int, multispot: bool, num_spots: int, clustered: bool,
-                  attractive_w: float, repulsive_w: float, align_w: float):
+                  attractive_w: float, repulsive_w: float, align_w: float, pheromone_field: bool = False,
+                  field_resolution: float = 1, backend: str = 'agent', seed: int = None,
+                  spatial_index: bool = True, contacts_path: str = None, collection: CollectionPolicy = None,
+                  decay_rate: float = 0.1, profile: bool = False, store_contacts: bool = True, workers: int = 1,
+                  strips: int = None, convergence: dict = None, torus_contacts: bool = False):
         super().__init__()
+        # constructor arguments a checkpoint needs to rebuild the model
+        self.config = dict(n_agents=n_agents, dim_env=dim_env, max_steps=max_steps, multispot=multispot, num_spots=num_spots,
+                           clustered=clustered, attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w,
+                           pheromone_field=pheromone_field, field_resolution=field_resolution, backend=backend, seed=seed,
+                           spatial_index=spatial_index, decay_rate=decay_rate, store_contacts=store_contacts,
+                           workers=workers, strips=strips, convergence=convergence, torus_contacts=torus_contacts)
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend {backend}, it must be either agent, vectorized or decomposed')
+        # the strips of the decomposed backend share pheromone molecules, there is no decomposed field
+        if pheromone_field and backend == 'decomposed':
+            raise ValueError('The decomposed backend only supports pheromone molecules, not pheromone fields')
+        self.backend = backend
+        # the agent-based path answers radius queries from per-step spatial indexes, by default as they
+        # return the same neighbours, in the same order, as the scans of the whole space and pool
+        self.spatial_index = spatial_index and backend == 'agent'
+        # worms are in contact within distance 20 in the plane, or on the torus if torus_contacts
+        self.torus_contacts = torus_contacts
         self.schedule = mesa.time.RandomActivation(self)
-        self.env = WormEnvironment(dim_env, torus=True)
+        self.env = WormEnvironment(dim_env, torus=True, pheromone_field=pheromone_field, field_resolution=field_resolution,
+                                   decay_rate=decay_rate)
+        # per-phase timers and counters of step, None unless profiling
+        self.profiler = StepProfiler() if profile else None
+        self.env.profiler = self.profiler
 
-        self.adj_matrix = np.zeros((max_steps + 2, n_agents, n_agents))
+        self.n_agents = n_agents
+        # contact graph of every step, streamed to contacts_path if given, None if not stored at all
+        self.contacts = None
+        if store_contacts or contacts_path is not None:
+            self.contacts = ContactRecorder(n_agents, contacts_path)
+        self.metrics = AggregationMetrics(n_agents)
+        # optional early stop marking the metrics as converged, convergence holding the arguments of ConvergenceCriterion
+        self.criterion = ConvergenceCriterion(**convergence) if convergence is not None else None
 
+        self.swarm = None
+        # same draws for every backend, so they all start from the same state
         if clustered:
-            self.clustered_agents(n_agents, multispot, num_spots)
+            positions, angles = self.clustered_agents(n_agents, multispot, num_spots)
         else:
+            positions = []; angles = []
             for i in range(n_agents):
-                pos = (self.random.uniform(0, dim_env), self.random.uniform(0, dim_env))
-                angle = self.random.random() * math.pi * 2
-                a = WormSimulator.create_agent(self, self.next_id(), pos, angle, attractive_w, repulsive_w, align_w)
+                positions.append((self.random.uniform(0, dim_env), self.random.uniform(0, dim_env)))
+                angles.append(self.random.random() * math.pi * 2)
+        if backend == 'agent':
+            for pos, angle in zip(positions, angles):
+                a = WormSimulator.create_agent(self, self.next_id(), pos, angle, attractive_w, repulsive_w, align_w, decay_rate)
                 self.schedule.add(a)
                 self.env.place_agent(a, a.pos)
 
-        self.adj_matrix[self.schedule.steps] = self.get_adj_matrix()
+        # generator of the bulk draws (pheromone random walks, vectorized worms)
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+        if backend == 'vectorized':
+            self.swarm = WormSwarm(self.env, positions, angles, self.rng,
+                                   attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w,
+                                   sensing_range=20, align_dist=10, decay_rate=decay_rate, profiler=self.profiler)
+        elif backend == 'decomposed':
+            # vectorized rules split over strips of the torus, stepped by workers processes
+            from decomposition import DecomposedSwarm
+            self.swarm = DecomposedSwarm(self.env, positions, angles, self.rng,
+                                         attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w,
+                                         sensing_range=20, align_dist=10, decay_rate=decay_rate, profiler=self.profiler,
+                                         workers=workers, strips=strips)
 
-        self.datacollector = mesa.DataCollector(agent_reporters={'pos': 'pos', 'velx': 'velx', 'vely': 'vely', 
-                                                                 'worm': 'is_worm', 'attractive': 'attractive'})
-        self.datacollector.collect(self)
+        if self.spatial_index:
+            self.env.index_agents(cell_size=20)
+        self.update_contacts()
+
+        self.collection = collection if collection is not None else CollectionPolicy()
+        self.config['collection'] = dict(kinds=self.collection.kinds, interval=self.collection.interval,
+                                         pheromone_mode=self.collection.pheromone_mode, bins=self.collection.bins)
+        self.recorder = TrajectoryRecorder(dim_env=dim_env)
+        self.collect()
 
     def step(self) -> None:
-        self.schedule.step()
-        self.adj_matrix[self.schedule.steps] = self.get_adj_matrix()
-        self.datacollector.collect(self)
+        with phase(self.profiler, 'total'):
+            with phase(self.profiler, 'pheromone_step'):
+                if self.swarm is not None:
+                    self.swarm.diffuse_pheromone(self.rng)
+                else:
+                    self.env.diffuse_pheromone(self.rng)
+            if self.spatial_index and not self.env.pheromone_field:
+                with phase(self.profiler, 'index'):
+                    self.env.index_pheromones(cell_size=20)
+            if self.swarm is None:
+                self.schedule.step()
+            else:
+                self.swarm.step()
+                self.schedule.steps += 1
+                self.schedule.time += 1
+            if self.spatial_index:
+                with phase(self.profiler, 'index'):
+                    self.env.index_agents(cell_size=20)
+            with phase(self.profiler, 'contacts'):
+                self.update_contacts()
+            if self.criterion is not None:
+                self.criterion.update(self.metrics)
+            with phase(self.profiler, 'collect'):
+                self.collect()
+        if self.profiler is not None:
+            if not self.env.pheromone_field:
+                self.profiler.count('live_pheromones', len(self.env.pheromones))
+            self.env.count_candidates()
+            self.profiler.end_step(self.schedule.steps)
+
+    def collect(self) -> None:
+        """Records the current step as set by the collection policy"""
+        step = self.schedule.steps
+        if not self.collection.collects(step):
+            return
+        kinds = self.collection.row_kinds()
+        if WORM in kinds:
+            if self.swarm is not None:
+                n = len(self.swarm)
+                self.recorder.record(step, np.arange(n), np.full(n, WORM), self.swarm.pos, self.swarm.vel)
+            else:
+                worms = self.worms()
+                self.recorder.record(step, [a.unique_id for a in worms], np.full(len(worms), WORM),
+                                     [a.pos for a in worms], [(a.velx, a.vely) for a in worms])
+        if not self.env.pheromone_field:
+            record_pheromones(self.recorder, step, self.env.pheromones, kinds)
+        if self.collection.pheromone_mode == 'histogram':
+            self.recorder.record_density(step, self.pheromone_density(True), self.pheromone_density(False))
+
+    def pheromone_density(self, attractive: bool) -> np.ndarray:
+        """Returns the (bins, bins) histogram of one pheromone kind over the environment, weighted by quantity"""
+        bins = self.collection.bins
+        if not self.env.pheromone_field:
+            return pool_density(self.env.pheromones, attractive, bins)
+        field = self.env.attractive_field if attractive else self.env.repulsive_field
+        centres = (np.arange(field.n_cells) + 0.5) * field.cell_size
+        x, y = np.meshgrid(centres, centres, indexing='ij')
+        return density_histogram(np.stack((x.ravel(), y.ravel()), axis=1), field.grid.ravel(), bins, self.env.dim_env)
+
+    def worms(self) -> List[SolitaryWorm]:
+        """
+        Returns the worms of the agent backend by unique_id. RandomActivation shuffles its agents
+        every step, so this is the order that keeps worm i the same worm at every step.
+        """
+        return sorted(self.schedule.agents, key=lambda a: a.unique_id)
+
+    def worm_positions(self) -> np.ndarray:
+        """Returns a copy of the (N, 2) array of worm positions, whatever the backend"""
+        if self.swarm is not None:
+            return self.swarm.pos.copy()
+        return np.array([a.pos for a in self.worms()])
+
+    def update_contacts(self) -> None:
+        """Records the contact graph of the current step and the aggregation metrics derived from it"""
+        index = self.worm_index()
+        edges = self.get_contacts(index)
+        if self.contacts is not None:
+            self.contacts.append(edges)
+        nn_distance = index.nearest_distance(20, NN_MAX_DISTANCE)
+        nn_distance = nn_distance[np.isfinite(nn_distance)]
+        self.metrics.update(self.schedule.steps, edges, nn_distance.mean() if len(nn_distance) > 0 else np.nan,
+                            polar_order(self.worm_angles()))
+
+    def worm_angles(self) -> np.ndarray:
+        """Returns the (N,) array of worm headings, whatever the backend"""
+        if self.swarm is not None:
+            return self.swarm.angle
+        return np.array([a.angle for a in self.worms()])
+
+    def worm_index(self) -> PeriodicCellList:
+        """Returns a spatial index of the worm positions, row i being worm i of worm_positions"""
+        if self.swarm is not None:
+            return self.env.indexes['worm'][0]
+        return PeriodicCellList(self.worm_positions(), self.env.dim_env, 20)
+
+    def get_contacts(self, index: PeriodicCellList = None) -> np.ndarray:
+        """Returns the (E, 2) uint32 edge list of the worms in contact, with i < j"""
+        if index is None:
+            index = self.worm_index()
+        i, j = contact_pairs(index, 20, self.torus_contacts) # max distance: 20
+        return np.stack((i, j), axis=1).astype(np.uint32)
 
     def get_adj_matrix(self) -> np.ndarray:
-        worm_pos = np.array([a.pos for a in self.schedule.agents if a.is_worm])
-        dist_mat = np.zeros(self.adj_matrix.shape[1:])
-        for w in range(len(worm_pos)):
-            dist_mat[w] = np.sqrt((worm_pos[w, 0] - worm_pos[:, 0]) ** 2 + (worm_pos[w, 1] - worm_pos[:, 1]) ** 2)
-        adj_mat = np.zeros(self.adj_matrix.shape[1:])
-        adj_mat[dist_mat <= 20] = 1 # max distance: 20
-        adj_mat[dist_mat > 20] = 0
-        return adj_mat
-        
+        return edges_to_dense(self.get_contacts(), self.n_agents)
+
+    def save_checkpoint(self, path) -> None:
+        """
+        Writes the full state of the simulation to a compressed .npz file (or any file object): the
+        worms, the live pheromones, both random generators, the step counters and what the recorders
+        collected so far, with the convergence state. The contact history is included when it is held in memory.
+        """
+        arrays = {}
+        if self.swarm is not None:
+            worms = self.swarm.get_state()
+        else:
+            agents = self.schedule.agents
+            worms = {'ids': np.array([a.unique_id for a in agents]), 'pos': np.array([a.pos for a in agents]),
+                     'angle': np.array([a.angle for a in agents]), 'vel': np.array([(a.velx, a.vely) for a in agents])}
+        if self.env.pheromone_field:
+            pheromones = {'attractive_grid': self.env.attractive_field.grid, 'repulsive_grid': self.env.repulsive_field.grid}
+        else:
+            pheromones = self.env.pheromones.get_state()
+        parts = {'worms': worms, 'pheromones': pheromones, 'recorder': self.recorder.get_state(), 'metrics': self.metrics.series()}
+        if self.contacts is not None and self.contacts.path is None:
+            parts['contacts'] = self.contacts.get_state()
+        for part, state in parts.items():
+            for name, value in state.items():
+                arrays[f'{part}.{name}'] = value
+
+        version, internal, gauss = self.random.getstate()
+        meta = {'config': self.config, 'steps': self.schedule.steps, 'time': self.schedule.time,
+                'model_steps': self._steps, 'current_id': self.current_id,
+                'random': [version, list(internal), gauss], 'rng': self.rng.bit_generator.state,
+                'converged': self.metrics.converged,
+                'criterion': self.criterion.get_state() if self.criterion is not None else None}
+        np.savez_compressed(path, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def restore(cls, path, seed: int = None, contacts_path: str = None, profile: bool = False, **overrides) -> 'WormSimulator':
+        """
+        Rebuilds a simulation from a checkpoint written by save_checkpoint.
+        Args:
+            path: checkpoint file or file object.
+            seed: if given, both random generators are reseeded, so the restored run diverges from the original.
+            contacts_path: directory the contact history is streamed to from the checkpoint step on.
+            profile: attaches a new StepProfiler.
+            overrides: constructor arguments replacing those of the checkpoint, e.g. the weights of a perturbation.
+        """
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            parts = {}
+            for key in data.files:
+                if key != 'meta':
+                    part, name = key.split('.', 1)
+                    parts.setdefault(part, {})[name] = data[key]
+        config = dict(meta['config'], **overrides)
+        if isinstance(config['collection'], dict):
+            config['collection'] = CollectionPolicy(**config['collection'])
+        model = cls(**config, contacts_path=contacts_path, profile=profile)
+
+        worms = parts['worms']
+        if model.swarm is not None:
+            model.swarm.set_state(worms)
+        else:
+            agents = {a.unique_id: a for a in model.schedule.agents}
+            for i, pos, angle, vel in zip(worms['ids'], worms['pos'], worms['angle'], worms['vel']):
+                a = agents[int(i)]
+                a.angle = float(angle)
+                a.velx, a.vely = float(vel[0]), float(vel[1])
+                model.env.move_agent(a, (float(pos[0]), float(pos[1])))
+                # RandomActivation shuffles its agents in place, so their order is part of the state
+                model.schedule.remove(a)
+                model.schedule.add(a)
+            if model.spatial_index:
+                model.env.index_agents(cell_size=20)
+        if model.env.pheromone_field:
+            model.env.attractive_field.grid = parts['pheromones']['attractive_grid'].copy()
+            model.env.repulsive_field.grid = parts['pheromones']['repulsive_grid'].copy()
+        else:
+            model.env.pheromones.set_state(parts['pheromones'])
+
+        model.recorder.set_state(parts['recorder'])
+        model.metrics.set_state(parts['metrics'])
+        model.metrics.converged = meta.get('converged', False)
+        # the patience count only carries over to the same criterion
+        if model.criterion is not None and meta.get('criterion') is not None and \
+                model.config['convergence'] == meta['config'].get('convergence'):
+            model.criterion.set_state(meta['criterion'])
+        if model.contacts is not None:
+            model.contacts.set_state(parts.get('contacts', {'edges': np.zeros((0, 2), dtype=np.uint32), 'offsets': [0]}))
+        model.schedule.steps = meta['steps']
+        model.schedule.time = meta['time']
+        model._steps = meta['model_steps']
+        model.current_id = meta['current_id']
+        version, internal, gauss = meta['random']
+        model.random.setstate((version, tuple(internal), gauss))
+        model.rng.bit_generator.state = meta['rng']
+        if seed is not None:
+            model.reseed(seed)
+        return model
+
+    def reseed(self, seed: int) -> None:
+        """Restarts both random generators from seed, deriving the bulk generator as the constructor does"""
+        self._seed = seed
+        self.random.seed(seed)
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+        if self.swarm is not None:
+            self.swarm.rng = self.rng
+
+    def fork(self, n: int, seed: int = None) -> List['WormSimulator']:
+        """Returns n copies of the current state, each reseeded with its own seed derived from seed"""
+        buffer = io.BytesIO()
+        self.save_checkpoint(buffer)
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n)]
+        replicates = []
+        for s in seeds:
+            buffer.seek(0)
+            replicates.append(WormSimulator.restore(buffer, seed=s))
+        return replicates
+
+    def close(self) -> None:
+        """Releases the worker processes and shared memory of the decomposed backend"""
+        if self.swarm is not None:
+            self.swarm.close()
+
     def clustered_agents(self, num_agents: int,
-                          multispot: bool = False, num_spots: int = 1) -> None:
-        """Implements the clustered initial positions for the worms"""
+                          multispot: bool = False, num_spots: int = 1) -> Tuple[List[Tuple[float]], List[float]]:
+        """Returns clustered initial positions for the worms, distinct cells of a square around one spot, and their headings"""
         radius = math.ceil(math.sqrt(num_agents) / 2)
         if multispot:
             if num_spots == 1 or num_spots == 2:
@@ -55,17 +331,15 @@ class WormSimulator(mesa.Model):
             else:
                 cluster_position = (self.env.dim_env // 2, self.env.dim_env // 2)
         else:
-            cluster_position = (self.random.randrange(0, self.env.dim_env), self.random.randrange(0, self.env.dim_env))
+            cluster_position = (self.random.randrange(0, int(self.env.dim_env)), self.random.randrange(0, int(self.env.dim_env)))
         neighborhood = self.env.get_neighborhood(cluster_position, True, True, radius)
-        positions = self.random.sample(neighborhood, num_agents)
-        for i in range(num_agents):
-            a = WormSimulator.create_agent(self, i, positions[i])
-            self.schedule.add(a)
-            self.env.place_agent(a, a.pos)
+        positions = [(float(x), float(y)) for x, y in self.random.sample(neighborhood, num_agents)]
+        angles = [self.random.random() * math.pi * 2 for _ in range(num_agents)]
+        return positions, angles
 
     @staticmethod
     def create_agent(model: mesa.Model, n: int, pos: Tuple[float], vel: Tuple[float],
-                    attractive_w = 0.4, repulsive_w = 0.4, align_w = 0.2) -> mesa.Agent:
+                    attractive_w = 0.4, repulsive_w = 0.4, align_w = 0.2, decay_rate = 0.1) -> mesa.Agent:
         agent = SolitaryWorm(n, model, pos, vel, attractive_w=attractive_w, repulsive_w=repulsive_w, 
-                             align_w=align_w, sensing_range=20, align_dist=10)
+                             align_w=align_w, sensing_range=20, align_dist=10, decay_rate=decay_rate)
         return agent
\ No newline at end of file
@@ -1,6 +1,7 @@
 import mesa
 from mesa.space import Coordinate
-from typing import Tuple, Sequence
+from profiling import phase
+from typing import Dict, Tuple, Sequence
 import math
 import numpy as np
 
@@ -8,14 +9,18 @@ import numpy as np
 class SolitaryWorm(mesa.Agent):
     """Class for the solitary worm in the minimal model"""
     def __init__(self, name: str, model: mesa.Model, pos: Tuple[float], angle: float, speed: float = 5,
-                  align_dist: float = 5, align_w: float = 0.2, sensing_range: float = 100, attractive_w = 0.2, repulsive_w = 0.2):
+                  align_dist: float = 5, align_w: float = 0.2, sensing_range: float = 100, attractive_w = 0.2, repulsive_w = 0.2,
+                  decay_rate: float = 0.1):
         super().__init__(name, model)
         self.name = name
         self.pos = pos
         self.angle = angle
+        self.velx = 0
+        self.vely = 0
         self.speed = speed
         self.align_dist = align_dist
         self.sensing_range = sensing_range
+        self.decay_rate = decay_rate
         self.is_worm = True
 
         if align_w + attractive_w + repulsive_w <= 1:
@@ -28,34 +33,28 @@ class SolitaryWorm(mesa.Agent):
     def sense_pheromone(self) -> bool:
         self.attraction_pheromone = False
         self.repulsion_pheromone = False
-        pheromone = self.model.env.get_pheromone(self.pos, self.sensing_range, True)
+        if self.model.env.pheromone_field:
+            return self.sense_pheromone_field()
+        delta, strength = self.model.env.get_pheromone_deltas(self.pos, self.sensing_range, attractive=True)
+        if len(strength) > 0:
+            self.attraction_pheromone = True
+            self.attraction_pos = np.asarray(self.pos) + np.average(delta, axis=0, weights=strength)
 
-        att_pheromone = [ph for ph in pheromone if ph.attractive]
-        rep_pheromone = [ph for ph in pheromone if not ph.attractive]
-        if len(att_pheromone) > 0:
+        delta, strength = self.model.env.get_pheromone_deltas(self.pos, self.sensing_range, attractive=False)
+        if len(strength) > 0:
+            self.repulsion_pheromone = True
+            self.repulsion_pos = np.asarray(self.pos) + np.average(delta, axis=0, weights=strength)
+
+    def sense_pheromone_field(self) -> None:
+        env = self.model.env
+        centroid, sensed = env.attractive_field.centroid(self.pos, self.sensing_range)
+        if sensed[0]:
             self.attraction_pheromone = True
-            posx = np.array([ph.pos[0] for ph in att_pheromone])
-            posx[posx - self.pos[0] > self.sensing_range] -= self.model.env.dim_env
-            posx[posx - self.pos[0] < -self.sensing_range] += self.model.env.dim_env
-            posy = np.array([ph.pos[1] for ph in att_pheromone])
-            posy[posy - self.pos[1] > self.sensing_range] -= self.model.env.dim_env
-            posy[posy - self.pos[1] < -self.sensing_range] += self.model.env.dim_env  
-            pos = [(posx[p], posy[p]) for p in range(len(att_pheromone))]          
-            strength = np.array([ph.quantity for ph in att_pheromone])
-            self.attraction_pos = np.average(pos, axis=0, weights=strength)
-
-        if len(rep_pheromone):
+            self.attraction_pos = centroid[0]
+        centroid, sensed = env.repulsive_field.centroid(self.pos, self.sensing_range)
+        if sensed[0]:
             self.repulsion_pheromone = True
-            posx = np.array([ph.pos[0] for ph in rep_pheromone])
-            posx[posx - self.pos[0] > self.sensing_range] -= self.model.env.dim_env
-            posx[posx - self.pos[0] < -self.sensing_range] += self.model.env.dim_env
-            posy = np.array([ph.pos[1] for ph in rep_pheromone])
-            posy[posy - self.pos[1] > self.sensing_range] -= self.model.env.dim_env
-            posy[posy - self.pos[1] < -self.sensing_range] += self.model.env.dim_env  
-            pos = [(posx[p], posy[p]) for p in range(len(rep_pheromone))]              
-            strength = np.array([ph.quantity for ph in rep_pheromone])
-            self.repulsion_pos = np.average(pos, axis=0, weights=strength)
-            
+            self.repulsion_pos = centroid[0]
 
     def move(self) -> None:
         self.angle = self.random.random() * math.pi * 2
@@ -90,65 +89,162 @@ class SolitaryWorm(mesa.Agent):
         rww = (1 - self.align_w - self.attractive_w - self.repulsive_w) / total_w
         self.angle = alw * align_angle + atw * attr_angle + rew * rep_angle + rww * self.angle
 
-        velx = np.cos(self.angle) * self.speed
-        vely = np.sin(self.angle) * self.speed
+        self.velx = np.cos(self.angle) * self.speed
+        self.vely = np.sin(self.angle) * self.speed
 
         # update the position
-        newpos = (self.pos[0] + velx, self.pos[1] + vely)
+        newpos = (self.pos[0] + self.velx, self.pos[1] + self.vely)
         self.pos = self.model.env.torus_adj(newpos)
 
     def emit_pheromone(self) -> bool:
-        ph_att = Pheromone(self.model.next_id(), self.model, self.pos, attractive=True, speed=10,
-                            quantity=1, decay_rate=0.1)
-        self.model.schedule.add(ph_att)
-        self.model.env.place_agent(ph_att, ph_att.pos)
+        if self.model.env.pheromone_field:
+            self.model.env.attractive_field.deposit(self.pos, quantity=1)
+            self.model.env.repulsive_field.deposit(self.pos, quantity=1)
+            return
 
-        ph_rep = Pheromone(self.model.next_id(), self.model, self.pos, attractive=False, speed=1,
-                           quantity=1, decay_rate=0.1)
-        self.model.schedule.add(ph_rep)
-        self.model.env.place_agent(ph_rep, ph_rep.pos)
+        self.model.env.pheromones.emit(self.pos, attractive=True, speed=10, quantity=1, decay_rate=self.decay_rate)
+        self.model.env.pheromones.emit(self.pos, attractive=False, speed=1, quantity=1, decay_rate=self.decay_rate)
 
     def is_worm(self) -> bool:
         return True
 
     def step(self) -> None:
-        self.sense_pheromone()
-        self.emit_pheromone()
-        self.move()
-
-class Pheromone(mesa.Agent):
-    def __init__(self, name: str, model: mesa.Model, pos: Tuple[int], attractive: bool, quantity: float = 1, speed: float = 1, decay_rate: float = 0.01):
-        super().__init__(name, model)
-        self.name = name
-        self.pos = pos
-        self.attractive = attractive
-        self.quantity = quantity
-        self.velx = 0
-        self.vely = 0
-        self.speed = speed
-        self.decay_rate = decay_rate
+        profiler = self.model.profiler
+        with phase(profiler, 'sense'):
+            self.sense_pheromone()
+        with phase(profiler, 'emit'):
+            self.emit_pheromone()
+        with phase(profiler, 'move'):
+            self.move()
+
+class Pheromone():
+    """
+    Read-only view of one molecule of a PheromonePool, with the attributes the Pheromone agents had.
+    It is a copy of the row taken when the view is made, valid until the next PheromonePool.step.
+    """
+    def __init__(self, pool: 'PheromonePool', row: int) -> None:
+        self.unique_id = int(pool.ids[row])
+        self.name = self.unique_id
+        self.pos = (float(pool.pos[row, 0]), float(pool.pos[row, 1]))
+        self.attractive = bool(pool.attractive[row])
+        self.quantity = float(pool.quantity[row])
+        self.velx = float(pool.vel[row, 0])
+        self.vely = float(pool.vel[row, 1])
+        self.speed = float(pool.speed[row])
+        self.decay_rate = float(pool.decay_rate[row])
         self.is_worm = False
 
-    def disperse(self, qty: float) -> None:
-        self.quantity -= qty
-        if self.quantity <= 0:
-            self.model.env.remove_agent(self)
-            self.model.schedule.remove(self)
-
-    def move(self) -> None:
-        angle = self.random.random() * math.pi * 2
-        if self.pos is None:
-            print('here')
-        self.velx = math.cos(angle) * self.speed
-        self.vely = math.sin(angle) * self.speed
-
-        # update the position
-        newpos = (self.pos[0] + self.velx, self.pos[1] + self.vely)
-        self.pos = self.model.env.torus_adj(newpos)
-
-    def step(self) -> None:
-        self.move()
-        self.disperse(self.decay_rate)
-
-    def is_worm(self) -> bool:
-        return False
\ No newline at end of file
+class PheromonePool():
+    """
+    Array-backed population of pheromone molecules.
+
+    Molecules are rows of preallocated arrays rather than mesa agents: emitting one writes the next
+    free row, and step moves and decays every molecule in bulk, then compacts the expired rows
+    away. Nothing is added to or removed from the schedule or the space.
+    The Pheromone agents used to be shuffled into the schedule with the worms, so a worm could
+    sense some molecules before and others after their move of the step. The pool is stepped once,
+    at the start of WormSimulator.step, so every worm senses all the molecules after their move,
+    plus the ones emitted earlier in the step, which have not moved yet.
+    """
+    columns = ('ids', 'pos', 'vel', 'attractive', 'quantity', 'speed', 'decay_rate')
+
+    def __init__(self, dim_env: float, capacity: int = 1024) -> None:
+        self.dim_env = dim_env
+        self.n = 0
+        self.next_id = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.attractive = np.zeros(capacity, dtype=bool)
+        self.quantity = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.decay_rate = np.zeros(capacity)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def reserve(self, n: int) -> None:
+        """Grows the arrays, doubling their capacity, until n more molecules fit"""
+        capacity = len(self.quantity)
+        if self.n + n <= capacity:
+            return
+        while capacity < self.n + n:
+            capacity *= 2
+        for name in self.columns:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def emit(self, pos: Tuple[float], attractive: bool, quantity: float = 1, speed: float = 1, decay_rate: float = 0.01) -> None:
+        self.reserve(1)
+        i = self.n
+        self.ids[i] = self.next_id
+        self.pos[i] = pos
+        self.vel[i] = 0
+        self.attractive[i] = attractive
+        self.quantity[i] = quantity
+        self.speed[i] = speed
+        self.decay_rate[i] = decay_rate
+        self.n += 1
+        self.next_id += 1
+
+    def emit_many(self, positions: np.ndarray, attractive: bool, quantity: float = 1, speed: float = 1, decay_rate: float = 0.01) -> None:
+        n = len(positions)
+        self.reserve(n)
+        sl = slice(self.n, self.n + n)
+        self.ids[sl] = np.arange(self.next_id, self.next_id + n)
+        self.pos[sl] = positions
+        self.vel[sl] = 0
+        self.attractive[sl] = attractive
+        self.quantity[sl] = quantity
+        self.speed[sl] = speed
+        self.decay_rate[sl] = decay_rate
+        self.n += n
+        self.next_id += n
+
+    def molecules(self, rows: Sequence[int]) -> list[Pheromone]:
+        """Returns Pheromone views of some rows"""
+        return [Pheromone(self, row) for row in rows]
+
+    def step(self, rng: np.random.Generator) -> None:
+        """Moves every molecule one random step of its speed on the torus, decays it and drops the expired ones"""
+        self.walk(rng.random(self.n) * math.pi * 2)
+
+    def walk(self, angle: np.ndarray) -> None:
+        """Moves every molecule one step of its speed in the direction of its angle, decays it and drops the expired ones"""
+        n = self.n
+        random_walk(self.pos[:n], self.vel[:n], self.quantity[:n], self.speed[:n], self.decay_rate[:n], angle, self.dim_env)
+        self.keep(self.quantity[:n] > 0)
+
+    def keep(self, alive: np.ndarray) -> None:
+        """Drops the molecules whose entry of the boolean mask alive is False, keeping the others in order"""
+        alive = np.nonzero(alive)[0]
+        self.n = len(alive)
+        for name in self.columns:
+            array = getattr(self, name)
+            array[:self.n] = array[alive]
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Returns copies of the rows of the live molecules and the next molecule id"""
+        state = {name: getattr(self, name)[:self.n].copy() for name in self.columns}
+        state['next_id'] = np.array(self.next_id)
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        n = len(state['ids'])
+        self.n = 0
+        self.reserve(n)
+        for name in self.columns:
+            getattr(self, name)[:n] = state[name]
+        self.n = n
+        self.next_id = int(state['next_id'])
+
+
+def random_walk(pos: np.ndarray, vel: np.ndarray, quantity: np.ndarray, speed: np.ndarray, decay_rate: np.ndarray,
+                angle: np.ndarray, dim_env: float) -> None:
+    """Moves molecules one step of their speed in the direction of their angle on the torus and decays them, in place"""
+    vel[:, 0] = np.cos(angle) * speed
+    vel[:, 1] = np.sin(angle) * speed
+    pos[...] = (pos + vel) % dim_env
+    quantity -= decay_rate
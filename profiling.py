@@ -0,0 +1,80 @@
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator
+import time
+import numpy as np
+
+
+class StepProfiler():
+    """
+    Cumulative and per-step timers and counters of the phases of WormSimulator.step.
+
+    Timers accumulate the wall-clock seconds spent inside each named phase and counters any
+    quantity worth tracking (live pheromones, neighbour candidates examined). Both are kept for the
+    running step and moved to the per-step history by end_step.
+    """
+    def __init__(self) -> None:
+        self.timers = {}
+        self.counters = {}
+        self.steps = []
+        self.history = []
+        self._timers = {}
+        self._counters = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self._timers[name] = self._timers.get(name, 0) + seconds
+
+    def count(self, name: str, n: int) -> None:
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def end_step(self, step: int) -> None:
+        for name, seconds in self._timers.items():
+            self.timers[name] = self.timers.get(name, 0) + seconds
+        for name, n in self._counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.steps.append(step)
+        self.history.append((self._timers, self._counters))
+        self._timers = {}
+        self._counters = {}
+
+    def per_step(self) -> Dict[str, np.ndarray]:
+        """Returns the value of every timer and counter at every step, 0 where it was not touched"""
+        columns = {'step': np.array(self.steps, dtype=int)}
+        for i, names in enumerate((self.timers, self.counters)):
+            for name in names:
+                columns[name] = np.array([h[i].get(name, 0) for h in self.history])
+        return columns
+
+    def table(self) -> str:
+        """Formats the totals, the per-step means and maxima of every timer and counter"""
+        per_step = self.per_step()
+        total_time = self.timers.get('total', sum(self.timers.values()))
+        lines = [f'{"phase":<24}{"total (s)":>12}{"mean (ms)":>12}{"max (ms)":>12}{"share":>8}']
+        for name, seconds in sorted(self.timers.items(), key=lambda item: -item[1]):
+            share = seconds / total_time if total_time > 0 else 0
+            lines.append(f'{name:<24}{seconds:>12.3f}{per_step[name].mean() * 1000:>12.3f}'
+                         f'{per_step[name].max() * 1000:>12.3f}{share:>8.1%}')
+        if len(self.counters) > 0:
+            lines.append('')
+            lines.append(f'{"counter":<24}{"total":>12}{"mean":>12}{"max":>12}')
+            for name, n in sorted(self.counters.items()):
+                lines.append(f'{name:<24}{n:>12.0f}{per_step[name].mean():>12.1f}{per_step[name].max():>12.0f}')
+        return '\n'.join(lines)
+
+    def save(self, path: str) -> None:
+        """Writes the per-step timers and counters as a CSV file, one row per step"""
+        columns = self.per_step()
+        np.savetxt(path, np.stack(list(columns.values()), axis=1), delimiter=',',
+                   header=','.join(columns), comments='', fmt='%.9g')
+
+
+def phase(profiler: StepProfiler, name: str):
+    """Times a phase with profiler, or does nothing if profiler is None"""
+    return profiler.phase(name) if profiler is not None else nullcontext()
@@ -0,0 +1,251 @@
+from typing import Dict, Sequence, Tuple, Union
+import os
+import numpy as np
+
+# values of the kind column
+WORM = 0
+ATTRACTIVE = 1
+REPULSIVE = 2
+
+KIND_NAMES = {'worm': WORM, 'attractive': ATTRACTIVE, 'repulsive': REPULSIVE}
+
+COLUMNS = {'step': np.int32, 'id': np.int64, 'kind': np.uint8,
+           'x': np.float32, 'y': np.float32, 'vx': np.float32, 'vy': np.float32}
+
+
+class CollectionPolicy():
+    """
+    What WormSimulator records and how often.
+    Args:
+        kinds: agent kinds recorded as rows, among 'worm', 'attractive' and 'repulsive'.
+        interval: steps between two collections, the initial state being always collected.
+        pheromone_mode: 'rows' records the pheromone kinds listed in kinds as individual rows,
+                        'histogram' records instead a bins x bins density of each pheromone kind,
+                        weighted by the remaining quantity.
+        bins: number of histogram bins along each axis.
+    """
+    def __init__(self, kinds: Sequence[str] = ('worm', 'attractive', 'repulsive'), interval: int = 1,
+                  pheromone_mode: str = 'rows', bins: int = 50) -> None:
+        unknown = set(kinds) - set(KIND_NAMES)
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown agent kinds {sorted(unknown)}, they must be among {list(KIND_NAMES)}')
+        if pheromone_mode not in ('rows', 'histogram'):
+            raise ValueError(f'Unknown pheromone mode {pheromone_mode}, it must be either rows or histogram')
+        if interval < 1:
+            raise ValueError(f'The collection interval is {interval} but it must be at least 1')
+        self.kinds = tuple(kinds)
+        self.interval = interval
+        self.pheromone_mode = pheromone_mode
+        self.bins = bins
+
+    def collects(self, step: int) -> bool:
+        return step % self.interval == 0
+
+    def row_kinds(self) -> Tuple[int]:
+        """Returns the values of the kind column recorded as rows"""
+        if self.pheromone_mode == 'histogram':
+            return (WORM,) if 'worm' in self.kinds else ()
+        return tuple(KIND_NAMES[k] for k in self.kinds)
+
+
+class TrajectoryRecorder():
+    """
+    Columnar recorder of agent trajectories.
+
+    Every call to record appends typed NumPy columns for the agents of one step. Small appends are
+    merged into chunks of about chunk_rows rows, and save writes every column to a compressed .npz
+    as separately compressed blocks of rows, together with the row offset of every step, so a step
+    can be read by decompressing only the blocks holding its rows. dim_env, the side of the
+    environment, is saved with them when given.
+    """
+    def __init__(self, chunk_rows: int = 1_000_000, dim_env: float = None) -> None:
+        self.chunk_rows = chunk_rows
+        self.dim_env = dim_env
+        self.chunks = {c: [] for c in COLUMNS}
+        self.pending = {c: [] for c in COLUMNS}
+        self.n_pending = 0
+        self.n_rows = 0
+        self.step_rows = []
+        self.density_steps = []
+        self.densities = {'attractive': [], 'repulsive': []}
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def record(self, step: int, ids: np.ndarray, kinds: np.ndarray, pos: np.ndarray, vel: np.ndarray) -> None:
+        """Appends rows of one step, pos and vel being (N, 2) arrays. Consecutive calls for the same step extend it."""
+        n = len(ids)
+        pos = np.asarray(pos).reshape(-1, 2)
+        vel = np.asarray(vel).reshape(-1, 2)
+        values = {'step': np.full(n, step), 'id': ids, 'kind': kinds,
+                  'x': pos[:, 0], 'y': pos[:, 1], 'vx': vel[:, 0], 'vy': vel[:, 1]}
+        for c, dtype in COLUMNS.items():
+            self.pending[c].append(np.asarray(values[c], dtype=dtype))
+        if len(self.step_rows) > 0 and self.step_rows[-1][0] == step:
+            self.step_rows[-1] = (step, self.step_rows[-1][1] + n)
+        else:
+            self.step_rows.append((step, n))
+        self.n_pending += n
+        self.n_rows += n
+        if self.n_pending >= self.chunk_rows:
+            self.merge()
+
+    def record_density(self, step: int, attractive: np.ndarray, repulsive: np.ndarray) -> None:
+        """Appends the pheromone density histograms of one step"""
+        self.density_steps.append(step)
+        self.densities['attractive'].append(np.asarray(attractive, dtype=np.float32))
+        self.densities['repulsive'].append(np.asarray(repulsive, dtype=np.float32))
+
+    def merge(self) -> None:
+        for c in COLUMNS:
+            if len(self.pending[c]) > 0:
+                self.chunks[c].append(np.concatenate(self.pending[c]))
+            self.pending[c] = []
+        self.n_pending = 0
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        self.merge()
+        return {c: np.concatenate(self.chunks[c]) if len(self.chunks[c]) > 0 else np.zeros(0, dtype=dtype)
+                for c, dtype in COLUMNS.items()}
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Returns the recorded columns, the rows of every step and the densities as arrays"""
+        state = dict(self.columns())
+        state['step_rows'] = np.array(self.step_rows, dtype=np.int64).reshape(-1, 2)
+        state['density_steps'] = np.array(self.density_steps, dtype=np.int32)
+        for kind, densities in self.densities.items():
+            state[f'{kind}_density'] = np.array(densities, dtype=np.float32)
+        return state
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.chunks = {c: [np.asarray(state[c], dtype=dtype)] for c, dtype in COLUMNS.items()}
+        self.pending = {c: [] for c in COLUMNS}
+        self.n_pending = 0
+        self.n_rows = len(state['step'])
+        self.step_rows = [(int(s), int(n)) for s, n in state['step_rows']]
+        self.density_steps = [int(s) for s in state['density_steps']]
+        self.densities = {kind: list(state[f'{kind}_density']) for kind in self.densities}
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Returns the arrays read by Trajectories: the columns, the recorded steps with their row offsets and the densities"""
+        steps = np.array([s for s, _ in self.step_rows], dtype=np.int32)
+        offsets = np.concatenate(([0], np.cumsum([n for _, n in self.step_rows], dtype=np.int64)))
+        densities = {}
+        if len(self.density_steps) > 0:
+            densities = {'density_steps': np.array(self.density_steps, dtype=np.int32),
+                         'attractive_density': np.stack(self.densities['attractive']),
+                         'repulsive_density': np.stack(self.densities['repulsive'])}
+        if self.dim_env is not None:
+            densities['dim_env'] = np.array(self.dim_env, dtype=float)
+        return dict(steps=steps, step_offsets=offsets, **self.columns(), **densities)
+
+    def save(self, path: str, block_rows: int = 65536) -> None:
+        """Writes the arrays read by Trajectories to a compressed .npz, every column being split into blocks of block_rows rows"""
+        arrays = self.arrays()
+        columns = {c: arrays.pop(c) for c in COLUMNS}
+        offsets = np.append(np.arange(0, self.n_rows, block_rows, dtype=np.int64), self.n_rows)
+        for c, values in columns.items():
+            for k, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+                arrays[f'{c}.{k}'] = values[start:stop]
+        np.savez_compressed(path, block_offsets=offsets, **arrays)
+
+
+class Trajectories():
+    """
+    Reader of the output of TrajectoryRecorder.save, or of the arrays it gives saved with save_arrays.
+
+    The file is kept open and the columns are only read when a step needs them: the blocks of a
+    .npz are decompressed on access, the last block of every column being kept so consecutive
+    steps do not decompress it again, and the arrays of a directory are memory-mapped. Files
+    written before columns were split into blocks hold every column as a single block.
+    """
+    def __init__(self, path: str) -> None:
+        self.data = load_arrays(path) if os.path.isdir(path) else np.load(path)
+        self.steps = self.data['steps']
+        self.step_offsets = self.data['step_offsets']
+        self.n_rows = int(self.step_offsets[-1]) if len(self.step_offsets) > 0 else 0
+        self.blocked = 'block_offsets' in self.data
+        self.block_offsets = self.data['block_offsets'] if self.blocked else np.array([0, self.n_rows])
+        # column -> (index, rows) of the block read last
+        self._blocks = {}
+        self._step_index = {int(s): i for i, s in enumerate(self.steps)}
+        # (T, bins, bins) pheromone densities, only present if collected as histograms
+        self.density_steps = self.data['density_steps'] if 'density_steps' in self.data else None
+        self.attractive_density = self.data['attractive_density'] if 'attractive_density' in self.data else None
+        self.repulsive_density = self.data['repulsive_density'] if 'repulsive_density' in self.data else None
+        # side of the environment, unknown for files written before it was saved
+        self.dim_env = float(self.data['dim_env']) if 'dim_env' in self.data else None
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        """Returns a whole column, reading all its blocks"""
+        return self.rows(column, 0, self.n_rows)
+
+    def close(self) -> None:
+        if hasattr(self.data, 'close'):
+            self.data.close()
+
+    def block(self, column: str, k: int) -> np.ndarray:
+        if column not in self._blocks or self._blocks[column][0] != k:
+            self._blocks[column] = (k, self.data[f'{column}.{k}' if self.blocked else column])
+        return self._blocks[column][1]
+
+    def rows(self, column: str, start: int, stop: int) -> np.ndarray:
+        """Returns rows start to stop of a column, reading only the blocks that hold them"""
+        if stop <= start:
+            return np.zeros(0, dtype=COLUMNS[column])
+        first = int(np.searchsorted(self.block_offsets, start, side='right')) - 1
+        last = int(np.searchsorted(self.block_offsets, stop, side='left'))
+        parts = []
+        for k in range(first, last):
+            offset = self.block_offsets[k]
+            parts.append(self.block(column, k)[max(start - offset, 0):stop - offset])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def at_step(self, step: int) -> Dict[str, np.ndarray]:
+        """Returns the columns of the rows recorded at a step"""
+        i = self._step_index[step]
+        start, stop = int(self.step_offsets[i]), int(self.step_offsets[i + 1])
+        return {c: self.rows(c, start, stop) for c in COLUMNS}
+
+
+def record_pheromones(recorder: TrajectoryRecorder, step: int, pool, kinds: Sequence[int], rows: np.ndarray = None) -> None:
+    """Records the molecules of a PheromonePool whose kind is among kinds, only those of the boolean mask rows if given"""
+    if ATTRACTIVE not in kinds and REPULSIVE not in kinds:
+        return
+    n = len(pool)
+    ph_kinds = np.where(pool.attractive[:n], ATTRACTIVE, REPULSIVE)
+    recorded = np.isin(ph_kinds, kinds)
+    if rows is not None:
+        recorded &= rows
+    if recorded.any():
+        recorder.record(step, pool.ids[:n][recorded], ph_kinds[recorded], pool.pos[:n][recorded], pool.vel[:n][recorded])
+
+
+def pool_density(pool, attractive: bool, bins: int, rows: np.ndarray = None) -> np.ndarray:
+    """Returns the (bins, bins) histogram of one pheromone kind of a PheromonePool weighted by quantity, over the rows of the boolean mask rows if given"""
+    n = len(pool)
+    kind = pool.attractive[:n] == attractive
+    if rows is not None:
+        kind &= rows
+    return density_histogram(pool.pos[:n][kind], pool.quantity[:n][kind], bins, pool.dim_env)
+
+
+def density_histogram(pos: np.ndarray, quantity: np.ndarray, bins: int, dim_env: float) -> np.ndarray:
+    density, _, _ = np.histogram2d(pos[:, 0], pos[:, 1], bins=bins, range=[[0, dim_env]] * 2, weights=quantity)
+    return density
+
+
+def save_arrays(directory: str, arrays: Dict[str, np.ndarray]) -> None:
+    """Writes every array to its own .npy file in directory, which load_arrays can memory-map"""
+    os.makedirs(directory, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'), np.asarray(values))
+
+
+def load_arrays(directory: str) -> Dict[str, Union[np.ndarray, np.memmap]]:
+    """Returns the arrays written by save_arrays, memory-mapped read-only"""
+    return {f[:-len('.npy')]: np.load(os.path.join(directory, f), mmap_mode='r')
+            for f in sorted(os.listdir(directory)) if f.endswith('.npy')}
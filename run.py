@@ -1,53 +1,128 @@
-import sys
-from tqdm import tqdm
-
+from config import ENV_SIZE, MAX_STEPS, NUM_AGENTS, contacts_path, metrics_path
 from model import WormSimulator
-import pandas as pd
-import mesa
-import numpy as np
-import argparse
+from ensemble import WormEnsemble
+from contacts import ContactRecorder
+from recorder import CollectionPolicy
+from convergence import ConvergenceCriterion
 import os
+import sys
+import time
 
-NUM_EXPERIMENTS = 1
-ENV_SIZE = 400
-MAX_STEPS = 500
-NUM_AGENTS = 75
-
-if len(sys.argv) > 1:
-    file_name = str(sys.argv[1])
-else:
-    print("File name set to default")
-    file_name = "cluster_false_test"
-
-
-def run_experiment(attractive_w, repulsive_w, align_w):
-    model = WormSimulator(n_agents=NUM_AGENTS, dim_env=ENV_SIZE, max_steps=MAX_STEPS, multispot=False, num_spots=1, clustered=False,
-                            attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w)
+def run_experiment(attractive_w, repulsive_w, align_w, contacts_path=None, seed=None, profile=False,
+                   checkpoint=None, save_checkpoint=None, checkpoint_step=None, convergence=None, backend='agent',
+                   collection=None):
+    # the contact history is only kept when it is written to contacts_path, the metrics are always computed
+    if checkpoint is not None:
+        # continue a warmed-up run with these weights and a fresh seed, on the backend it was saved from,
+        # collecting as it did unless a CollectionPolicy is given
+        overrides = {'collection': collection} if collection is not None else {}
+        model = WormSimulator.restore(checkpoint, seed=seed, contacts_path=contacts_path, profile=profile,
+                                      attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w,
+                                      convergence=convergence, **overrides)
+        if model.backend != backend:
+            raise ValueError(f'The checkpoint {checkpoint} was saved from the {model.backend} backend, not the {backend} backend')
+    else:
+        model = WormSimulator(n_agents=NUM_AGENTS, dim_env=ENV_SIZE, max_steps=MAX_STEPS, multispot=False, num_spots=1, clustered=False,
+                                attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w, contacts_path=contacts_path, seed=seed,
+                                profile=profile, store_contacts=False, convergence=convergence, backend=backend,
+                                collection=collection)
 
-    step_count = 0
-    while step_count <= MAX_STEPS:
+    while model.schedule.steps <= MAX_STEPS:
         model.step()
+        if save_checkpoint is not None and model.schedule.steps == checkpoint_step:
+            model.save_checkpoint(save_checkpoint)
+        # optional early stop, convergence holding the arguments of ConvergenceCriterion
+        if model.metrics.converged:
+            break
+    if save_checkpoint is not None and checkpoint_step is None:
+        model.save_checkpoint(save_checkpoint)
+    if model.contacts is not None:
+        model.contacts.close()
+    model.close()
+    if profile:
+        print(model.profiler.table())
 
-        step_count += 1
+    return model.recorder, model.contacts, model.metrics
 
-    data = model.datacollector.get_agent_vars_dataframe()
+def run_replicates(attractive_w, repulsive_w, align_w, seeds, store_contacts=False, convergence=None):
+    """
+    Runs one replicate of the vectorized backend per seed, all batched in a single WormEnsemble.
+    With convergence, every replicate has its own criterion and is retired from the ensemble at
+    the step it converges, so the batch only keeps stepping the replicates still running.
+    """
+    ensemble = WormEnsemble(seeds, NUM_AGENTS, ENV_SIZE, attractive_w, repulsive_w, align_w,
+                            store_contacts=store_contacts, collection=CollectionPolicy(kinds=()))
+    criteria = [ConvergenceCriterion(**convergence) for _ in seeds] if convergence is not None else []
+    while ensemble.steps <= MAX_STEPS and len(ensemble.active) > 0:
+        ensemble.step()
+        converged = [r for r in ensemble.active if criteria and criteria[r].update(ensemble.metrics[r])]
+        if len(converged) > 0:
+            ensemble.retire(converged)
+    return ensemble
 
-    return data, model.adj_matrix
+def main(attractive_w, repulsive_w, align_w, test_n, seed=None, positions_path='position_data.npz', profile=False,
+         store_contacts=False, checkpoint=None, save_checkpoint=None, checkpoint_step=None, convergence=None, store=None,
+         backend='agent', collection=None):
+    """
+    Runs one experiment on a backend of WormSimulator and saves its outputs. With an ExperimentStore,
+    they go to a new run of the store instead of aggr_data and positions_path, positions_path then
+    only telling whether the trajectories are kept.
+    collection holds the arguments of the CollectionPolicy of the trajectories. By default every
+    kind is recorded at every step when the trajectories are kept, and nothing otherwise.
+    """
+    if collection is not None:
+        collection = CollectionPolicy(**collection)
+    else:
+        collection = CollectionPolicy() if positions_path is not None else CollectionPolicy(kinds=())
+    if store is not None:
+        run_id = store.create_run(attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w, test_n=test_n,
+                                  seed=seed, n_agents=NUM_AGENTS, dim_env=ENV_SIZE, backend=backend, max_steps=MAX_STEPS,
+                                  checkpoint=checkpoint, convergence=convergence)
+        contacts = store.contacts_path(run_id) if store_contacts else None
+    else:
+        contacts = contacts_path(attractive_w, repulsive_w, align_w, test_n, backend) if store_contacts else None
+    start = time.perf_counter()
+    recorder, _, metrics = run_experiment(attractive_w, repulsive_w, align_w, contacts_path=contacts,
+                            seed=seed, profile=profile, checkpoint=checkpoint, save_checkpoint=save_checkpoint,
+                            checkpoint_step=checkpoint_step, convergence=convergence, backend=backend,
+                            collection=collection)
+    if store is not None:
+        store.finish_run(run_id, metrics, recorder if positions_path is not None else None,
+                         wall_time=time.perf_counter() - start)
+        return metrics
+    os.makedirs('aggr_data', exist_ok=True)
+    metrics.save(metrics_path(attractive_w, repulsive_w, align_w, test_n, backend))
+    if positions_path is not None:
+        recorder.save(positions_path)
+    return metrics
 
-def main(attractive_w, repulsive_w, align_w, test_n):
-    res, adj_mat = run_experiment(attractive_w, repulsive_w, align_w)
-    res['posx'] = [p[0] for p in res['pos'].values]
-    res['posy'] = [p[1] for p in res['pos'].values]
-    res = res.drop('pos', axis=1)
-    res.to_csv(f'position_data.csv')
-    np.save(f'aggr_data/adj_{attractive_w}_{repulsive_w}_{align_w}_{test_n}.npy', adj_mat)
+def main_batch(attractive_w, repulsive_w, align_w, test_ns, seeds, store_contacts=False, convergence=None, store=None):
+    """Runs the replicates test_ns of one weight combination as a single ensemble and saves the outputs of each as vectorized runs"""
+    start = time.perf_counter()
+    ensemble = run_replicates(attractive_w, repulsive_w, align_w, seeds, store_contacts, convergence)
+    wall_time = (time.perf_counter() - start) / len(seeds)
+    if store is None:
+        os.makedirs('aggr_data', exist_ok=True)
+    for r, (test_n, seed) in enumerate(zip(test_ns, seeds)):
+        if store is not None:
+            run_id = store.create_run(attractive_w=attractive_w, repulsive_w=repulsive_w, align_w=align_w, test_n=test_n,
+                                      seed=seed, n_agents=NUM_AGENTS, dim_env=ENV_SIZE, backend='vectorized',
+                                      max_steps=MAX_STEPS, convergence=convergence, batched=True)
+            path = store.contacts_path(run_id)
+        else:
+            ensemble.metrics[r].save(metrics_path(attractive_w, repulsive_w, align_w, test_n, 'vectorized'))
+            path = contacts_path(attractive_w, repulsive_w, align_w, test_n, 'vectorized')
+        if store_contacts:
+            contacts = ContactRecorder(NUM_AGENTS, path)
+            # up to the step the replicate converged at
+            for t in range(len(ensemble.metrics[r])):
+                contacts.append(ensemble.contacts[r][t])
+            contacts.close()
+        if store is not None:
+            store.finish_run(run_id, ensemble.metrics[r], wall_time=wall_time)
+    return ensemble.metrics
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-a', type=float, required=True)
-    parser.add_argument('-r', type=float, required=True)
-    parser.add_argument('-l', type=float, required=True)
-    parser.add_argument('-t', type=int, required=True)
-    args = parser.parse_args()
-    main(args.a, args.r, args.l, args.t)
+    import cli
+    raise SystemExit(1 if cli.main(['run'] + sys.argv[1:]) else 0)
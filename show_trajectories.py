@@ -1,10 +1,18 @@
-import pygame
-from pygame.locals import *
-import pandas as pd
-from run import ENV_SIZE, MAX_STEPS
+from recorder import Trajectories, WORM, ATTRACTIVE, REPULSIVE
+from config import ENV_SIZE, MAX_STEPS
+from spatial import PeriodicCellList
+from contacts import contact_pairs
 import math
+import subprocess
+import sys
 import numpy as np
 
+# colours of the pygame names used by Simulator
+BLUE = (0, 0, 255)
+PURPLE = (160, 32, 240)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
 class Simulator():
 
     width: int
@@ -13,7 +21,7 @@ class Simulator():
 
     def __init__(
             self,
-            pos_data: pd.DataFrame,
+            pos_data: Trajectories,
             width: int = ENV_SIZE,
             height: int = ENV_SIZE,
     ) -> None:
@@ -23,6 +31,7 @@ class Simulator():
         self.height = height * self.size_multiplier
 
     def run(self) -> None:
+        import pygame
         pygame.init()
 
         canvas = pygame.display.set_mode((self.width, self.height))
@@ -31,22 +40,26 @@ class Simulator():
         
         running = True
 
-        step = 0
-        while running and step < MAX_STEPS:
+        # frames follow the recorded steps, which may be decimated by the collection policy
+        frame = 0
+        while running and frame < min(len(self.pos_data), MAX_STEPS):
 
             pygame.time.delay(0)
 
             for event in pygame.event.get():
-                if event.type == KEYDOWN:
-                    if event.key == K_BACKSPACE:
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_BACKSPACE:
                         running = False
-                elif event.type == QUIT:
+                elif event.type == pygame.QUIT:
                     running = False
 
             canvas.fill((0, 0, 0))
 
-            att_ph_positions = self.pos_data.loc[(self.pos_data['Step'] == step) & (self.pos_data['worm'] == False) & 
-                                                 (self.pos_data['attractive'] == True)][['posx', 'posy']].to_numpy() * self.size_multiplier
+            rows = self.pos_data.at_step(self.pos_data.steps[frame])
+            positions = np.stack((rows['x'], rows['y']), axis=1) * self.size_multiplier
+            velocities = np.stack((rows['vx'], rows['vy']), axis=1) * self.size_multiplier
+
+            att_ph_positions = positions[rows['kind'] == ATTRACTIVE]
 
             color = 'blue'
             for i in range(att_ph_positions.shape[0]):
@@ -54,8 +67,7 @@ class Simulator():
 
                 pygame.draw.circle(canvas, color, pos, (1 * self.size_multiplier))
 
-            rep_ph_positions = self.pos_data.loc[(self.pos_data['Step'] == step) & (self.pos_data['worm'] == False) & 
-                                                 (self.pos_data['attractive'] == False)][['posx', 'posy']].to_numpy() * self.size_multiplier
+            rep_ph_positions = positions[rows['kind'] == REPULSIVE]
 
             color = 'purple'
             for i in range(rep_ph_positions.shape[0]):
@@ -63,8 +75,8 @@ class Simulator():
 
                 pygame.draw.circle(canvas, color, pos, (1 * self.size_multiplier))
 
-            agent_positions = self.pos_data.loc[(self.pos_data['Step'] == step) & (self.pos_data['worm'] == True)][['posx', 'posy']].to_numpy() * self.size_multiplier
-            agent_velocities = self.pos_data.loc[(self.pos_data['Step'] == step) & (self.pos_data['worm'] == True)][['velx', 'vely']].to_numpy() * self.size_multiplier
+            agent_positions = positions[rows['kind'] == WORM]
+            agent_velocities = velocities[rows['kind'] == WORM]
 
             for i in range(agent_positions.shape[0]):
                 color = 'red'
@@ -79,12 +91,13 @@ class Simulator():
                 #arrow(canvas, "white", (255, 255, 255), pos, pos + vel * 10, 4, 2)
             
             pygame.display.update()
-            filename = "video/screen_%04d.png" % ( step )
+            filename = "video/screen_%04d.png" % ( frame )
             pygame.image.save(canvas, filename)
-            step += 1
+            frame += 1
 
 
 def arrow(screen, lcolor, tricolor, start, end, trirad, thickness=2):
+    import pygame
     rad = math.pi / 180
     pygame.draw.line(screen, lcolor, start, end, thickness)
     rotation = (math.atan2(start[1] - end[1], end[0] - start[0])) + math.pi/2
@@ -96,7 +109,84 @@ def arrow(screen, lcolor, tricolor, start, end, trirad, thickness=2):
                                         end[1] + trirad * math.cos(rotation + 120*rad))))
 
 
+class HeadlessRenderer():
+    """
+    Renders trajectories without a display, streaming raw RGB frames into an ffmpeg pipe.
+
+    Frames are drawn in a NumPy buffer: every marker of a kind is stamped at once through a
+    precomputed disk of pixel offsets, and worms with a neighbour within group_dist are found
+    with a cell list instead of an all-pairs check. As in Simulator, the distance is measured in
+    the plane, so worms close to each other across an edge are not grouped.
+    The side of the environment is read from the trajectories, ENV_SIZE being assumed for files
+    that do not hold it, unless dim_env is given.
+    """
+    def __init__(self, pos_data: Trajectories, dim_env: float = None, scale: float = 2, skip: int = 1,
+                  fps: int = 15, crf: int = 25, group_dist: float = 10, ffmpeg: str = 'ffmpeg') -> None:
+        self.pos_data = pos_data
+        if dim_env is None:
+            dim_env = pos_data.dim_env if pos_data.dim_env is not None else ENV_SIZE
+        self.dim_env = dim_env
+        self.scale = scale
+        self.skip = skip
+        self.fps = fps
+        self.crf = crf
+        self.group_dist = group_dist
+        self.ffmpeg = ffmpeg
+        # even sizes, as required by yuv420p
+        self.width = int(round(dim_env * scale / 2)) * 2
+        self.height = self.width
+        self.ph_disk = self.disk(max(1, round(1 * scale)))
+        self.worm_disk = self.disk(max(1, round(5 * scale)))
+
+    @staticmethod
+    def disk(radius: int) -> np.ndarray:
+        d = np.arange(-radius, radius + 1)
+        dx, dy = np.meshgrid(d, d, indexing='ij')
+        inside = dx ** 2 + dy ** 2 <= radius ** 2
+        return np.stack((dx[inside], dy[inside]), axis=1)
+
+    def stamp(self, frame: np.ndarray, positions: np.ndarray, disk: np.ndarray, color) -> None:
+        """Draws a filled disk of color at every position, clipped at the frame borders"""
+        if len(positions) == 0:
+            return
+        pixels = (positions * self.scale).astype(int)[:, None, :] + disk[None, :, :]
+        pixels = pixels.reshape(-1, 2)
+        inside = (pixels[:, 0] >= 0) & (pixels[:, 0] < self.width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < self.height)
+        pixels = pixels[inside]
+        frame[pixels[:, 1], pixels[:, 0]] = color
+
+    def draw(self, step: int) -> np.ndarray:
+        frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        rows = self.pos_data.at_step(step)
+        positions = np.stack((rows['x'], rows['y']), axis=1)
+        self.stamp(frame, positions[rows['kind'] == ATTRACTIVE], self.ph_disk, BLUE)
+        self.stamp(frame, positions[rows['kind'] == REPULSIVE], self.ph_disk, PURPLE)
+
+        worms = positions[rows['kind'] == WORM]
+        grouped = np.zeros(len(worms), dtype=bool)
+        if len(worms) > 0:
+            i, j = contact_pairs(PeriodicCellList(worms, self.dim_env, self.group_dist), self.group_dist)
+            grouped[i] = True
+            grouped[j] = True
+        self.stamp(frame, worms[~grouped], self.worm_disk, RED)
+        self.stamp(frame, worms[grouped], self.worm_disk, GREEN)
+        return frame
+
+    def run(self, output: str = 'video.mp4') -> None:
+        command = [self.ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', f'{self.width}x{self.height}', '-r', str(self.fps), '-i', '-',
+                   '-vcodec', 'libx264', '-crf', str(self.crf), '-pix_fmt', 'yuv420p', output]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            for step in self.pos_data.steps[::self.skip]:
+                process.stdin.write(self.draw(int(step)).tobytes())
+        finally:
+            process.stdin.close()
+            process.wait()
+        if process.returncode != 0:
+            raise RuntimeError(f'ffmpeg exited with code {process.returncode}')
+
+
 if __name__ == "__main__":
-    pos_data = pd.read_csv('position_data.csv')
-    sim = Simulator(pos_data)
-    sim.run()
\ No newline at end of file
+    import cli
+    raise SystemExit(1 if cli.main(['render'] + sys.argv[1:]) else 0)
@@ -0,0 +1,133 @@
+from typing import Tuple
+import math
+import numpy as np
+
+
+class PeriodicCellList():
+    """
+    Cell list over a square periodic domain, answering fixed-radius neighbour queries.
+
+    Points are bucketed into square cells no smaller than cell_size and sorted by cell, so a query
+    only examines the cells overlapping its radius. Build it once per step with cell_size equal to
+    the largest query radius to keep every query on a 3x3 block of cells.
+
+    Points may be split into n_groups independent domains of the same size (the replicates of a
+    WormEnsemble): every group has its own cells, and queries only match points of their own group.
+    """
+    def __init__(self, positions: np.ndarray, dim_env: float, cell_size: float,
+                  groups: np.ndarray = None, n_groups: int = 1) -> None:
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.dim_env = dim_env
+        self.n_cells = max(1, int(dim_env // cell_size))
+        self.cell_side = dim_env / self.n_cells
+        self.groups = np.zeros(len(self.positions), dtype=int) if groups is None else np.asarray(groups)
+
+        cell_id = self.cell_id(self.cell_of(self.positions), self.groups)
+        self.order = np.argsort(cell_id, kind='stable')
+        self.starts = np.searchsorted(cell_id[self.order], np.arange(n_groups * self.n_cells ** 2 + 1))
+        self._stencils = {}
+        # number of candidate points whose distance was checked by the queries so far
+        self.examined = 0
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def cell_of(self, points: np.ndarray) -> np.ndarray:
+        return np.floor(points / self.cell_side).astype(int) % self.n_cells
+
+    def cell_id(self, cells: np.ndarray, groups: np.ndarray = 0) -> np.ndarray:
+        return (groups * self.n_cells + cells[:, 0]) * self.n_cells + cells[:, 1]
+
+    def wrap(self, delta: np.ndarray) -> np.ndarray:
+        """Returns the minimum image of a displacement on the torus"""
+        return (delta + self.dim_env / 2) % self.dim_env - self.dim_env / 2
+
+    def stencil(self, radius: float) -> np.ndarray:
+        """Returns the distinct cell offsets that may hold points within radius of a cell"""
+        if radius not in self._stencils:
+            r = math.ceil(radius / self.cell_side)
+            d = np.arange(-r, r + 1) if 2 * r + 1 < self.n_cells else np.arange(self.n_cells)
+            ox, oy = np.meshgrid(d, d, indexing='ij')
+            self._stencils[radius] = np.stack((ox.ravel(), oy.ravel()), axis=1)
+        return self._stencils[radius]
+
+    def query_point(self, pos: Tuple[float], radius: float, include_center: bool = True, group: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the points within radius of a single position.
+        Args:
+            pos: (x, y) coordinate to center the search at.
+            radius: search distance.
+            include_center: if False, points at exactly pos are left out.
+            group: group searched.
+
+        Returns:
+            The indices of the points found and their (K, 2) displacements from pos.
+        """
+        pos = np.asarray(pos, dtype=float)
+        cells = self.cell_id((self.cell_of(pos[None, :]) + self.stencil(radius)) % self.n_cells, group)
+        candidates = np.concatenate([self.order[self.starts[c]:self.starts[c + 1]] for c in cells])
+        self.examined += len(candidates)
+        delta = self.wrap(self.positions[candidates] - pos)
+        d2 = delta[:, 0] ** 2 + delta[:, 1] ** 2
+        keep = d2 <= radius ** 2
+        if not include_center:
+            keep &= d2 > 0
+        return candidates[keep], delta[keep]
+
+    def query(self, points: np.ndarray, radius: float, include_center: bool = True,
+               groups: np.ndarray = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns every (query point, indexed point) pair within radius, for many query points at once.
+        Args:
+            points: (M, 2) array of coordinates to center the searches at.
+            radius: search distance.
+            include_center: if False, pairs at distance exactly 0 are left out.
+            groups: group searched by every query point.
+
+        Returns:
+            Arrays of query indices and indexed point indices, and the (K, 2) displacements between them.
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cells = self.cell_of(points)
+        qi = []; j = []
+        for offset in self.stencil(radius):
+            c = self.cell_id((cells + offset) % self.n_cells, groups)
+            lo = self.starts[c]
+            counts = self.starts[c + 1] - lo
+            total = counts.sum()
+            if total == 0:
+                continue
+            first = np.cumsum(counts) - counts
+            qi.append(np.repeat(np.arange(len(points)), counts))
+            j.append(self.order[np.arange(total) - np.repeat(first - lo, counts)])
+        if len(qi) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros((0, 2))
+        qi = np.concatenate(qi); j = np.concatenate(j)
+        self.examined += len(qi)
+        delta = self.wrap(self.positions[j] - points[qi])
+        d2 = delta[:, 0] ** 2 + delta[:, 1] ** 2
+        keep = d2 <= radius ** 2
+        if not include_center:
+            keep &= d2 > 0
+        return qi[keep], j[keep], delta[keep]
+
+    def nearest_distance(self, radius: float, max_radius: float = None) -> np.ndarray:
+        """
+        Returns the distance of every indexed point to its nearest other point, inf if there is none.
+        The search starts at radius and doubles it for the points left without any neighbour, up to
+        max_radius, the points with no other point within max_radius being left at inf. By default
+        max_radius is the half-diagonal of the torus, so that only points alone in their group are.
+        """
+        distance = np.full(len(self), np.inf)
+        todo = np.arange(len(self))
+        half_diagonal = self.dim_env * math.sqrt(2) / 2
+        max_radius = half_diagonal if max_radius is None else min(max_radius, half_diagonal)
+        radius = min(radius, max_radius)
+        while len(todo) > 0:
+            qi, _, delta = self.query(self.positions[todo], radius, include_center=False, groups=self.groups[todo])
+            np.minimum.at(distance, todo[qi], np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2))
+            todo = todo[np.isinf(distance[todo])]
+            if radius >= max_radius:
+                break
+            radius = min(2 * radius, max_radius)
+        return distance
@@ -0,0 +1,163 @@
+from clusters import AggregationMetrics
+from contacts import ContactHistory
+from recorder import TrajectoryRecorder, Trajectories, save_arrays, load_arrays
+from typing import Dict, List, Set, Tuple
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+
+# catalog columns set when a run is created, any other parameter being kept in its config
+PARAMETERS = ('attractive_w', 'repulsive_w', 'align_w', 'test_n', 'seed', 'n_agents', 'dim_env', 'backend')
+# catalog columns set when a run is finished
+SUMMARY = ('stop_step', 'converged', 'final_largest_cluster', 'final_n_clusters', 'final_nn_distance',
+           'final_order_parameter', 'wall_time')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    attractive_w REAL, repulsive_w REAL, align_w REAL, test_n INTEGER, seed INTEGER, n_agents INTEGER, dim_env REAL,
+    backend TEXT NOT NULL DEFAULT 'agent',
+    status TEXT NOT NULL DEFAULT 'running',
+    stop_step INTEGER, converged INTEGER, final_largest_cluster INTEGER, final_n_clusters INTEGER,
+    final_nn_distance REAL, final_order_parameter REAL, wall_time REAL,
+    created TEXT, config TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_weights ON runs (attractive_w, repulsive_w, align_w, test_n);
+"""
+
+
+class StoredRun():
+    """
+    Catalog entry of one run of an ExperimentStore. The arrays of the run are only read, and
+    memory-mapped, when one of metrics, trajectories or contacts is called.
+    """
+    def __init__(self, path: str, row: dict) -> None:
+        self.path = path
+        self.run_id = row['run_id']
+        self.params = row
+        self.config = json.loads(row['config']) if row['config'] else {}
+
+    def __getitem__(self, column: str):
+        return self.params[column]
+
+    def __repr__(self) -> str:
+        return f"StoredRun({', '.join(f'{k}={self.params[k]}' for k in ('run_id',) + PARAMETERS[:4])})"
+
+    def metrics(self) -> Dict[str, np.memmap]:
+        """Returns the series of AggregationMetrics.series"""
+        return load_arrays(os.path.join(self.path, 'metrics'))
+
+    def trajectories(self) -> Trajectories:
+        """Returns the recorded trajectories, None if they were not kept"""
+        path = os.path.join(self.path, 'trajectories')
+        return Trajectories(path) if os.path.isdir(path) else None
+
+    def contacts(self) -> ContactHistory:
+        """Returns the contact history, None if it was not kept"""
+        path = os.path.join(self.path, 'contacts')
+        return ContactHistory(path) if os.path.isdir(path) else None
+
+
+class ExperimentStore():
+    """
+    Directory of simulation runs with a SQLite catalog of their parameters, seeds and summary metrics.
+
+    Every run gets a directory runs/<run_id> of its own, holding its metric series and trajectories
+    as one .npy file per array and its contact history in the layout of ContactRecorder, so runs
+    executing concurrently never write to the same file. Queries go through the catalog and return
+    StoredRun views whose arrays are memory-mapped on demand, so thousands of runs can be selected
+    and analysed without loading them all.
+    Only finished runs are returned by queries. Finishing a run supersedes the earlier finished runs
+    of the same weights, replicate and backend, so a rerun replaces the previous one.
+    """
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(os.path.join(root, 'runs'), exist_ok=True)
+        # concurrent writers wait for each other's short transactions instead of failing
+        self.db = sqlite3.connect(os.path.join(root, 'catalog.sqlite'), timeout=60)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        # catalogs created before runs recorded their backend only hold agent-based runs
+        if 'backend' not in [row['name'] for row in self.db.execute('PRAGMA table_info(runs)')]:
+            with self.db:
+                self.db.execute("ALTER TABLE runs ADD COLUMN backend TEXT NOT NULL DEFAULT 'agent'")
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM runs WHERE status = 'done'").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+    def run_path(self, run_id: int) -> str:
+        return os.path.join(self.root, 'runs', f'{run_id:06d}')
+
+    def contacts_path(self, run_id: int) -> str:
+        """Returns the directory a ContactRecorder of the run streams to"""
+        return os.path.join(self.run_path(run_id), 'contacts')
+
+    def create_run(self, **params) -> int:
+        """Adds a running run to the catalog and returns its id, parameters outside PARAMETERS going to its config"""
+        columns = [p for p in PARAMETERS if p in params]
+        config = {k: v for k, v in params.items() if k not in PARAMETERS}
+        with self.db:
+            cursor = self.db.execute(
+                f"INSERT INTO runs ({', '.join(columns)}, created, config) VALUES ({', '.join('?' * (len(columns) + 2))})",
+                [params[p] for p in columns] + [time.strftime('%Y-%m-%dT%H:%M:%S'), json.dumps(config)])
+        run_id = cursor.lastrowid
+        os.makedirs(self.run_path(run_id), exist_ok=True)
+        return run_id
+
+    def finish_run(self, run_id: int, metrics: AggregationMetrics, recorder: TrajectoryRecorder = None,
+                   wall_time: float = None) -> None:
+        """Writes the metric series and optionally the trajectories of a run, then records its summary"""
+        series = metrics.series()
+        save_arrays(os.path.join(self.run_path(run_id), 'metrics'), series)
+        if recorder is not None:
+            save_arrays(os.path.join(self.run_path(run_id), 'trajectories'), recorder.arrays())
+
+        def last(field):
+            return series[field][-1].item() if len(metrics) > 0 else None
+        summary = [last('step'), int(metrics.converged), last('largest_cluster'), last('n_clusters'),
+                   last('nn_distance'), last('order_parameter'), wall_time]
+        with self.db:
+            self.db.execute("UPDATE runs SET status = 'superseded' WHERE status = 'done' AND run_id != ? AND "
+                            "(attractive_w, repulsive_w, align_w, test_n, backend) IS "
+                            "(SELECT attractive_w, repulsive_w, align_w, test_n, backend FROM runs WHERE run_id = ?)",
+                            (run_id, run_id))
+            self.db.execute(f"UPDATE runs SET status = 'done', {', '.join(f'{c} = ?' for c in SUMMARY)} WHERE run_id = ?",
+                            summary + [run_id])
+
+    def runs(self, **where) -> List[StoredRun]:
+        """
+        Returns the finished runs matching every filter, ordered by weights, replicate and id.
+        Args:
+            where: catalog columns mapped to a value, a list of accepted values or a (low, high)
+                   tuple of inclusive bounds, either of which may be None.
+        """
+        clauses = ["status = 'done'"]; args = []
+        for column, value in where.items():
+            if column not in ('run_id',) + PARAMETERS + SUMMARY:
+                raise ValueError(f'Unknown catalog column {column}, it must be among {("run_id",) + PARAMETERS + SUMMARY}')
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    clauses.append(f'{column} >= ?'); args.append(low)
+                if high is not None:
+                    clauses.append(f'{column} <= ?'); args.append(high)
+            elif isinstance(value, (list, set)):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})"); args.extend(value)
+            elif value is None:
+                clauses.append(f'{column} IS NULL')
+            else:
+                clauses.append(f'{column} = ?'); args.append(value)
+        rows = self.db.execute(f"SELECT * FROM runs WHERE {' AND '.join(clauses)} "
+                               "ORDER BY attractive_w, repulsive_w, align_w, test_n, run_id", args)
+        return [StoredRun(self.run_path(row['run_id']), dict(row)) for row in rows]
+
+    def completed(self) -> Set[Tuple[float, float, float, int, str]]:
+        """Returns the (attractive_w, repulsive_w, align_w, test_n, backend) keys of the finished runs"""
+        rows = self.db.execute("SELECT attractive_w, repulsive_w, align_w, test_n, backend FROM runs WHERE status = 'done'")
+        return set(map(tuple, rows))
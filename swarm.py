@@ -0,0 +1,155 @@
+from environment import WormEnvironment
+from profiling import StepProfiler, phase
+from typing import Dict, Tuple
+import numpy as np
+
+
+class WormSwarm():
+    """
+    Struct-of-arrays population of solitary worms.
+
+    Positions and headings are kept in contiguous NumPy arrays, pheromone molecules in the
+    environment's PheromonePool, and every
+    rule of SolitaryWorm (sensing, emission, alignment, attraction, repulsion and the random
+    heading) is applied to all worms in one batched pass. Unlike RandomActivation, the update is
+    synchronous: every worm sees the state of its neighbours at the beginning of the step.
+    """
+    def __init__(self, env: WormEnvironment, positions: np.ndarray, angles: np.ndarray, rng: np.random.Generator,
+                  speed: float = 5, align_dist: float = 5, align_w: float = 0.2, sensing_range: float = 100,
+                  attractive_w: float = 0.2, repulsive_w: float = 0.2, decay_rate: float = 0.1,
+                  profiler: StepProfiler = None) -> None:
+        self.env = env
+        self.profiler = profiler
+        self.rng = rng
+        self.pos = np.array(positions, dtype=float).reshape(-1, 2)
+        self.angle = np.array(angles, dtype=float)
+        self.vel = np.zeros(self.pos.shape)
+        self.speed = speed
+        self.align_dist = align_dist
+        self.sensing_range = sensing_range
+        self.decay_rate = decay_rate
+        # spatial indexes are sized to the largest query radius
+        self.cell_size = max(align_dist, sensing_range)
+
+        if align_w + attractive_w + repulsive_w <= 1:
+            self.align_w = align_w
+            self.attractive_w = attractive_w
+            self.repulsive_w = repulsive_w
+        else:
+            raise Exception(f'The sum of the alignment, attraction and repulsion weights is {align_w + attractive_w + repulsive_w} but it must be <1.0')
+
+        self.index_worms()
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        return {'pos': self.pos.copy(), 'angle': self.angle.copy(), 'vel': self.vel.copy()}
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        self.pos = np.array(state['pos'], dtype=float)
+        self.angle = np.array(state['angle'], dtype=float)
+        self.vel = np.array(state['vel'], dtype=float)
+        self.index_worms()
+
+    def close(self) -> None:
+        pass
+
+    def diffuse_pheromone(self, rng: np.random.Generator) -> None:
+        """Advances the pheromones by one step"""
+        self.env.diffuse_pheromone(rng)
+
+    def index_worms(self) -> None:
+        self.env.set_index('worm', self.pos, cell_size=self.cell_size)
+
+    def sense_pheromone(self, attractive: bool) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the weighted centroid of the sensed pheromone of one kind and whether any was sensed, per worm"""
+        if self.env.pheromone_field:
+            field = self.env.attractive_field if attractive else self.env.repulsive_field
+            return field.centroid(self.pos, self.sensing_range)
+
+        qi, delta, w = self.env.get_pheromone_many(self.pos, self.sensing_range, attractive)
+        return pheromone_centroid(self.pos, qi, delta, w)
+
+    def emit_pheromone(self) -> None:
+        if self.env.pheromone_field:
+            self.env.attractive_field.deposit(self.pos, quantity=1)
+            self.env.repulsive_field.deposit(self.pos, quantity=1)
+            return
+        self.env.pheromones.emit_many(self.pos, attractive=True, speed=10, quantity=1, decay_rate=self.decay_rate)
+        self.env.pheromones.emit_many(self.pos, attractive=False, speed=1, quantity=1, decay_rate=self.decay_rate)
+
+    def align(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the mean heading of the worms within align_dist and their number, per worm"""
+        index = self.env.indexes['worm'][0]
+        qi, j, _ = index.query(self.pos, self.align_dist, include_center=False)
+        return mean_heading(qi, self.angle[j], len(self))
+
+    def move(self, attraction_pos: np.ndarray, attracted: np.ndarray,
+              repulsion_pos: np.ndarray, repulsed: np.ndarray) -> None:
+        random_angle = self.rng.random(len(self)) * np.pi * 2
+        align_angle, n_neighbors = self.align()
+        self.angle = steer(self.pos, align_angle, n_neighbors > 0, attraction_pos, attracted, repulsion_pos, repulsed,
+                           random_angle, self.align_w, self.attractive_w, self.repulsive_w)
+
+        self.vel[:, 0] = np.cos(self.angle) * self.speed
+        self.vel[:, 1] = np.sin(self.angle) * self.speed
+        self.pos = (self.pos + self.vel) % self.env.dim_env
+        self.index_worms()
+
+    def step(self) -> None:
+        if not self.env.pheromone_field:
+            with phase(self.profiler, 'index'):
+                self.env.index_pheromones(self.cell_size)
+        with phase(self.profiler, 'sense'):
+            attraction_pos, attracted = self.sense_pheromone(attractive=True)
+            repulsion_pos, repulsed = self.sense_pheromone(attractive=False)
+        with phase(self.profiler, 'emit'):
+            self.emit_pheromone()
+        with phase(self.profiler, 'move'):
+            self.move(attraction_pos, attracted, repulsion_pos, repulsed)
+
+
+def pheromone_centroid(pos: np.ndarray, qi: np.ndarray, delta: np.ndarray, w: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the quantity-weighted centroid of the molecules matched to every position and whether any was.
+    Args:
+        pos: (N, 2) positions.
+        qi: index of the position each matched molecule belongs to.
+        delta: (K, 2) displacements of the molecules from their position.
+        w: (K,) quantities of the molecules.
+    """
+    n = len(pos)
+    total = np.bincount(qi, weights=w, minlength=n)
+    sensed = np.bincount(qi, minlength=n) > 0
+    total[~sensed] = 1
+    centroid = pos.copy()
+    centroid[:, 0] += np.bincount(qi, weights=w * delta[:, 0], minlength=n) / total
+    centroid[:, 1] += np.bincount(qi, weights=w * delta[:, 1], minlength=n) / total
+    return centroid, sensed
+
+
+def mean_heading(qi: np.ndarray, angles: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the mean of the neighbour angles matched to each of n worms and their number"""
+    count = np.bincount(qi, minlength=n)
+    angle_sum = np.bincount(qi, weights=angles, minlength=n)
+    return angle_sum / np.maximum(count, 1), count
+
+
+def steer(pos: np.ndarray, align_angle: np.ndarray, aligned: np.ndarray, attraction_pos: np.ndarray, attracted: np.ndarray,
+          repulsion_pos: np.ndarray, repulsed: np.ndarray, random_angle: np.ndarray,
+          align_w, attractive_w, repulsive_w) -> np.ndarray:
+    """
+    Returns the new headings of SolitaryWorm.move: the weighted mean of the alignment, attraction,
+    repulsion and random angles, weights of the missing stimuli being left out. The weights are
+    scalars or per-worm arrays.
+    """
+    attr_angle = np.arctan2(attraction_pos[:, 1] - pos[:, 1], attraction_pos[:, 0] - pos[:, 0])
+    rep_angle = np.arctan2(pos[:, 1] - repulsion_pos[:, 1], pos[:, 0] - repulsion_pos[:, 0])
+
+    random_w = 1 - align_w - attractive_w - repulsive_w
+    alw = aligned * align_w
+    atw = attracted * attractive_w
+    rew = repulsed * repulsive_w
+    total_w = alw + atw + rew + random_w
+    return (alw * align_angle + atw * attr_angle + rew * rep_angle + random_w * random_angle) / total_w
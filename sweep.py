@@ -0,0 +1,166 @@
+from tqdm import tqdm
+
+import run
+from config import MANIFEST
+from store import ExperimentStore
+import numpy as np
+import itertools
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+
+def valid_weights(attractive_w, repulsive_w, align_w):
+    """
+    Whether the weights sum to less than 1, in the summation order of SolitaryWorm.__init__. The
+    worm accepts a sum of exactly 1, but a worm sensing nothing then has no heading.
+    """
+    return align_w + attractive_w + repulsive_w < 1 - 1e-9
+
+def run_seed(base_seed, attractive_w, repulsive_w, align_w, test_n):
+    """Deterministic seed of one run, independent of the order in which the sweep dispatches it"""
+    key = [base_seed, test_n] + [round(w * 1e6) for w in (attractive_w, repulsive_w, align_w)]
+    return int(np.random.SeedSequence(key).generate_state(1)[0])
+
+def read_manifest(manifest):
+    """Returns the (attractive_w, repulsive_w, align_w, test_n, backend) keys of the runs recorded as completed"""
+    done = set()
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    # records written before runs had a backend are agent-based runs
+                    done.add((r['attractive_w'], r['repulsive_w'], r['align_w'], r['test_n'], r.get('backend', 'agent')))
+    return done
+
+def open_store(root):
+    return ExperimentStore(root) if root is not None else None
+
+def output_paths(record, store_contacts, store_root):
+    """Adds the paths of the outputs of a run to its manifest record, unless they went to an ExperimentStore"""
+    keys = (record['attractive_w'], record['repulsive_w'], record['align_w'], record['test_n'], record['backend'])
+    if store_root is not None:
+        record['store'] = store_root
+        return record
+    record['metrics_path'] = run.metrics_path(*keys)
+    if store_contacts:
+        record['contacts_path'] = run.contacts_path(*keys)
+    return record
+
+def failure(job, error):
+    """Returns the record of a job that raised error, which is reported but not written to the manifest"""
+    attractive_w, repulsive_w, align_w, test_n, seed = job[:5]
+    return {'attractive_w': attractive_w, 'repulsive_w': repulsive_w, 'align_w': align_w, 'test_n': test_n,
+            'seed': seed, 'backend': job[8], 'error': repr(error)}
+
+def run_job(job):
+    attractive_w, repulsive_w, align_w, test_n, seed, store_contacts, convergence, store_root, backend = job
+    store = open_store(store_root)
+    start = time.perf_counter()
+    try:
+        metrics = run.main(attractive_w, repulsive_w, align_w, test_n, seed=seed, positions_path=None,
+                           store_contacts=store_contacts, convergence=convergence, store=store, backend=backend)
+    except Exception as e:
+        return failure(job, e)
+    finally:
+        if store is not None:
+            store.close()
+    record = {'attractive_w': attractive_w, 'repulsive_w': repulsive_w, 'align_w': align_w, 'test_n': test_n,
+              'seed': seed, 'backend': backend, 'wall_time': time.perf_counter() - start,
+              'stop_step': int(metrics.values['step'][-1]), 'converged': metrics.converged}
+    return output_paths(record, store_contacts, store_root)
+
+def run_batch_job(jobs):
+    """Runs the replicates of one weight combination as a single ensemble, returning one record per replicate"""
+    attractive_w, repulsive_w, align_w = jobs[0][:3]
+    store_contacts, convergence, store_root, backend = jobs[0][5:]
+    store = open_store(store_root)
+    start = time.perf_counter()
+    try:
+        metrics = run.main_batch(attractive_w, repulsive_w, align_w, [j[3] for j in jobs], [j[4] for j in jobs],
+                                 store_contacts, convergence, store)
+    except Exception as e:
+        return [failure(job, e) for job in jobs]
+    finally:
+        if store is not None:
+            store.close()
+    wall_time = (time.perf_counter() - start) / len(jobs)
+    records = []
+    for (_, _, _, test_n, seed, _, _, _, _), m in zip(jobs, metrics):
+        record = {'attractive_w': attractive_w, 'repulsive_w': repulsive_w, 'align_w': align_w, 'test_n': test_n,
+                  'seed': seed, 'backend': backend, 'wall_time': wall_time, 'batched': True,
+                  'stop_step': int(m.values['step'][-1]), 'converged': m.converged}
+        records.append(output_paths(record, store_contacts, store_root))
+    return records
+
+def main(attractive_ws, repulsive_ws, align_ws, replicates, jobs=1, base_seed=0, manifest=MANIFEST, store_contacts=False,
+         batch=False, convergence=None, store=None, backend='agent'):
+    """
+    Runs every valid weight combination replicates times on a backend over a process pool.
+    Runs of the same backend already recorded in the manifest whose outputs still exist are
+    skipped, so an interrupted sweep resumes where it stopped. Each completed run is appended to
+    the manifest with its seed, backend and wall time. With batch, which requires the vectorized
+    backend, the replicates of a combination run together as one WormEnsemble. convergence holds
+    the arguments of the ConvergenceCriterion stopping every run early, the step each run stopped
+    at being recorded in the manifest. A run that fails is reported and left out of the manifest,
+    so the other runs go on and a resumed sweep retries it.
+    With store, the directory of an ExperimentStore, the outputs of every run are added to the store
+    and the runs it has already finished are skipped.
+    """
+    if batch and backend != 'vectorized':
+        raise ValueError(f'Batched replicates run on the vectorized backend, not the {backend} backend')
+    combinations = list(itertools.product(attractive_ws, repulsive_ws, align_ws))
+    invalid = [c for c in combinations if not valid_weights(*c)]
+    for c in invalid:
+        print(f'Skipping attractive_w={c[0]} repulsive_w={c[1]} align_w={c[2]}: the weights sum to 1 or more')
+
+    if store is not None:
+        catalog = ExperimentStore(store)
+        done = catalog.completed()
+        catalog.close()
+    else:
+        done = read_manifest(manifest)
+    todo = []; skipped = 0
+    for (a, r, l), t in itertools.product([c for c in combinations if c not in invalid], range(replicates)):
+        key = (a, r, l, t, backend)
+        if key in done and (store is not None or os.path.exists(run.metrics_path(*key))
+                            and (not store_contacts or os.path.isdir(run.contacts_path(*key)))):
+            skipped += 1
+            continue
+        todo.append((a, r, l, t, run_seed(base_seed, a, r, l, t), store_contacts, convergence, store, backend))
+    print(f'{len(todo)} runs to do, {skipped} already done')
+
+    os.makedirs(os.path.dirname(manifest) or '.', exist_ok=True)
+    if store is None:
+        os.makedirs('aggr_data', exist_ok=True)
+    with Pool(jobs) as pool, open(manifest, 'a') as f:
+        if batch:
+            groups = {}
+            for job in todo:
+                groups.setdefault(job[:3], []).append(job)
+            results = pool.imap_unordered(run_batch_job, list(groups.values()))
+            total = len(groups)
+        else:
+            results = ([record] for record in pool.imap_unordered(run_job, todo))
+            total = len(todo)
+        failed = 0
+        for records in tqdm(results, total=total):
+            for record in records:
+                if 'error' in record:
+                    failed += 1
+                    print(f"Run attractive_w={record['attractive_w']} repulsive_w={record['repulsive_w']} "
+                          f"align_w={record['align_w']} test_n={record['test_n']} failed: {record['error']}", file=sys.stderr)
+                    continue
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+    if failed > 0:
+        print(f'{failed} runs failed', file=sys.stderr)
+    return failed
+
+
+if __name__ == "__main__":
+    import cli
+    raise SystemExit(1 if cli.main(['sweep'] + sys.argv[1:]) else 0)
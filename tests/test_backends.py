@@ -0,0 +1,58 @@
+from model import WormSimulator
+import numpy as np
+import pytest
+
+SEEDS = range(6)
+STEPS = 80
+# steps at the end of the runs whose metrics are averaged
+TAIL = 40
+
+
+def late_means(backend):
+    """Returns the largest cluster and nearest-neighbour distance of every seed, averaged over the last TAIL steps"""
+    means = []
+    for seed in SEEDS:
+        model = WormSimulator(n_agents=30, dim_env=120, max_steps=STEPS, multispot=False, num_spots=1, clustered=False,
+                              attractive_w=0.4, repulsive_w=0.1, align_w=0.3, seed=seed, backend=backend,
+                              spatial_index=True, store_contacts=False)
+        for _ in range(STEPS):
+            model.step()
+        series = model.metrics.series()
+        means.append([series['largest_cluster'][-TAIL:].mean(), series['nn_distance'][-TAIL:].mean()])
+    return np.array(means)
+
+def test_vectorized_backend_aggregates_like_the_agent_backend():
+    # the vectorized backend updates the worms synchronously, so runs of the same seed only agree in distribution
+    agent = late_means('agent')
+    vectorized = late_means('vectorized')
+    difference = np.abs(agent.mean(axis=0) - vectorized.mean(axis=0))
+    standard_error = np.sqrt(agent.var(axis=0, ddof=1) / len(agent) + vectorized.var(axis=0, ddof=1) / len(vectorized))
+    assert np.all(difference <= 3 * standard_error)
+    # and both aggregate: the largest cluster grows beyond the initial one
+    assert agent[:, 0].mean() > 12 and vectorized[:, 0].mean() > 12
+
+@pytest.mark.parametrize('backend', ['agent', 'vectorized'])
+@pytest.mark.parametrize('multispot', [False, True])
+def test_clustered_start_is_shared_by_the_backends(backend, multispot):
+    kwargs = dict(n_agents=20, dim_env=100, max_steps=10, multispot=multispot, num_spots=1, clustered=True,
+                  attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=1)
+    positions = WormSimulator(**kwargs, backend=backend).worm_positions()
+    np.testing.assert_array_equal(positions, WormSimulator(**kwargs, backend='agent').worm_positions())
+    assert len(set(map(tuple, positions))) == 20
+    # every worm starts within a square of side 2 * ceil(sqrt(20) / 2) around the spot, across the torus
+    spread = np.abs((positions - positions[0] + 50) % 100 - 50)
+    assert spread.max() <= 6
+
+def test_decomposed_backend_does_not_depend_on_the_workers():
+    runs = []
+    for workers in (1, 2):
+        model = WormSimulator(n_agents=30, dim_env=120, max_steps=20, multispot=False, num_spots=1, clustered=False,
+                              attractive_w=0.4, repulsive_w=0.1, align_w=0.3, seed=2, backend='decomposed',
+                              workers=workers, strips=2, store_contacts=False)
+        for _ in range(20):
+            model.step()
+        model.close()
+        runs.append((model.worm_positions(), model.metrics.series()))
+    np.testing.assert_array_equal(runs[0][0], runs[1][0])
+    for field, series in runs[0][1].items():
+        np.testing.assert_array_equal(runs[1][1][field], series)
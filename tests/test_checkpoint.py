@@ -0,0 +1,42 @@
+from model import WormSimulator
+import io
+import numpy as np
+import pytest
+
+# every step is stable, so the run converges once patience steps have been counted
+CONVERGENCE = dict(metric='largest_cluster', window=5, tolerance=1, patience=20)
+
+
+def make_model(backend):
+    return WormSimulator(n_agents=30, dim_env=150, max_steps=100, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.2, align_w=0.3, backend=backend, seed=4,
+                         store_contacts=False, convergence=CONVERGENCE)
+
+def run_until_converged(model):
+    while not model.metrics.converged:
+        model.step()
+    return model.schedule.steps
+
+@pytest.mark.parametrize('backend', ['agent', 'vectorized'])
+def test_restored_run_continues_identically(backend):
+    model = make_model(backend)
+    for _ in range(20):
+        model.step()
+    buffer = io.BytesIO()
+    model.save_checkpoint(buffer)
+    buffer.seek(0)
+    restored = WormSimulator.restore(buffer)
+
+    assert restored.criterion.stable_steps == model.criterion.stable_steps > 0
+    assert run_until_converged(restored) == run_until_converged(model)
+    np.testing.assert_array_equal(restored.worm_positions(), model.worm_positions())
+    for field, series in model.metrics.series().items():
+        np.testing.assert_array_equal(restored.metrics.series()[field], series)
+
+def test_converged_flag_is_restored():
+    model = make_model('vectorized')
+    run_until_converged(model)
+    buffer = io.BytesIO()
+    model.save_checkpoint(buffer)
+    buffer.seek(0)
+    assert WormSimulator.restore(buffer).metrics.converged
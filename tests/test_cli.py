@@ -0,0 +1,62 @@
+import cli
+import pytest
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replaces the handler of every command but batch by one recording its arguments"""
+    calls = []
+    commands = dict(cli.COMMANDS)
+    for name, (add_arguments, _, help) in cli.COMMANDS.items():
+        if name == 'batch':
+            continue
+
+        def handler(args, name=name):
+            if getattr(args, 'a', None) == -1:
+                raise RuntimeError('failing job')
+            calls.append((name, args))
+        commands[name] = (add_arguments, handler, help)
+    monkeypatch.setattr(cli, 'COMMANDS', commands)
+    return calls
+
+def test_subcommands_parse_their_arguments(calls):
+    assert cli.main(['run', '-a', '0.1', '-r', '0.2', '-l', '0.3', '-t', '4', '-b', 'vectorized', '--stop-metric', 'largest_cluster']) == 0
+    name, args = calls[-1]
+    assert name == 'run' and (args.a, args.r, args.l, args.t, args.backend) == (0.1, 0.2, 0.3, 4, 'vectorized')
+    assert cli.convergence_arguments(args) == dict(metric='largest_cluster', window=50, tolerance=0.02, patience=50)
+
+    cli.main(['sweep', '-a', '0.1', '0.2', '-r', '0.2', '-l', '0.1', '0.3', '-n', '3', '--batch', '-b', 'vectorized'])
+    name, args = calls[-1]
+    assert name == 'sweep' and args.a == [0.1, 0.2] and args.l == [0.1, 0.3] and args.n == 3 and args.batch
+    assert cli.convergence_arguments(args) is None
+
+    cli.main(['render', '--headless', 'out.mp4', '--skip', '2'])
+    name, args = calls[-1]
+    assert name == 'render' and args.headless == 'out.mp4' and args.skip == 2 and args.input == 'position_data.npz'
+
+    with pytest.raises(SystemExit):
+        cli.main(['run', '-a', '0.1'])
+    with pytest.raises(SystemExit):
+        cli.main(['run', '-a', '0.1', '-r', '0.2', '-l', '0.3', '-t', '0', '-b', 'gpu'])
+
+def write_jobs(tmp_path, lines):
+    path = tmp_path / 'jobs.txt'
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+def test_batch_counts_the_failed_jobs(calls, tmp_path):
+    jobs = write_jobs(tmp_path, [
+        '# a comment and a blank line are skipped', '',
+        'run -a 0.1 -r 0.2 -l 0.3 -t 0',
+        'run -a 0.1',                         # malformed, argparse exits
+        'run -a -1 -r 0.2 -l 0.3 -t 0',       # the handler raises
+        'batch other_jobs.txt',               # nested batch
+        'analyse -a 0.1 -r 0.2 -l 0.3',
+    ])
+    assert cli.main(['batch', jobs]) == 3
+    assert [name for name, _ in calls] == ['run', 'analyse']
+
+def test_batch_stops_on_error(calls, tmp_path):
+    jobs = write_jobs(tmp_path, ['run -a 0.1 -r 0.2 -l 0.3 -t 0', 'batch other_jobs.txt', 'run -a 0.2 -r 0.2 -l 0.3 -t 0'])
+    assert cli.main(['batch', jobs, '--stop-on-error']) == 1
+    assert [args.a for _, args in calls] == [0.1]
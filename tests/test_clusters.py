@@ -0,0 +1,64 @@
+from clusters import AggregationMetrics, cluster_labels, cluster_sizes, largest_cluster
+from contacts import edges_to_dense
+import analyse_cluster
+import numpy as np
+
+
+def bfs_clusters(graph, interval):
+    """find_clusters as analyse_cluster implemented it before cluster_labels"""
+    to_visit = set(range(len(graph)))
+    clusters = []
+    while len(to_visit) > 0:
+        node = to_visit.pop()
+        bfs_list = set([node,])
+        cluster = set([node,])
+        while len(bfs_list) > 0:
+            bfs_node = bfs_list.pop()
+            if bfs_node in to_visit:
+                to_visit.remove(bfs_node)
+            connected = [i for i in range(len(graph[bfs_node])) if graph[bfs_node][i] >= interval]
+            connected = [c for c in connected if c in to_visit]
+            bfs_list.update(connected)
+            cluster.update(connected)
+        clusters.append(cluster)
+    return clusters
+
+def random_steps(n_steps, n_agents, seed):
+    rng = np.random.default_rng(seed)
+    steps = []
+    for t in range(n_steps):
+        # from no contact to one giant cluster
+        n_edges = rng.integers(0, 2 * n_agents)
+        i, j = rng.integers(0, n_agents, (2, n_edges))
+        keep = i < j
+        steps.append(np.stack((i[keep], j[keep]), axis=1).astype(np.uint32))
+    return steps
+
+def test_cluster_labels_match_bfs():
+    steps = random_steps(40, 30, seed=0)
+    labels = cluster_labels(steps, 30)
+    for t, edges in enumerate(steps):
+        expected = {frozenset(c) for c in bfs_clusters(edges_to_dense(edges, 30), 1)}
+        found = {}
+        for worm, label in enumerate(labels[t]):
+            found.setdefault(label, set()).add(worm)
+        assert {frozenset(c) for c in found.values()} == expected
+        # labelled by the smallest worm of their cluster
+        assert all(label == min(found[label]) for label in found)
+        assert largest_cluster(labels)[t] == max(len(c) for c in expected)
+        assert cluster_sizes(labels)[t].sum() == len(expected)
+
+def test_find_clusters_and_metrics_agree_with_bfs():
+    steps = random_steps(10, 25, seed=1)
+    metrics = AggregationMetrics(25)
+    for t, edges in enumerate(steps):
+        dense = edges_to_dense(edges, 25)
+        expected = {frozenset(c) for c in bfs_clusters(dense, 1)}
+        assert {frozenset(c) for c in analyse_cluster.find_clusters(dense, 1)} == expected
+        metrics.update(t, edges, np.nan)
+        assert metrics.values['largest_cluster'][-1] == max(len(c) for c in expected)
+        assert metrics.values['n_clusters'][-1] == len(expected)
+
+def test_empty_steps_have_singleton_clusters():
+    labels = cluster_labels([np.zeros((0, 2), dtype=np.uint32)] * 3, 5)
+    np.testing.assert_array_equal(labels, np.tile(np.arange(5), (3, 1)))
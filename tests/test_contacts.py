@@ -0,0 +1,72 @@
+from contacts import ContactRecorder, ContactHistory
+from model import WormSimulator
+import numpy as np
+import os
+
+
+def random_steps(n_steps, n_agents=10, seed=0):
+    rng = np.random.default_rng(seed)
+    steps = []
+    for _ in range(n_steps):
+        i, j = np.nonzero(np.triu(rng.random((n_agents, n_agents)) < 0.2, k=1))
+        steps.append(np.stack((i, j), axis=1).astype(np.uint32))
+    return steps
+
+def test_recorder_flushes_chunks_read_back_by_history(tmp_path):
+    path = str(tmp_path / 'contacts')
+    steps = random_steps(8)
+    recorder = ContactRecorder(10, path, chunk_steps=3)
+    for t, edges in enumerate(steps):
+        recorder.append(edges)
+        # every chunk of 3 steps is on disk, the rest is buffered
+        flushed = (t + 1) // 3 * 3
+        assert len(np.fromfile(os.path.join(path, 'offsets.i64'), dtype=np.int64)) == flushed
+        assert os.path.getsize(os.path.join(path, 'edges.u32')) == 8 * sum(len(e) for e in steps[:flushed])
+        assert len(recorder) == t + 1
+    recorder.close()
+
+    history = ContactHistory(path)
+    assert len(history) == 8 and history.n_agents == 10
+    for t, edges in enumerate(steps):
+        np.testing.assert_array_equal(history[t], edges)
+    np.testing.assert_array_equal(history[-1], steps[-1])
+    dense = history.dense(2)
+    assert np.array_equal(dense, dense.T) and np.all(np.diag(dense) == 1)
+    assert dense.sum() == 10 + 2 * len(steps[2])
+
+def make_model(**kwargs):
+    return WormSimulator(n_agents=30, dim_env=100, max_steps=20, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=4, **kwargs)
+
+def test_restored_run_streams_the_whole_history(tmp_path):
+    full = make_model()
+    for _ in range(12):
+        full.step()
+    model = make_model()
+    for _ in range(5):
+        model.step()
+    checkpoint = str(tmp_path / 'checkpoint.npz')
+    model.save_checkpoint(checkpoint)
+    path = str(tmp_path / 'contacts')
+    restored = WormSimulator.restore(checkpoint, contacts_path=path)
+    for _ in range(7):
+        restored.step()
+    restored.contacts.close()
+
+    history = ContactHistory(path)
+    assert len(history) == len(full.contacts) == 13
+    for t in range(13):
+        np.testing.assert_array_equal(history[t], full.contacts[t])
+
+def test_agent_worms_keep_their_index_across_steps():
+    model = make_model(spatial_index=False)
+    previous = model.worm_positions()
+    for _ in range(5):
+        model.step()
+        positions = model.worm_positions()
+        # row i moves by one step of worm i, at speed 5, rather than jumping to another worm
+        delta = np.abs((positions - previous + 50) % 100 - 50)
+        assert np.all(np.hypot(delta[:, 0], delta[:, 1]) <= 5 + 1e-9)
+        previous = positions
+    ids = [a.unique_id for a in model.worms()]
+    assert ids == sorted(ids)
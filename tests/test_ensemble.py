@@ -0,0 +1,45 @@
+from ensemble import WormEnsemble
+from model import WormSimulator
+import numpy as np
+
+
+def make_ensemble(seeds):
+    return WormEnsemble(seeds, n_agents=30, dim_env=150, attractive_w=0.3, repulsive_w=0.2, align_w=0.3)
+
+def test_retired_replicates_leave_the_others_unchanged():
+    full = make_ensemble([1, 2, 3])
+    retiring = make_ensemble([1, 2, 3])
+    for step in range(25):
+        if step == 10:
+            retiring.retire([1])
+        full.step()
+        retiring.step()
+
+    assert list(retiring.active) == [0, 2]
+    assert len(retiring.metrics[1]) == 11
+    assert np.all(retiring.pheromones.replica[:len(retiring.pheromones)] != 1)
+    for r in (0, 2):
+        np.testing.assert_array_equal(retiring.worm_positions(r), full.worm_positions(r))
+        for field, series in full.metrics[r].series().items():
+            np.testing.assert_array_equal(retiring.metrics[r].series()[field], series)
+
+def test_replicates_follow_single_vectorized_runs():
+    ensemble = WormEnsemble([1, 2], n_agents=30, dim_env=150, attractive_w=0.3, repulsive_w=0.2, align_w=0.3,
+                            store_contacts=True)
+    models = [WormSimulator(n_agents=30, dim_env=150, max_steps=30, multispot=False, num_spots=1, clustered=False,
+                            attractive_w=0.3, repulsive_w=0.2, align_w=0.3, backend='vectorized', seed=seed)
+              for seed in (1, 2)]
+    for _ in range(30):
+        ensemble.step()
+        for model in models:
+            model.step()
+
+    for r, model in enumerate(models):
+        np.testing.assert_array_equal(ensemble.worm_positions(r), model.worm_positions())
+        for field, series in model.metrics.series().items():
+            np.testing.assert_array_equal(ensemble.metrics[r].series()[field], series)
+        for t in range(len(model.contacts)):
+            np.testing.assert_array_equal(ensemble.contacts[r][t], model.contacts[t])
+        trajectories = ensemble.recorders[r].columns()
+        for column, values in model.recorder.columns().items():
+            np.testing.assert_array_equal(trajectories[column], values)
@@ -0,0 +1,95 @@
+import explore
+from explore import AdaptiveExplorer, simplex_grid
+import multiprocessing.dummy
+import json
+import numpy as np
+
+
+def fake_score_job(job):
+    """Scores a run with its attractive weight, so the boundary at threshold t lies on the plane attractive_w = t"""
+    attractive_w, repulsive_w, align_w, test_n, seed, spacing = job[:6]
+    return {'attractive_w': attractive_w, 'repulsive_w': repulsive_w, 'align_w': align_w, 'test_n': test_n,
+            'seed': seed, 'spacing': spacing, 'backend': job[9] if len(job) > 9 else 'agent', 'wall_time': 0, 'stop_step': 0,
+            'score': attractive_w}
+
+def scored_explorer(**kwargs):
+    explorer = AdaptiveExplorer(spacing=0.25, replicates=2, threshold=0.3, **kwargs)
+    for job in explorer.initial_jobs():
+        explorer.add(fake_score_job(job))
+    return explorer
+
+def test_disagreeing_edges_cross_the_threshold_between_neighbours():
+    explorer = scored_explorer()
+    points, spacing, mean, _, _ = explorer.summary()
+    i, j, length = explorer.disagreeing_edges()
+    assert len(i) > 0
+    assert np.all((mean[i] >= 0.3) != (mean[j] >= 0.3))
+    assert np.all(np.abs(points[i] - points[j]).max(axis=1) <= 0.25 + 1e-9)
+    np.testing.assert_allclose(length, 0.25)
+    # the only crossing is between attractive_w 0.25 and 0.5
+    assert set(np.round(points[np.concatenate((i, j)), 0], 6)) == {0.25, 0.5}
+
+def test_refine_splits_the_disagreeing_edges():
+    explorer = scored_explorer(round_runs=1000, budget=10000)
+    i, _, _ = explorer.disagreeing_edges()
+    jobs = explorer.refine()
+    assert len(jobs) > 0
+    for attractive_w, repulsive_w, align_w, test_n, seed, spacing in jobs:
+        assert attractive_w == 0.375 and spacing == 0.125 and test_n in (0, 1)
+    # every midpoint gets replicates runs once, however many edges share it
+    midpoints = {job[:3] for job in jobs}
+    assert len(jobs) == 2 * len(midpoints)
+    assert explorer.disagreeing_edges()[0].size == 0
+
+def test_refine_respects_the_budget_and_replicates_noisy_points():
+    explorer = scored_explorer(round_runs=3)
+    assert len(explorer.refine()) == 3
+    noisy = AdaptiveExplorer(spacing=0.25, replicates=2, max_std=0.1, max_replicates=4)
+    for job in noisy.initial_jobs():
+        record = fake_score_job(job)
+        # the replicates of the origin disagree, those of every other point agree
+        record['score'] = 0.6 if job[:3] == (0.0, 0.0, 0.0) and job[3] == 1 else 0.2
+        noisy.add(record)
+    jobs = noisy.refine()
+    assert [job[:4] for job in jobs] == [(0.0, 0.0, 0.0, 2), (0.0, 0.0, 0.0, 3)]
+
+def test_boundary_interpolates_the_threshold():
+    boundary = scored_explorer().boundary()
+    assert len(boundary) > 0
+    np.testing.assert_allclose(boundary[:, 0], 0.3)
+
+def test_resume_runs_the_missing_grid_points_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(explore, 'Pool', multiprocessing.dummy.Pool)
+    monkeypatch.setattr(explore, 'score_job', fake_score_job)
+    samples = tmp_path / 'samples.jsonl'
+    grid = AdaptiveExplorer(spacing=0.25, replicates=2).initial_jobs()
+    # an exploration interrupted after a third of its initial grid
+    with open(samples, 'w') as f:
+        for job in grid[:len(grid) // 3]:
+            f.write(json.dumps(fake_score_job(job)) + '\n')
+
+    explorer = AdaptiveExplorer(spacing=0.25, replicates=2, threshold=0.3, budget=len(grid) + 10, round_runs=10)
+    explorer.explore(jobs=1, samples_path=str(samples))
+    with open(samples) as f:
+        runs = [json.loads(line) for line in f]
+    keys = [(r['attractive_w'], r['repulsive_w'], r['align_w'], r['test_n']) for r in runs]
+    assert len(keys) == len(set(keys)) == len(grid) + 10
+    assert set(job[:4] for job in grid) <= set(keys)
+    assert all(len(explorer.points[p]['scores']) == 2 for p in simplex_grid(0.25))
+
+def test_explore_runs_and_resumes_on_its_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(explore, 'Pool', multiprocessing.dummy.Pool)
+    monkeypatch.setattr(explore, 'score_job', fake_score_job)
+    samples = tmp_path / 'samples.jsonl'
+    grid = AdaptiveExplorer(spacing=0.25, replicates=2).initial_jobs()
+    # a complete agent-based exploration of the grid does not count towards a vectorized one
+    with open(samples, 'w') as f:
+        for job in grid:
+            f.write(json.dumps(fake_score_job(job)) + '\n')
+
+    explorer = AdaptiveExplorer(spacing=0.25, replicates=2, threshold=0.3, budget=len(grid))
+    explorer.explore(jobs=1, samples_path=str(samples), backend='vectorized')
+    with open(samples) as f:
+        runs = [json.loads(line) for line in f]
+    assert [r['backend'] for r in runs] == ['agent'] * len(grid) + ['vectorized'] * len(grid)
+    assert explorer.n_runs == len(grid)
@@ -0,0 +1,39 @@
+from environment import PheromoneField
+from model import WormSimulator
+import numpy as np
+import pytest
+
+
+def test_field_decays_by_decay_rate_every_step():
+    field = PheromoneField(50, resolution=1, speed=3, decay_rate=0.1)
+    field.deposit(np.array([[10.2, 20.7], [30.5, 5.5], [10.2, 20.7]]))
+    total = field.grid.sum()
+    for _ in range(5):
+        field.step()
+        np.testing.assert_allclose(field.grid.sum(), total * 0.9, rtol=1e-9)
+        total = field.grid.sum()
+
+def test_diffusion_conserves_mass_and_spreads_it():
+    field = PheromoneField(50, resolution=1, speed=3, decay_rate=0)
+    field.deposit((25.5, 25.5), quantity=4)
+    for _ in range(10):
+        field.step()
+    np.testing.assert_allclose(field.grid.sum(), 4, rtol=1e-9)
+    assert field.grid.max() < 4 and (field.grid > 1e-3).sum() > 1
+    # the spread matches the variance of 10 random steps of length 3, 45 along each axis
+    x = (np.arange(50) + 0.5)[:, None]
+    variance = ((x - 25.5) ** 2 * field.grid).sum() / field.grid.sum()
+    np.testing.assert_allclose(variance, 45, rtol=0.05)
+
+def test_centroid_wraps_across_the_edge():
+    field = PheromoneField(50, resolution=1, speed=1, decay_rate=0)
+    field.deposit(np.array([[0.5, 10.5], [49.5, 10.5]]))
+    centroid, sensed = field.centroid(np.array([[0.2, 10.2], [25.0, 10.0]]), radius=3)
+    assert sensed[0] and not sensed[1]
+    # halfway between the cells on either side of x = 0, not in the middle of the environment
+    np.testing.assert_allclose(centroid[0], (0, 10.5), atol=1e-9)
+
+def test_decomposed_backend_rejects_the_field():
+    with pytest.raises(ValueError):
+        WormSimulator(n_agents=5, dim_env=100, max_steps=1, multispot=False, num_spots=1, clustered=False,
+                      attractive_w=0.3, repulsive_w=0.3, align_w=0.3, pheromone_field=True, backend='decomposed')
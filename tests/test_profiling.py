@@ -0,0 +1,39 @@
+from profiling import StepProfiler, phase
+from model import WormSimulator
+from contextlib import nullcontext
+import numpy as np
+import pytest
+
+
+def make_model(backend, profile):
+    return WormSimulator(n_agents=30, dim_env=120, max_steps=10, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=0, backend=backend, profile=profile)
+
+@pytest.mark.parametrize('backend', ['agent', 'vectorized'])
+def test_phases_add_up_to_the_step_time(backend):
+    model = make_model(backend, profile=True)
+    for _ in range(10):
+        model.step()
+    per_step = model.profiler.per_step()
+    assert list(per_step['step']) == list(range(1, 11))
+    phases = sum(per_step[name] for name in model.profiler.timers if name != 'total')
+    total = per_step['total']
+    # the phases do not overlap and leave only bookkeeping outside them
+    assert np.all(phases <= total)
+    assert phases.sum() >= 0.9 * total.sum()
+    for name, seconds in model.profiler.timers.items():
+        assert seconds == pytest.approx(per_step[name].sum())
+    assert 'contacts' in model.profiler.table()
+
+def test_phase_does_nothing_without_a_profiler(monkeypatch):
+    assert isinstance(phase(None, 'move'), nullcontext)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the profiler was used while profiling is off')
+    for method in ('phase', 'add_time', 'count', 'end_step'):
+        monkeypatch.setattr(StepProfiler, method, fail)
+    for backend in ('agent', 'vectorized'):
+        model = make_model(backend, profile=False)
+        assert model.profiler is None and model.env.profiler is None
+        for _ in range(3):
+            model.step()
@@ -0,0 +1,89 @@
+from recorder import TrajectoryRecorder, Trajectories, COLUMNS, WORM, save_arrays
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def recorder():
+    recorder = TrajectoryRecorder()
+    rng = np.random.default_rng(0)
+    for step in range(20):
+        n = 5 + step
+        recorder.record(step, np.arange(n), np.full(n, WORM), rng.random((n, 2)), rng.random((n, 2)))
+    return recorder
+
+def check_steps(trajectories, recorder):
+    columns = recorder.columns()
+    offsets = np.concatenate(([0], np.cumsum([n for _, n in recorder.step_rows])))
+    for i, step in enumerate(trajectories.steps):
+        rows = trajectories.at_step(int(step))
+        for c in COLUMNS:
+            np.testing.assert_array_equal(rows[c], columns[c][offsets[i]:offsets[i + 1]])
+    for c in COLUMNS:
+        np.testing.assert_array_equal(trajectories[c], columns[c])
+
+def test_blocks_are_sliced_across_their_boundaries(recorder, tmp_path):
+    path = str(tmp_path / 'positions.npz')
+    recorder.save(path, block_rows=7)
+    trajectories = Trajectories(path)
+    assert len(trajectories.block_offsets) > 2
+    check_steps(trajectories, recorder)
+    trajectories.close()
+
+def test_unblocked_files_and_directories_are_read(recorder, tmp_path):
+    path = str(tmp_path / 'positions.npz')
+    np.savez_compressed(path, **recorder.arrays())
+    check_steps(Trajectories(path), recorder)
+    save_arrays(str(tmp_path / 'trajectories'), recorder.arrays())
+    check_steps(Trajectories(str(tmp_path / 'trajectories')), recorder)
+
+def make_model(collection):
+    from model import WormSimulator
+    return WormSimulator(n_agents=20, dim_env=100, max_steps=10, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=0, collection=collection)
+
+def test_policy_skips_what_it_does_not_collect(monkeypatch):
+    from recorder import CollectionPolicy
+    calls = []
+    record = TrajectoryRecorder.record
+    monkeypatch.setattr(TrajectoryRecorder, 'record', lambda self, step, *args: (calls.append(step), record(self, step, *args)))
+    model = make_model(CollectionPolicy(kinds=()))
+    for _ in range(5):
+        model.step()
+    assert calls == [] and len(model.recorder) == 0
+
+    model = make_model(CollectionPolicy(kinds=('worm',), interval=3))
+    for _ in range(9):
+        model.step()
+    assert calls == [0, 3, 6, 9]
+    assert set(model.recorder.columns()['kind']) == {WORM}
+
+def test_runs_without_positions_collect_nothing(tmp_path, monkeypatch):
+    import run
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(run, 'MAX_STEPS', 3)
+    monkeypatch.setattr(run, 'NUM_AGENTS', 10)
+    recorders = []
+    run_experiment = run.run_experiment
+
+    def recording_run_experiment(*args, **kwargs):
+        outputs = run_experiment(*args, **kwargs)
+        recorders.append(outputs[0])
+        return outputs
+    monkeypatch.setattr(run, 'run_experiment', recording_run_experiment)
+    run.main(0.3, 0.3, 0.3, 0, seed=1, positions_path=None)
+    run.main(0.3, 0.3, 0.3, 0, seed=1, positions_path=str(tmp_path / 'positions.npz'),
+             collection=dict(kinds=('worm',), interval=2))
+    assert len(recorders[0]) == 0
+    # run_experiment steps up to MAX_STEPS + 1
+    assert [step for step, _ in recorders[1].step_rows] == [0, 2, 4] and len(recorders[1]) == 30
+
+def test_collection_options_of_the_command_line():
+    import argparse
+    import cli
+    parser = argparse.ArgumentParser()
+    cli.add_run_arguments(parser)
+    weights = ['-a', '0.1', '-r', '0.1', '-l', '0.1', '-t', '0']
+    assert cli.collection_arguments(parser.parse_args(weights)) is None
+    args = parser.parse_args(weights + ['--collect-kinds', 'worm', '--collect-interval', '5', '--pheromone-histogram'])
+    assert cli.collection_arguments(args) == dict(kinds=['worm'], interval=5, pheromone_mode='histogram', bins=50)
@@ -0,0 +1,58 @@
+from recorder import TrajectoryRecorder, Trajectories, WORM, ATTRACTIVE
+from model import WormSimulator
+import show_trajectories
+import numpy as np
+
+
+class FakeFfmpeg():
+    """Stands for the ffmpeg process, keeping the raw frames written to its pipe"""
+    def __init__(self, command, stdin):
+        self.command = command
+        self.stdin = self
+        self.frames = []
+        self.returncode = None
+        FakeFfmpeg.last = self
+
+    def write(self, data):
+        self.frames.append(data)
+
+    def close(self):
+        pass
+
+    def wait(self):
+        self.returncode = 0
+
+
+def test_headless_renderer_streams_one_frame_per_rendered_step(tmp_path, monkeypatch):
+    model = WormSimulator(n_agents=10, dim_env=60, max_steps=5, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=0)
+    for _ in range(5):
+        model.step()
+    path = str(tmp_path / 'positions.npz')
+    model.recorder.save(path)
+    monkeypatch.setattr(show_trajectories.subprocess, 'Popen', FakeFfmpeg)
+
+    trajectories = Trajectories(path)
+    assert trajectories.dim_env == 60
+    renderer = show_trajectories.HeadlessRenderer(trajectories, scale=2, skip=2)
+    renderer.run(str(tmp_path / 'video.mp4'))
+    ffmpeg = FakeFfmpeg.last
+    assert '120x120' in ffmpeg.command
+    # steps 0, 2 and 4 of the 6 recorded
+    assert len(ffmpeg.frames) == 3
+    assert all(len(frame) == 120 * 120 * 3 for frame in ffmpeg.frames)
+    frame = np.frombuffer(ffmpeg.frames[0], dtype=np.uint8).reshape(120, 120, 3)
+    assert frame.any()
+
+def test_worms_are_grouped_in_the_plane(tmp_path):
+    recorder = TrajectoryRecorder(dim_env=100)
+    # two worms 8 apart, and two worms 2 apart across the edge x = 0
+    positions = np.array([[50, 50], [58, 50], [1, 20], [99, 20]], dtype=float)
+    recorder.record(0, np.arange(4), np.full(4, WORM), positions, np.zeros((4, 2)))
+    recorder.record(0, [4], [ATTRACTIVE], [[20, 80]], [[0, 0]])
+    path = str(tmp_path / 'positions.npz')
+    recorder.save(path)
+    frame = show_trajectories.HeadlessRenderer(Trajectories(path), scale=1).draw(0)
+    assert tuple(frame[50, 50]) == tuple(frame[50, 58]) == show_trajectories.GREEN
+    assert tuple(frame[20, 1]) == tuple(frame[20, 99]) == show_trajectories.RED
+    assert tuple(frame[80, 20]) == show_trajectories.BLUE
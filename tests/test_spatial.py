@@ -0,0 +1,105 @@
+from spatial import PeriodicCellList
+from contacts import contact_pairs
+from model import WormSimulator
+import numpy as np
+import pytest
+
+
+def torus_distances(a, b, dim_env):
+    delta = np.abs(a[:, None] - b[None])
+    delta = np.minimum(delta, dim_env - delta)
+    return np.sqrt((delta ** 2).sum(axis=2))
+
+@pytest.mark.parametrize('cell_size', [7, 20, 60])
+def test_query_matches_brute_force(cell_size):
+    rng = np.random.default_rng(0)
+    points = rng.random((300, 2)) * 100
+    queries = np.concatenate((rng.random((50, 2)) * 100, points[:10]))
+    index = PeriodicCellList(points, 100, cell_size)
+    distance = torus_distances(queries, points, 100)
+    for radius in (5, 20, 45):
+        qi, j, delta = index.query(queries, radius, include_center=False)
+        expected = np.nonzero((distance <= radius) & (distance > 0))
+        assert sorted(zip(qi, j)) == sorted(zip(*expected))
+        np.testing.assert_allclose(np.hypot(delta[:, 0], delta[:, 1]), distance[qi, j])
+        found, _ = index.query_point(queries[3], radius)
+        assert sorted(found) == list(np.nonzero(distance[3] <= radius)[0])
+
+def test_groups_only_match_their_own_points():
+    rng = np.random.default_rng(1)
+    points = rng.random((200, 2)) * 50
+    groups = rng.integers(0, 3, 200)
+    index = PeriodicCellList(points, 50, 10, groups, 3)
+    qi, j, _ = index.query(points, 10, groups=groups)
+    distance = torus_distances(points, points, 50)
+    expected = np.nonzero((distance <= 10) & (groups[:, None] == groups[None]))
+    assert sorted(zip(qi, j)) == sorted(zip(*expected))
+
+def test_nearest_distance_matches_brute_force():
+    rng = np.random.default_rng(2)
+    points = rng.random((60, 2)) * 200
+    distance = torus_distances(points, points, 200)
+    np.fill_diagonal(distance, np.inf)
+    np.testing.assert_allclose(PeriodicCellList(points, 200, 20).nearest_distance(20), distance.min(axis=1))
+    # beyond max_radius the points are left without a nearest neighbour
+    capped = PeriodicCellList(points, 200, 20).nearest_distance(5, max_radius=15)
+    expected = distance.min(axis=1)
+    np.testing.assert_allclose(capped, np.where(expected <= 15, expected, np.inf))
+    assert np.isinf(capped).any() and np.isfinite(capped).any()
+
+@pytest.mark.parametrize('torus', [False, True])
+def test_contact_pairs_match_brute_force(torus):
+    rng = np.random.default_rng(3)
+    points = rng.random((150, 2)) * 100
+    if torus:
+        distance = torus_distances(points, points, 100)
+    else:
+        distance = np.sqrt(((points[:, None] - points[None]) ** 2).sum(axis=2))
+    i, j = contact_pairs(PeriodicCellList(points, 100, 20), 20, torus)
+    expected = np.nonzero(np.triu(distance <= 20, k=1))
+    assert list(zip(i, j)) == list(zip(*expected))
+
+
+def make_model(spatial_index):
+    return WormSimulator(n_agents=40, dim_env=200, max_steps=40, multispot=False, num_spots=1, clustered=False,
+                         attractive_w=0.3, repulsive_w=0.3, align_w=0.3, seed=3, spatial_index=spatial_index)
+
+def test_indexed_neighbours_match_get_neighbors():
+    model = make_model(True)
+    for _ in range(5):
+        model.step()
+    env = model.env
+    for worm in model.schedule.agents:
+        # moving worms after the index was built exercises its search margin
+        env.move_agent(worm, env.torus_adj((worm.pos[0] + 3, worm.pos[1] - 4)))
+    for worm in model.schedule.agents:
+        indexed = env.get_neighbor_worms(worm.pos, 10, False)
+        scanned = [a for a in env.get_neighbors(worm.pos, 10, False) if a.is_worm]
+        assert indexed == scanned
+
+def test_spatial_index_does_not_change_the_run():
+    runs = [make_model(spatial_index) for spatial_index in (False, True)]
+    for _ in range(40):
+        for model in runs:
+            model.step()
+    np.testing.assert_array_equal(runs[0].worm_positions(), runs[1].worm_positions())
+    # the metrics average over the worms in another order
+    for field, series in runs[0].metrics.series().items():
+        np.testing.assert_allclose(runs[1].metrics.series()[field], series, rtol=1e-12)
+
+def test_get_pheromone_views_match_the_pool():
+    model = make_model(True)
+    for _ in range(5):
+        model.step()
+    pool = model.env.pheromones
+    pos = model.schedule.agents[0].pos
+    attractive, repulsive = model.env.get_pheromone_kinds(pos, 20)
+    views = model.env.get_pheromone(pos, 20)
+    assert [p.unique_id for p in views] == [p.unique_id for p in attractive + repulsive]
+    delta = (pool.pos[:len(pool)] - pos + 100) % 200 - 100
+    inside = (delta ** 2).sum(axis=1) <= 20 ** 2
+    for kind, attr in ((attractive, True), (repulsive, False)):
+        expected = np.nonzero(inside & (pool.attractive[:len(pool)] == attr))[0]
+        assert [p.unique_id for p in kind] == list(pool.ids[expected])
+        assert all(p.attractive == attr and not p.is_worm for p in kind)
+        np.testing.assert_array_equal([p.quantity for p in kind], pool.quantity[expected])
@@ -0,0 +1,101 @@
+from store import ExperimentStore
+from clusters import AggregationMetrics
+from contacts import ContactRecorder
+from recorder import TrajectoryRecorder, WORM
+import numpy as np
+import pytest
+import sqlite3
+
+
+def make_metrics(steps, n_agents=4, converged=False):
+    metrics = AggregationMetrics(n_agents)
+    for step in range(steps):
+        # the first step + 1 worms in one cluster
+        labels = np.arange(n_agents)
+        labels[:step + 1] = 0
+        metrics.record(step, labels, 1.0 + step, 0.5)
+    metrics.converged = converged
+    return metrics
+
+def add_run(store, attractive_w, test_n=0, backend='agent', steps=3, **params):
+    run_id = store.create_run(attractive_w=attractive_w, repulsive_w=0.1, align_w=0.2, test_n=test_n, seed=7,
+                              n_agents=4, dim_env=100, backend=backend, **params)
+    store.finish_run(run_id, make_metrics(steps), wall_time=1.5)
+    return run_id
+
+def test_runs_are_added_and_queried(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    ids = [add_run(store, a, t) for a in (0.1, 0.2, 0.3) for t in (0, 1)]
+    add_run(store, 0.2, 0, backend='vectorized')
+    # a run still running is not returned
+    store.create_run(attractive_w=0.4, repulsive_w=0.1, align_w=0.2, test_n=0)
+    assert len(store) == 7
+
+    runs = store.runs(attractive_w=0.2, backend='agent')
+    assert [r['test_n'] for r in runs] == [0, 1]
+    assert [r.run_id for r in store.runs(attractive_w=[0.1, 0.3], test_n=1)] == [ids[1], ids[5]]
+    assert len(store.runs(attractive_w=(0.15, None))) == 5
+    assert len(store.runs(attractive_w=(None, 0.15), backend=['vectorized'])) == 0
+    run = store.runs(run_id=ids[0])[0]
+    assert run['seed'] == 7 and run['stop_step'] == 2 and run['final_largest_cluster'] == 3
+    assert run['final_nn_distance'] == 3.0 and run['wall_time'] == 1.5 and run['converged'] == 0
+    with pytest.raises(ValueError):
+        store.runs(colour='red')
+    store.close()
+
+def test_finishing_a_run_replaces_the_same_key(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    first = add_run(store, 0.1, steps=3)
+    other_backend = add_run(store, 0.1, backend='vectorized')
+    # the second run is only returned once it has finished
+    second = store.create_run(attractive_w=0.1, repulsive_w=0.1, align_w=0.2, test_n=0, backend='agent', checkpoint='warm.npz')
+    assert [r.run_id for r in store.runs(backend='agent')] == [first]
+    store.finish_run(second, make_metrics(5))
+    runs = store.runs(attractive_w=0.1)
+    assert sorted(r.run_id for r in runs) == sorted([second, other_backend])
+    assert store.runs(run_id=second)[0].config == {'checkpoint': 'warm.npz'}
+    assert store.completed() == {(0.1, 0.1, 0.2, 0, 'agent'), (0.1, 0.1, 0.2, 0, 'vectorized')}
+    store.close()
+
+def test_metrics_contacts_and_trajectories_are_read_back(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    run_id = store.create_run(attractive_w=0.1, repulsive_w=0.1, align_w=0.2, test_n=0)
+    contacts = ContactRecorder(4, store.contacts_path(run_id), chunk_steps=2)
+    edges = [np.array([[0, 1]], dtype=np.uint32), np.zeros((0, 2), dtype=np.uint32), np.array([[0, 1], [2, 3]], dtype=np.uint32)]
+    for e in edges:
+        contacts.append(e)
+    contacts.close()
+    recorder = TrajectoryRecorder(dim_env=100)
+    recorder.record(0, np.arange(4), np.full(4, WORM), np.ones((4, 2)), np.zeros((4, 2)))
+    metrics = make_metrics(3)
+    store.finish_run(run_id, metrics, recorder)
+    store.close()
+
+    run = ExperimentStore(str(tmp_path)).runs()[0]
+    for field, series in metrics.series().items():
+        np.testing.assert_array_equal(run.metrics()[field], series)
+    history = run.contacts()
+    assert len(history) == 3
+    for t, e in enumerate(edges):
+        np.testing.assert_array_equal(history[t], e)
+    trajectories = run.trajectories()
+    assert len(trajectories) == 1 and trajectories.dim_env == 100
+    np.testing.assert_array_equal(trajectories['x'], np.ones(4, dtype=np.float32))
+
+    other = ExperimentStore(str(tmp_path))
+    bare = add_run(other, 0.2)
+    assert other.runs(run_id=bare)[0].contacts() is None and other.runs(run_id=bare)[0].trajectories() is None
+
+def test_catalogs_without_backend_hold_agent_runs(tmp_path):
+    db = sqlite3.connect(str(tmp_path / 'catalog.sqlite'))
+    db.execute("CREATE TABLE runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, attractive_w REAL, repulsive_w REAL, "
+               "align_w REAL, test_n INTEGER, seed INTEGER, n_agents INTEGER, dim_env REAL, "
+               "status TEXT NOT NULL DEFAULT 'running', stop_step INTEGER, converged INTEGER, final_largest_cluster INTEGER, "
+               "final_n_clusters INTEGER, final_nn_distance REAL, final_order_parameter REAL, wall_time REAL, "
+               "created TEXT, config TEXT)")
+    db.execute("INSERT INTO runs (attractive_w, repulsive_w, align_w, test_n, status) VALUES (0.1, 0.1, 0.2, 0, 'done')")
+    db.commit()
+    db.close()
+    store = ExperimentStore(str(tmp_path))
+    assert store.completed() == {(0.1, 0.1, 0.2, 0, 'agent')}
+    store.close()
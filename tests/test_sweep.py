@@ -0,0 +1,35 @@
+import sweep
+from clusters import AggregationMetrics
+import multiprocessing.dummy
+import json
+import numpy as np
+
+
+def test_valid_weights_rejects_a_sum_of_one():
+    assert sweep.valid_weights(0.2, 0.2, 0.5)
+    assert not sweep.valid_weights(0.2, 0.2, 0.6)
+    assert not sweep.valid_weights(0.3, 0.2, 0.5)
+    assert not sweep.valid_weights(0.5, 0.5, 0.5)
+
+def test_a_failing_run_does_not_stop_the_sweep(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sweep, 'Pool', multiprocessing.dummy.Pool)
+    ran = []
+
+    def fake_main(attractive_w, repulsive_w, align_w, test_n, **kwargs):
+        if attractive_w == 0.1:
+            raise ZeroDivisionError('float division by zero')
+        ran.append((attractive_w, test_n))
+        metrics = AggregationMetrics(2)
+        metrics.record(0, np.zeros(2, dtype=int), 1.0, 1.0)
+        return metrics
+    monkeypatch.setattr(sweep.run, 'main', fake_main)
+
+    manifest = str(tmp_path / 'manifest.jsonl')
+    failed = sweep.main([0.1, 0.2], [0.2], [0.3], replicates=2, manifest=manifest)
+    assert failed == 2
+    assert sorted(ran) == [(0.2, 0), (0.2, 1)]
+    with open(manifest) as f:
+        records = [json.loads(line) for line in f]
+    # the failed runs are retried when the sweep resumes
+    assert sorted((r['attractive_w'], r['test_n']) for r in records) == [(0.2, 0), (0.2, 1)]